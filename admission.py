@@ -0,0 +1,150 @@
+"""Admission control and load shedding for expensive routes.
+
+Each endpoint listed in ADMISSION_LIMITS gets:
+
+- a concurrency limit (a bulkhead) with a short bounded wait queue. A
+  request waits at most `wait` seconds for a slot; if the queue is full or
+  the wait runs out it gets a fast 503 instead of holding a worker thread
+  and DB connection;
+- an optional per-client token bucket (`per_client`: burst, per seconds)
+  keyed by user id, or by remote address for anonymous requests. Clients
+  over their budget get 429.
+
+Both responses carry Retry-After. Routes without limits are never
+touched, so cheap pages keep working while contribute/vote/login are
+saturated. State is kept in process memory: limits apply per worker
+process, so size them for one worker's share of the DB pool.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from flask import Response, g, jsonify, request
+from flask_login import current_user
+
+DEFAULT_LIMITS = {
+    'login': {'methods': ('POST',), 'concurrency': 4, 'queue': 8, 'wait': 0.5, 'per_client': (20, 60)},
+    'contribute': {'methods': ('POST',), 'concurrency': 8, 'queue': 16, 'wait': 0.5, 'per_client': (6, 60)},
+    'submit_vote': {'methods': ('POST',), 'concurrency': 8, 'queue': 16, 'wait': 0.5, 'per_client': (10, 60)},
+    # Every hop comes from a handful of gateway addresses, so no per-client budget
+    'ussd_callback': {'methods': ('POST',), 'concurrency': 8, 'queue': 32, 'wait': 1.0},
+}
+
+class Bulkhead:
+    """Concurrency limit with a bounded number of waiters"""
+
+    def __init__(self, concurrency, queue, wait):
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.queue = queue
+        self.wait = wait
+        self.lock = threading.Lock()
+        self.waiting = 0
+
+    def acquire(self):
+        if self.slots.acquire(blocking=False):
+            return True
+        with self.lock:
+            if self.waiting >= self.queue:
+                return False
+            self.waiting += 1
+        try:
+            return self.slots.acquire(timeout=self.wait)
+        finally:
+            with self.lock:
+                self.waiting -= 1
+
+    def release(self):
+        self.slots.release()
+
+class TokenBuckets:
+    """Per-key token buckets; the least recently seen keys are dropped past max_keys"""
+
+    def __init__(self, burst, period, max_keys=10000):
+        self.capacity = float(burst)
+        self.rate = burst / period
+        self.max_keys = max_keys
+        self.lock = threading.Lock()
+        self.buckets = OrderedDict()
+
+    def take(self, key):
+        """Return 0 if a token was taken, otherwise seconds until one is available"""
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.pop(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / self.rate
+            self.buckets[key] = (tokens, now)
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        return wait
+
+class AdmissionControl:
+    """Flask extension applying per-endpoint concurrency limits and per-client rate limits"""
+
+    def __init__(self, app=None):
+        self.limits = {}
+        self.bulkheads = {}
+        self.buckets = {}
+        self.per_client = True
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['admission'] = self
+        if not app.config.setdefault('ADMISSION_ENABLED', True):
+            return
+        self.per_client = app.config.setdefault('ADMISSION_PER_CLIENT', True)
+        self.configure(app.config.setdefault('ADMISSION_LIMITS', DEFAULT_LIMITS))
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+
+    def configure(self, limits):
+        """Replace the per-endpoint limits (resets queues and buckets)"""
+        self.limits = {endpoint: dict(limit) for endpoint, limit in limits.items()}
+        self.bulkheads = {endpoint: Bulkhead(limit['concurrency'], limit.get('queue', 0), limit.get('wait', 0.5))
+                          for endpoint, limit in self.limits.items() if limit.get('concurrency')}
+        self.buckets = {endpoint: TokenBuckets(*limit['per_client'])
+                        for endpoint, limit in self.limits.items() if limit.get('per_client')}
+
+    def _client_key(self):
+        if current_user.is_authenticated:
+            return f'user:{current_user.id}'
+        return f'ip:{request.remote_addr}'
+
+    def _before_request(self):
+        limit = self.limits.get(request.endpoint)
+        if limit is None or request.method not in limit.get('methods', (request.method,)):
+            return None
+
+        # Cheap per-client check first, so abusive clients never take a slot
+        buckets = self.buckets.get(request.endpoint)
+        if buckets is not None and self.per_client:
+            wait = buckets.take(self._client_key())
+            if wait:
+                return self._reject(429, 'Too many requests, please slow down.', wait)
+
+        bulkhead = self.bulkheads.get(request.endpoint)
+        if bulkhead is not None:
+            if not bulkhead.acquire():
+                return self._reject(503, 'The service is busy, please try again shortly.', bulkhead.wait)
+            g._admission_bulkhead = bulkhead
+        return None
+
+    def _teardown_request(self, exc):
+        bulkhead = g.pop('_admission_bulkhead', None)
+        if bulkhead is not None:
+            bulkhead.release()
+
+    def _reject(self, status, message, retry_after):
+        if request.path.startswith('/api/') or request.accept_mimetypes.best == 'application/json':
+            response = jsonify({'error': message})
+        else:
+            response = Response(message, mimetype='text/plain')
+        response.status_code = status
+        response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+        return response
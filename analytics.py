@@ -0,0 +1,306 @@
+"""Per-chama contribution analytics over an in-memory columnar snapshot.
+
+A Snapshot holds a chama's contributions, hot and archived, as NumPy
+arrays (id, user_id, amount, timestamp, status and method codes) built
+from one bulk read. Every use refreshes it from the sync feed (see
+sync.py): contribution changes for the chama numbered past the snapshot's
+high-water mark are re-read by id and replace their old rows, and
+tombstones drop them, so status changes and deletions are seen as well as
+new rows. Archiving deletes hot rows, so a change in the chama's archive
+rebuilds the snapshot instead of applying those tombstones.
+
+Snapshots are immutable (a refresh makes a new one) and kept per process
+in an LRU bounded by MAX_SNAPSHOT_BYTES of arrays. The analytics
+functions take a snapshot and are vectorized over its arrays.
+"""
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import func
+
+from archive import archived_rows
+from extensions import db, metrics
+from models import Contribution, ContributionArchive, SyncChange
+from sync import stamp_pending
+
+MAX_SNAPSHOT_BYTES = 64 * 1024 * 1024
+REBUILD_CHANGES = 5000  # past this many changed rows a fresh read is cheaper
+STATUSES = ('pending', 'confirmed', 'rejected')
+RETENTION_MONTHS = 12
+MOVING_AVERAGE_WEEKS = (4, 12)
+RECENT_DAYS = 90
+
+class Snapshot:
+    """Columnar copy of one chama's contributions as of sync sequence `seq`"""
+
+    def __init__(self, chama_id, seq, archive_state, methods, ids, user_ids, amounts, times, statuses,
+                 method_codes):
+        self.chama_id = chama_id
+        self.seq = seq
+        self.archive_state = archive_state
+        self.methods = methods  # label of each method code
+        self.ids = ids
+        self.user_ids = user_ids
+        self.amounts = amounts
+        self.times = times  # seconds since the epoch
+        self.statuses = statuses  # index into STATUSES
+        self.method_codes = method_codes
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in (self.ids, self.user_ids, self.amounts, self.times,
+                                              self.statuses, self.method_codes))
+
+    def confirmed(self):
+        return self.statuses == STATUSES.index('confirmed')
+
+class SnapshotCache:
+    """LRU of snapshots by chama, bounded by the total size of their arrays"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.nbytes = 0
+
+    def get(self, chama_id):
+        with self.lock:
+            snapshot = self.entries.get(chama_id)
+            if snapshot is not None:
+                self.entries.move_to_end(chama_id)
+            return snapshot
+
+    def set(self, chama_id, snapshot):
+        with self.lock:
+            old = self.entries.pop(chama_id, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            self.entries[chama_id] = snapshot
+            self.nbytes += snapshot.nbytes
+            # The newest snapshot stays even if it alone is over budget
+            while self.nbytes > self.max_bytes and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def pop(self, chama_id):
+        with self.lock:
+            snapshot = self.entries.pop(chama_id, None)
+            if snapshot is not None:
+                self.nbytes -= snapshot.nbytes
+
+_snapshots = SnapshotCache(MAX_SNAPSHOT_BYTES)
+
+# Building
+
+def _columns(rows, methods):
+    """Arrays from (id, user_id, amount, contributed_at, status, payment_method) tuples.
+
+    Method labels not yet in `methods` are appended to it.
+    """
+    if not rows:
+        return (np.empty(0, np.int64), np.empty(0, np.int32), np.empty(0, np.float64), np.empty(0, np.int64),
+                np.empty(0, np.int8), np.empty(0, np.int8))
+    ids, user_ids, amounts, dates, statuses, payment_methods = zip(*rows)
+    times = np.array(dates, dtype='datetime64[us]').astype('datetime64[s]').astype(np.int64)
+    labels, codes = np.unique(np.array([method or '' for method in payment_methods]), return_inverse=True)
+    for label in labels:
+        if label not in methods:
+            methods.append(str(label))
+    method_codes = np.array([methods.index(label) for label in labels], np.int8)[codes]
+    status_codes = np.array([STATUSES.index(status) if status in STATUSES else -1 for status in statuses], np.int8)
+    return (np.array(ids, np.int64), np.array(user_ids, np.int32), np.array(amounts, np.float64), times,
+            status_codes, method_codes)
+
+def _hot_rows(chama_id, ids=None):
+    query = db.session.query(Contribution.id, Contribution.user_id, Contribution.amount,
+                             Contribution.contributed_at, Contribution.status, Contribution.payment_method)\
+        .filter(Contribution.chama_id == chama_id)
+    if ids is not None:
+        query = query.filter(Contribution.id.in_(ids))
+    return [tuple(row) for row in query]
+
+def _archive_state(chama_id):
+    # Archiving adds rows and account deletion rewrites them; either changes one of these
+    return tuple(db.session.query(func.count(ContributionArchive.id), func.max(ContributionArchive.id),
+                                  func.sum(ContributionArchive.row_count))
+                 .filter(ContributionArchive.chama_id == chama_id).one())
+
+def _high_water(chama_id):
+    return db.session.query(func.coalesce(func.max(SyncChange.seq), 0))\
+        .filter(SyncChange.chama_id == chama_id).scalar()
+
+def build_snapshot(chama_id):
+    """Read a chama's contributions into a new Snapshot"""
+    stamp_pending()
+    # Taken before the read: a change in between is read now and applied again later, which is harmless
+    seq = _high_water(chama_id)
+    archive_state = _archive_state(chama_id)
+    rows = _hot_rows(chama_id)
+    rows += [(row['id'], row['user_id'], row['amount'], row['contributed_at'], row['status'], row['payment_method'])
+             for row in archived_rows(chama_id)]
+    methods = []
+    return Snapshot(chama_id, seq, archive_state, methods, *_columns(rows, methods))
+
+def refresh_snapshot(snapshot):
+    """The snapshot with changes since its high-water mark applied; the same object if there were none"""
+    stamp_pending()
+    chama_id = snapshot.chama_id
+    if _archive_state(chama_id) != snapshot.archive_state:
+        return build_snapshot(chama_id)
+    changes = db.session.query(SyncChange.seq, SyncChange.entity, SyncChange.entity_id)\
+        .filter(SyncChange.chama_id == chama_id, SyncChange.seq > snapshot.seq).all()
+    if not changes:
+        return snapshot
+    changed = [entity_id for _, entity, entity_id in changes if entity == 'contribution']
+    if len(changed) > REBUILD_CHANGES:
+        return build_snapshot(chama_id)
+    seq = max(change_seq for change_seq, _, _ in changes)
+    if not changed:
+        return Snapshot(chama_id, seq, snapshot.archive_state, snapshot.methods, snapshot.ids, snapshot.user_ids,
+                        snapshot.amounts, snapshot.times, snapshot.statuses, snapshot.method_codes)
+
+    # Deleted rows simply aren't read back
+    keep = ~np.isin(snapshot.ids, changed)
+    methods = list(snapshot.methods)
+    fresh = _columns(_hot_rows(chama_id, changed), methods)
+    old = (snapshot.ids, snapshot.user_ids, snapshot.amounts, snapshot.times, snapshot.statuses,
+           snapshot.method_codes)
+    return Snapshot(chama_id, seq, snapshot.archive_state, methods,
+                    *(np.concatenate([column[keep], new]) for column, new in zip(old, fresh)))
+
+def get_snapshot(chama_id):
+    """An up-to-date snapshot for the chama, from this process's cache when possible"""
+    snapshot = _snapshots.get(chama_id)
+    metrics.record_cache('analytics_snapshot', snapshot is not None)
+    fresh = build_snapshot(chama_id) if snapshot is None else refresh_snapshot(snapshot)
+    if fresh is not snapshot:
+        _snapshots.set(chama_id, fresh)
+    return fresh
+
+# Analytics
+
+def _month_numbers(times):
+    """Months since January 1970"""
+    return times.astype('datetime64[s]').astype('datetime64[M]').astype(np.int64)
+
+def _week_numbers(times):
+    """Monday-based weeks since the epoch (1970-01-01 was a Thursday)"""
+    return (times // 86400 + 3) // 7
+
+def _month_start(number):
+    return np.datetime64(int(number), 'M').astype('datetime64[s]').item()
+
+def _week_start(number):
+    return np.datetime64(int(number) * 7 - 3, 'D').astype('datetime64[s]').item()
+
+def _now_seconds(now):
+    return int(np.datetime64(now or datetime.utcnow(), 's').astype(np.int64))
+
+def cohort_retention(snapshot, now=None, months=RETENTION_MONTHS):
+    """Share of members who contributed in each month after their first confirmed one.
+
+    Cohorts are the months of members' first confirmed contributions, the
+    latest `months` of them. Returns rows of (cohort start, size, [share
+    for months 0..months-1, None once in the future]).
+    """
+    mask = snapshot.confirmed()
+    if not mask.any():
+        return []
+    members, member_index = np.unique(snapshot.user_ids[mask], return_inverse=True)
+    month = _month_numbers(snapshot.times[mask])
+    first = np.full(len(members), np.iinfo(np.int64).max)
+    np.minimum.at(first, member_index, month)
+
+    offset = month - first[member_index]
+    # One count per member and month, however many payments they made in it
+    active = np.unique(member_index[offset < months] * months + offset[offset < months])
+    active_member, active_offset = active // months, active % months
+
+    cohorts, cohort_index = np.unique(first, return_inverse=True)
+    sizes = np.bincount(cohort_index, minlength=len(cohorts))
+    counts = np.bincount(cohort_index[active_member] * months + active_offset,
+                         minlength=len(cohorts) * months).reshape(len(cohorts), months)
+    shares = counts / sizes[:, None]
+    elapsed = _month_numbers(np.array([_now_seconds(now)]))[0] - cohorts
+
+    rows = []
+    for index in range(max(0, len(cohorts) - months), len(cohorts)):
+        cells = [float(share) if k <= elapsed[index] else None for k, share in enumerate(shares[index])]
+        rows.append((_month_start(cohorts[index]), int(sizes[index]), cells))
+    return rows
+
+def contribution_regularity(snapshot, frequency, now=None):
+    """How regularly members pay: a histogram of the share of periods paid, and payment gaps.
+
+    A member's share counts the periods from their first confirmed payment
+    to the current one in which they made any confirmed payment.
+    """
+    mask = snapshot.confirmed()
+    bins = np.linspace(0, 1, 11)
+    if not mask.any():
+        return {'bins': bins.tolist(), 'counts': [0] * 10, 'members': 0, 'gap_days': {}}
+    period_of = _week_numbers if frequency == 'weekly' else _month_numbers
+    members, member_index = np.unique(snapshot.user_ids[mask], return_inverse=True)
+    period = period_of(snapshot.times[mask])
+    first = np.full(len(members), np.iinfo(np.int64).max)
+    np.minimum.at(first, member_index, period)
+    current = period_of(np.array([_now_seconds(now)]))[0]
+
+    span = int(period.max() - period.min()) + 1
+    paid = np.bincount(np.unique(member_index * span + (period - period.min())) // span, minlength=len(members))
+    share = paid / np.maximum(current - first + 1, 1)
+    counts, _ = np.histogram(np.minimum(share, 1), bins=bins)
+
+    # Days between consecutive confirmed payments of the same member
+    order = np.lexsort((snapshot.times[mask], member_index))
+    times, owners = snapshot.times[mask][order], member_index[order]
+    gaps = np.diff(times)[owners[1:] == owners[:-1]] / 86400
+    gap_days = {f'p{q}': float(np.percentile(gaps, q)) for q in (25, 50, 75, 90)} if gaps.size else {}
+    return {'bins': bins.tolist(), 'counts': counts.tolist(), 'members': len(members), 'gap_days': gap_days}
+
+def moving_averages(snapshot, now=None, weeks=26, windows=MOVING_AVERAGE_WEEKS):
+    """Confirmed totals for each of the last `weeks` weeks with trailing moving averages"""
+    current = _week_numbers(np.array([_now_seconds(now)]))[0]
+    history = weeks + max(windows) - 1
+    oldest = current - history + 1
+    mask = snapshot.confirmed()
+    week = _week_numbers(snapshot.times[mask])
+    recent = (week >= oldest) & (week <= current)
+    totals = np.bincount(week[recent] - oldest, weights=snapshot.amounts[mask][recent], minlength=history)
+    averages = {window: np.convolve(totals, np.ones(window) / window, 'valid')[-weeks:].tolist()
+                for window in windows}
+    return {'weeks': [_week_start(number) for number in range(current - weeks + 1, current + 1)],
+            'totals': totals[-weeks:].tolist(), 'averages': averages}
+
+def method_mix(snapshot, since=None):
+    """Confirmed count and amount per payment method, largest amount first"""
+    mask = snapshot.confirmed()
+    if since is not None:
+        mask &= snapshot.times >= _now_seconds(since)
+    codes = snapshot.method_codes[mask]
+    counts = np.bincount(codes, minlength=len(snapshot.methods))
+    amounts = np.bincount(codes, weights=snapshot.amounts[mask], minlength=len(snapshot.methods))
+    total = amounts.sum()
+    mix = [{'method': method or 'unknown', 'count': int(counts[code]), 'amount': float(amounts[code]),
+            'share': float(amounts[code] / total * 100) if total else 0.0}
+           for code, method in enumerate(snapshot.methods) if counts[code]]
+    mix.sort(key=lambda row: -row['amount'])
+    return mix
+
+def chama_insights(chama, now=None):
+    """Everything the analytics page shows, from one refreshed snapshot"""
+    now = now or datetime.utcnow()
+    snapshot = get_snapshot(chama.id)
+    return {
+        'contributions': len(snapshot),
+        'retention': cohort_retention(snapshot, now),
+        'regularity': contribution_regularity(snapshot, chama.contribution_frequency, now),
+        'trend': moving_averages(snapshot, now),
+        'methods': method_mix(snapshot),
+        'recent_methods': method_mix(snapshot, since=now - timedelta(days=RECENT_DAYS)),
+    }
@@ -0,0 +1,401 @@
+"""Async JSON API for mobile clients.
+
+An ASGI (Starlette) app serving the read-only mobile endpoints under
+/api/v1 with SQLAlchemy's asyncio extension, so a process can hold many
+slow, long-lived client connections without tying up a thread or a pooled
+DB connection per client. It shares models.py and the session cookie with
+the Flask app and runs next to it as a separate process behind the same
+proxy:
+
+    uvicorn api:api --port 8001      # /api/v1/...
+    flask run / gunicorn app:app     # everything else
+
+The database URL is the Flask app's, with the async driver swapped in
+(asyncpg for PostgreSQL, aiosqlite for SQLite).
+"""
+import binascii
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+from sqlalchemy import case, extract, func, or_, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+from app import app as flask_app
+from archive import all_contributions, month_start, unpack_rows
+from models import (ArchivedReference, Chama, Contribution, ContributionArchive, Expense, Goal, Membership, User, Vote,
+                    VoteOption, VoteResponse)
+from payloads import render
+
+ASYNC_DRIVERS = {'postgresql': 'postgresql+asyncpg', 'postgres': 'postgresql+asyncpg', 'sqlite': 'sqlite+aiosqlite'}
+
+def async_database_url(url):
+    scheme, rest = url.split('://', 1)
+    return ASYNC_DRIVERS.get(scheme.split('+')[0], scheme) + '://' + rest
+
+engine = None
+Session = None
+
+@asynccontextmanager
+async def lifespan(app):
+    # Created inside the server's event loop, once per worker process
+    global engine, Session
+    url = async_database_url(flask_app.config['SQLALCHEMY_DATABASE_URI'])
+    pool = {} if url.startswith('sqlite') else {'pool_size': flask_app.config.get('API_POOL_SIZE', 10),
+                                                'max_overflow': 0}
+    engine = create_async_engine(url, **pool)
+    Session = async_sessionmaker(engine, expire_on_commit=False)
+    yield
+    await engine.dispose()
+
+# Authentication: the Flask session cookie set by /login
+
+_serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+
+def current_user_id(request):
+    cookie = request.cookies.get(flask_app.config['SESSION_COOKIE_NAME'])
+    if not cookie:
+        return None
+    try:
+        data = _serializer.loads(cookie, max_age=int(flask_app.permanent_session_lifetime.total_seconds()))
+    except Exception:
+        return None
+    user_id = data.get('_user_id')
+    return int(user_id) if user_id else None
+
+def error(message, status):
+    return JSONResponse({'error': message}, status_code=status)
+
+def respond(request, data):
+    """Field selection, MessagePack and compression as negotiated by the client (see payloads.py)"""
+    body, headers, _ = render(data, request.query_params.get('fields'), request.headers.get('accept'),
+                              request.headers.get('accept-encoding'), flask_app.config['API_COMPRESS_MIN_SIZE'])
+    return Response(body, headers=headers)
+
+async def _membership(session, user_id, chama_id):
+    return (await session.execute(
+        select(Membership.role).where(Membership.user_id == user_id, Membership.chama_id == chama_id,
+                                      Membership.is_active == True)
+    )).scalar_one_or_none()
+
+def _contribution_json(row):
+    return {
+        'id': row.id,
+        'chama_id': row.chama_id,
+        'user': row.name,
+        'amount': row.amount,
+        'status': row.status,
+        'payment_method': row.payment_method,
+        'transaction_ref': row.transaction_ref,
+        'contributed_at': row.contributed_at.isoformat(),
+    }
+
+def _archived_json(row, chama_id, name):
+    return {
+        'id': row['id'],
+        'chama_id': chama_id,
+        'user': name,
+        'amount': row['amount'],
+        'status': row['status'],
+        'payment_method': row['payment_method'],
+        'transaction_ref': row['transaction_ref'],
+        'contributed_at': row['contributed_at'].isoformat(),
+    }
+
+_contribution_columns = (Contribution.id, Contribution.chama_id, User.name, Contribution.amount, Contribution.status,
+                         Contribution.payment_method, Contribution.transaction_ref, Contribution.contributed_at)
+
+# Endpoints
+
+async def dashboard(request):
+    user_id = current_user_id(request)
+    if user_id is None:
+        return error('Unauthorized', 401)
+    start_of_month = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+    async with Session() as session:
+        chamas = (await session.execute(
+            select(Chama.id, Chama.name, Chama.contribution_amount, Chama.contribution_frequency, Membership.role)
+            .join(Membership, Membership.chama_id == Chama.id)
+            .where(Membership.user_id == user_id, Membership.is_active == True)
+            .order_by(Chama.name)
+        )).all()
+        facts = all_contributions()
+        totals = (await session.execute(
+            select(func.coalesce(func.sum(case((facts.c.status == 'confirmed', facts.c.amount), else_=0)), 0),
+                   func.coalesce(func.sum(facts.c.entries).filter(facts.c.contributed_at >= start_of_month), 0))
+            .where(facts.c.user_id == user_id)
+        )).one()
+        recent = (await session.execute(
+            select(*_contribution_columns).join(User, User.id == Contribution.user_id)
+            .where(Contribution.user_id == user_id)
+            .order_by(Contribution.contributed_at.desc()).limit(5)
+        )).all()
+
+    return respond(request, {
+        'chamas': [{'id': c.id, 'name': c.name, 'contribution_amount': c.contribution_amount,
+                    'contribution_frequency': c.contribution_frequency, 'role': c.role} for c in chamas],
+        'total_contributions': float(totals[0]),
+        'monthly_contribution_count': totals[1],
+        'recent_contributions': [_contribution_json(row) for row in recent],
+    })
+
+async def chama_detail(request):
+    user_id = current_user_id(request)
+    if user_id is None:
+        return error('Unauthorized', 401)
+    chama_id = request.path_params['chama_id']
+
+    async with Session() as session:
+        role = await _membership(session, user_id, chama_id)
+        if role is None:
+            return error('You are not a member of this chama', 403)
+        chama = (await session.execute(select(Chama).where(Chama.id == chama_id))).scalar_one()
+        members = (await session.execute(
+            select(func.count(Membership.id)).where(Membership.chama_id == chama_id, Membership.is_active == True)
+        )).scalar()
+        facts = all_contributions()
+        total_in = (await session.execute(
+            select(func.coalesce(func.sum(facts.c.amount), 0))
+            .where(facts.c.chama_id == chama_id, facts.c.status == 'confirmed')
+        )).scalar()
+        total_out = (await session.execute(
+            select(func.coalesce(func.sum(Expense.amount), 0)).where(Expense.chama_id == chama_id)
+        )).scalar()
+        recent = (await session.execute(
+            select(*_contribution_columns).join(User, User.id == Contribution.user_id)
+            .where(Contribution.chama_id == chama_id)
+            .order_by(Contribution.contributed_at.desc()).limit(10)
+        )).all()
+        goals = (await session.execute(
+            select(Goal).where(Goal.chama_id == chama_id, Goal.is_achieved == False)
+            .order_by(Goal.target_date.is_(None), Goal.target_date, Goal.created_at)
+        )).scalars().all()
+        votes = (await session.execute(
+            select(Vote.id, Vote.title, Vote.vote_type, Vote.closes_at)
+            .where(Vote.chama_id == chama_id, Vote.is_active == True)
+        )).all()
+
+    return respond(request, {
+        'id': chama.id,
+        'name': chama.name,
+        'description': chama.description,
+        'contribution_amount': chama.contribution_amount,
+        'contribution_frequency': chama.contribution_frequency,
+        'role': role,
+        'total_members': members,
+        'total_contributions': float(total_in),
+        'total_expenses': float(total_out),
+        'balance': float(total_in) - float(total_out),
+        'recent_contributions': [_contribution_json(row) for row in recent],
+        'active_goals': [{'id': g.id, 'title': g.title, 'target_amount': g.target_amount,
+                          'current_amount': g.current_amount, 'progress_percent': g.progress_percent,
+                          'target_date': g.target_date.isoformat() if g.target_date else None} for g in goals],
+        'active_votes': [{'id': v.id, 'title': v.title, 'vote_type': v.vote_type,
+                          'closes_at': v.closes_at.isoformat() if v.closes_at else None} for v in votes],
+    })
+
+def encode_cursor(key):
+    """Opaque paging cursor for a (contributed_at, id) key"""
+    contributed_at, contribution_id = key
+    return urlsafe_b64encode(f'{contributed_at.isoformat()} {contribution_id}'.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """(contributed_at, id) key of a cursor from encode_cursor(); ValueError if malformed"""
+    try:
+        contributed_at, contribution_id = urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode().split(' ')
+    except (binascii.Error, UnicodeDecodeError) as e:
+        raise ValueError(cursor) from e
+    return datetime.fromisoformat(contributed_at), int(contribution_id)
+
+async def _anchor(session, chama_id, contribution_id):
+    """Paging key of a contribution id (cursors from before they were opaque), or None.
+
+    Only indexed lookups: archived rows without a transaction reference
+    aren't found, and their page starts over.
+    """
+    contributed_at = (await session.execute(
+        select(Contribution.contributed_at).where(Contribution.id == contribution_id,
+                                                  Contribution.chama_id == chama_id)
+    )).scalar_one_or_none()
+    if contributed_at is None:
+        contributed_at = (await session.execute(
+            select(ArchivedReference.contributed_at).where(ArchivedReference.id == contribution_id,
+                                                           ArchivedReference.chama_id == chama_id)
+        )).scalar_one_or_none()
+    return (contributed_at, contribution_id) if contributed_at is not None else None
+
+def _unpack_older(data, before, keep):
+    return [row for row in unpack_rows(data)
+            if (before is None or (row['contributed_at'], row['id']) < before) and keep(row)]
+
+async def _archived_rows(session, chama_id, keep, limit, before=None, since=None):
+    """Up to `limit` archived rows passing keep(row), newest first.
+
+    Months are decompressed newest first (in the thread pool, off the
+    event loop), from the one holding the (contributed_at, id) key
+    `before` back to the one holding `since`, stopping once `limit` rows
+    are found.
+    """
+    query = select(ContributionArchive.id).where(ContributionArchive.chama_id == chama_id)
+    if before is not None:
+        query = query.where(ContributionArchive.period_start <= before[0])
+    if since is not None:
+        query = query.where(ContributionArchive.period_start >= month_start(since))
+    archive_ids = (await session.execute(query.order_by(ContributionArchive.period_start.desc()))).scalars().all()
+    rows = []
+    for archive_id in archive_ids:
+        data = (await session.execute(
+            select(ContributionArchive.data).where(ContributionArchive.id == archive_id)
+        )).scalar_one()
+        rows += await run_in_threadpool(_unpack_older, data, before, keep)
+        if len(rows) >= limit:
+            break
+    rows.sort(key=lambda row: (row['contributed_at'], row['id']), reverse=True)
+    return rows[:limit]
+
+async def contributions(request):
+    """Contribution history, newest first, paged with ?before=<next_before>&limit=
+
+    next_before is an opaque cursor; pages run on from the hot table into
+    the archived months.
+    """
+    user_id = current_user_id(request)
+    if user_id is None:
+        return error('Unauthorized', 401)
+    chama_id = request.path_params['chama_id']
+    before = request.query_params.get('before')
+    try:
+        limit = min(100, max(1, int(request.query_params.get('limit', 50))))
+        anchor = decode_cursor(before) if before and not before.isdigit() else None
+    except ValueError:
+        return error('Invalid paging parameters', 400)
+    mine = bool(request.query_params.get('mine'))
+
+    async with Session() as session:
+        if await _membership(session, user_id, chama_id) is None:
+            return error('You are not a member of this chama', 403)
+        if before and before.isdigit():
+            anchor = await _anchor(session, chama_id, int(before))
+            if anchor is None:
+                return respond(request, {'contributions': [], 'next_before': None})
+
+        query = select(*_contribution_columns).join(User, User.id == Contribution.user_id)\
+            .where(Contribution.chama_id == chama_id)
+        if mine:
+            query = query.where(Contribution.user_id == user_id)
+        if anchor is not None:
+            # Keyset paging on (contributed_at, id) so deep pages stay cheap
+            query = query.where(or_(Contribution.contributed_at < anchor[0],
+                                    (Contribution.contributed_at == anchor[0]) & (Contribution.id < anchor[1])))
+        hot = (await session.execute(
+            query.order_by(Contribution.contributed_at.desc(), Contribution.id.desc()).limit(limit)
+        )).all()
+
+        # Archived rows interleave with any older hot rows (pending or earmarked ones stay hot), so
+        # only months at or after the last hot row can add to a full page
+        cold = await _archived_rows(session, chama_id, lambda row: not mine or row['user_id'] == user_id, limit,
+                                    anchor, hot[-1].contributed_at if len(hot) == limit else None)
+        names = dict((await session.execute(
+            select(User.id, User.name).where(User.id.in_({row['user_id'] for row in cold}))
+        )).all()) if cold else {}
+
+    page = [((row.contributed_at, row.id), _contribution_json(row)) for row in hot]
+    page += [((row['contributed_at'], row['id']), _archived_json(row, chama_id, names.get(row['user_id'])))
+             for row in cold]
+    page.sort(key=lambda entry: entry[0], reverse=True)
+    page = page[:limit]
+    return respond(request, {
+        'contributions': [item for _, item in page],
+        'next_before': encode_cursor(page[-1][0]) if len(page) == limit else None,
+    })
+
+async def contribution_stats(request):
+    user_id = current_user_id(request)
+    if user_id is None:
+        return error('Unauthorized', 401)
+    chama_id = request.path_params['chama_id']
+
+    async with Session() as session:
+        if await _membership(session, user_id, chama_id) is None:
+            return error('Unauthorized', 403)
+        facts = all_contributions()
+        month = extract('month', facts.c.contributed_at)
+        rows = (await session.execute(
+            select(month.label('month'), func.sum(facts.c.amount).label('total'))
+            .where(facts.c.chama_id == chama_id, facts.c.status == 'confirmed')
+            .group_by(month)
+        )).all()
+
+    return respond(request, {
+        'monthly_contributions': [{'month': row.month, 'total': float(row.total)} for row in rows]
+    })
+
+async def vote_results(request):
+    user_id = current_user_id(request)
+    if user_id is None:
+        return error('Unauthorized', 401)
+    chama_id = request.path_params['chama_id']
+    vote_id = request.path_params['vote_id']
+
+    async with Session() as session:
+        if await _membership(session, user_id, chama_id) is None:
+            return error('You are not a member of this chama', 403)
+        vote = (await session.execute(
+            select(Vote).where(Vote.id == vote_id, Vote.chama_id == chama_id)
+        )).scalar_one_or_none()
+        if vote is None:
+            return error('Vote not found', 404)
+        has_voted = (await session.execute(
+            select(VoteResponse.id).where(VoteResponse.vote_id == vote_id, VoteResponse.user_id == user_id)
+        )).first() is not None
+
+        if vote.vote_type == 'percentage':
+            members = (await session.execute(
+                select(func.count(Membership.id)).where(Membership.chama_id == chama_id, Membership.is_active == True)
+            )).scalar()
+            yes_count = (await session.execute(
+                select(func.count(VoteResponse.id)).where(VoteResponse.vote_id == vote_id,
+                                                          VoteResponse.percentage >= 50)
+            )).scalar()
+            results = {
+                'total_members': members,
+                'yes_count': yes_count,
+                'approval_percentage': (yes_count / members * 100) if members > 0 else 0,
+            }
+        else:
+            # Every option's count in one grouped query
+            rows = (await session.execute(
+                select(VoteOption.id, VoteOption.option_text, func.count(VoteResponse.id))
+                .outerjoin(VoteResponse, VoteResponse.option_id == VoteOption.id)
+                .where(VoteOption.vote_id == vote_id)
+                .group_by(VoteOption.id, VoteOption.option_text).order_by(VoteOption.id)
+            )).all()
+            results = {'options': [{'id': option_id, 'text': text, 'count': count}
+                                   for option_id, text, count in rows]}
+
+    return respond(request, {
+        'id': vote.id,
+        'title': vote.title,
+        'description': vote.description,
+        'vote_type': vote.vote_type,
+        'is_active': vote.is_active,
+        'closes_at': vote.closes_at.isoformat() if vote.closes_at else None,
+        'has_voted': has_voted,
+        'results': results,
+    })
+
+api = Starlette(
+    routes=[
+        Route('/api/v1/dashboard', dashboard),
+        Route('/api/v1/chamas/{chama_id:int}', chama_detail),
+        Route('/api/v1/chamas/{chama_id:int}/contributions', contributions),
+        Route('/api/v1/chamas/{chama_id:int}/stats', contribution_stats),
+        Route('/api/v1/chamas/{chama_id:int}/votes/{vote_id:int}', vote_results),
+    ],
+    lifespan=lifespan,
+)
@@ -0,0 +1,238 @@
+"""Cold storage for closed months of contributions.
+
+The contribution table holds the hot rows: the last HOT_MONTHS months, plus
+older rows that are still pending or are earmarked for goals (GoalAllocation
+points at them). archive_contributions() moves every other row of a closed
+month into one ContributionArchive row per chama (zlib-compressed JSON),
+folds it into frozen ContributionSummary totals per member, month and
+status, indexes its transaction reference in ArchivedReference (for
+search) and deletes it from the hot table.
+
+Readers don't need to know where a row lives:
+
+- all_contributions() is the hot rows UNION ALL the summaries, for totals
+  and per-month aggregates. Archived amounts are dated at the start of
+  their month, so a date range is exact when it starts on a month boundary
+  or inside the hot window.
+- archived_total() and archived_rows() are exact for any range, for
+  balances and statements.
+
+Balance checkpoints and compliance snapshots are frozen before a month is
+archived, so day-to-day pages never open the archive.
+"""
+import json
+import zlib
+from datetime import datetime
+
+from sqlalchemy import func, insert, literal, select, union_all
+
+from extensions import db
+from models import (ArchivedReference, Chama, Contribution, ContributionArchive, ContributionSummary, GoalAllocation,
+                    SyncChange)
+
+HOT_MONTHS = 12
+ARCHIVED_COLUMNS = ('id', 'user_id', 'amount', 'payment_method', 'transaction_ref', 'status',
+                    'contributed_at', 'confirmed_by')
+DELETE_BATCH = 500
+
+def month_start(when):
+    return when.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def next_month(when):
+    if when.month == 12:
+        return when.replace(year=when.year + 1, month=1)
+    return when.replace(month=when.month + 1)
+
+def archive_cutoff(now=None, hot_months=HOT_MONTHS):
+    """Start of the oldest month that stays hot"""
+    current = month_start(now or datetime.utcnow())
+    index = current.year * 12 + current.month - 1 - hot_months
+    return current.replace(year=index // 12, month=index % 12 + 1)
+
+def _pack(rows):
+    values = [[row[column] for column in ARCHIVED_COLUMNS] for row in rows]
+    for value in values:
+        value[6] = value[6].isoformat()
+    return zlib.compress(json.dumps(values, separators=(',', ':')).encode(), 9)
+
+def unpack_rows(data):
+    """Rows of a ContributionArchive's data, as dicts"""
+    rows = [dict(zip(ARCHIVED_COLUMNS, value)) for value in json.loads(zlib.decompress(data))]
+    for row in rows:
+        row['contributed_at'] = datetime.fromisoformat(row['contributed_at'])
+    return rows
+
+# Reading
+
+def all_contributions():
+    """Hot rows and archived summaries as one subquery.
+
+    Columns: chama_id, user_id, status, contributed_at, entries (rows
+    represented; sum it instead of counting) and amount.
+    """
+    hot = select(Contribution.chama_id, Contribution.user_id, Contribution.status,
+                 Contribution.contributed_at, literal(1).label('entries'), Contribution.amount)
+    cold = select(ContributionSummary.chama_id, ContributionSummary.user_id, ContributionSummary.status,
+                  ContributionSummary.period_start, ContributionSummary.entries, ContributionSummary.amount)
+    return union_all(hot, cold).subquery('all_contributions')
+
+def archived_rows(chama_id, start=None, end=None):
+    """Archived contributions of a chama dated in [start, end), oldest first, as dicts"""
+    query = ContributionArchive.query.filter(ContributionArchive.chama_id == chama_id)
+    if start is not None:
+        query = query.filter(ContributionArchive.period_start >= month_start(start))
+    if end is not None:
+        query = query.filter(ContributionArchive.period_start < end)
+    rows = []
+    for archive in query.order_by(ContributionArchive.period_start):
+        rows += [row for row in unpack_rows(archive.data)
+                 if (start is None or row['contributed_at'] >= start)
+                 and (end is None or row['contributed_at'] < end)]
+    rows.sort(key=lambda row: (row['contributed_at'], row['id']))
+    return rows
+
+def archived_total(chama_id, start=None, end=None):
+    """Confirmed archived amount dated in [start, end).
+
+    Whole months come from the summaries; only a partial month at either
+    end of the range is decompressed.
+    """
+    partial = []
+    whole_from, whole_to = start, end
+    if start is not None and start != month_start(start):
+        whole_from = next_month(month_start(start))
+        partial.append((start, whole_from if end is None else min(whole_from, end)))
+    if end is not None and end != month_start(end):
+        whole_to = month_start(end)
+        if whole_from is None or whole_to >= whole_from:
+            partial.append((whole_to if start is None else max(whole_to, start), end))
+
+    total = 0.0
+    if whole_from is None or whole_to is None or whole_from < whole_to:
+        query = db.session.query(func.coalesce(func.sum(ContributionSummary.amount), 0)).filter(
+            ContributionSummary.chama_id == chama_id, ContributionSummary.status == 'confirmed')
+        if whole_from is not None:
+            query = query.filter(ContributionSummary.period_start >= whole_from)
+        if whole_to is not None:
+            query = query.filter(ContributionSummary.period_start < whole_to)
+        total += query.scalar()
+    for low, high in partial:
+        total += sum(row['amount'] for row in archived_rows(chama_id, low, high) if row['status'] == 'confirmed')
+    return total
+
+# Archiving
+
+def _archivable(chama_id, before):
+    allocated = db.session.query(GoalAllocation.contribution_id)
+    return db.session.query(*[getattr(Contribution, column) for column in ARCHIVED_COLUMNS]).filter(
+        Contribution.chama_id == chama_id,
+        Contribution.contributed_at < before,
+        Contribution.status != 'pending',
+        ~Contribution.id.in_(allocated),
+    )
+
+def _archive_chama(chama_id, before):
+    """Move a chama's archivable rows dated before `before` into the archive; the caller commits"""
+    rows = [row._asdict() for row in _archivable(chama_id, before)
+            .order_by(Contribution.contributed_at, Contribution.id)]
+    if not rows:
+        return 0
+    by_month = {}
+    for row in rows:
+        by_month.setdefault(month_start(row['contributed_at']), []).append(row)
+
+    archives = {archive.period_start: archive for archive in ContributionArchive.query.filter(
+        ContributionArchive.chama_id == chama_id, ContributionArchive.period_start < before)}
+    for period_start, month_rows in by_month.items():
+        archive = archives.get(period_start)
+        if archive is None:
+            db.session.add(ContributionArchive(chama_id=chama_id, period_start=period_start,
+                                               row_count=len(month_rows), data=_pack(month_rows)))
+        else:
+            # Stragglers (e.g. confirmed after their month was archived) join the existing archive
+            rows_so_far = unpack_rows(archive.data)
+            archive.data = _pack(rows_so_far + month_rows)
+            archive.row_count = len(rows_so_far) + len(month_rows)
+
+    summaries = {(summary.user_id, summary.period_start, summary.status): summary
+                 for summary in ContributionSummary.query.filter(
+                     ContributionSummary.chama_id == chama_id, ContributionSummary.period_start < before)}
+    for row in rows:
+        key = (row['user_id'], month_start(row['contributed_at']), row['status'])
+        summary = summaries.get(key)
+        if summary is None:
+            summary = summaries[key] = ContributionSummary(chama_id=chama_id, user_id=key[0], period_start=key[1],
+                                                           status=key[2], entries=0, amount=0.0)
+            db.session.add(summary)
+        summary.entries += 1
+        summary.amount += row['amount']
+
+    references = [{'id': row['id'], 'chama_id': chama_id, 'user_id': row['user_id'],
+                   'period_start': month_start(row['contributed_at']), 'contributed_at': row['contributed_at'],
+                   'transaction_ref': row['transaction_ref'], 'amount': row['amount'], 'status': row['status']}
+                  for row in rows if row['transaction_ref']]
+    if references:
+        db.session.execute(insert(ArchivedReference), references)
+
+    ids = [row['id'] for row in rows]
+    for offset in range(0, len(ids), DELETE_BATCH):
+        batch = ids[offset:offset + DELETE_BATCH]
+        Contribution.query.filter(Contribution.id.in_(batch)).delete(synchronize_session=False)
+        # Archiving isn't a deletion as far as synced clients are concerned
+        SyncChange.query.filter(SyncChange.entity == 'contribution', SyncChange.entity_id.in_(batch))\
+            .delete(synchronize_session=False)
+    return len(rows)
+
+def archive_contributions(before=None, chama_id=None):
+    """Archive contributions dated before `before` (default archive_cutoff()).
+
+    Works a chama at a time and commits after each, so it can be
+    interrupted and rerun. Returns the number of rows archived.
+    """
+    # ledger and compliance read the archive themselves
+    from compliance import build_compliance
+    from ledger import ensure_checkpoints
+
+    before = month_start(before) if before is not None else archive_cutoff()
+    query = db.session.query(Contribution.chama_id).filter(
+        Contribution.contributed_at < before, Contribution.status != 'pending',
+        ~Contribution.id.in_(db.session.query(GoalAllocation.contribution_id)),
+    ).distinct().order_by(Contribution.chama_id)
+    if chama_id is not None:
+        query = query.filter(Contribution.chama_id == chama_id)
+
+    archived = 0
+    for (c_id,) in query.all():
+        # Freeze what the hot pages read before their inputs go cold
+        ensure_checkpoints(c_id, before)
+        build_compliance(db.session.get(Chama, c_id))
+        archived += _archive_chama(c_id, before)
+        db.session.commit()
+    return archived
+
+def forget_user(user_id):
+    """Remove a user's archived contributions (account deletion); the caller commits.
+
+    Returns {chama_id: earliest removed confirmed date} so the caller can
+    invalidate checkpoints and compliance snapshots that included them.
+    """
+    earliest = {}
+    months = db.session.query(ContributionSummary.chama_id, ContributionSummary.period_start)\
+        .filter(ContributionSummary.user_id == user_id).distinct().all()
+    for chama_id, period_start in months:
+        archive = ContributionArchive.query.filter_by(chama_id=chama_id, period_start=period_start).first()
+        if archive is None:
+            continue
+        rows = unpack_rows(archive.data)
+        kept = [row for row in rows if row['user_id'] != user_id]
+        for row in rows:
+            if row['user_id'] == user_id and row['status'] == 'confirmed':
+                earliest[chama_id] = min(earliest.get(chama_id, row['contributed_at']), row['contributed_at'])
+        if kept:
+            archive.data = _pack(kept)
+            archive.row_count = len(kept)
+        else:
+            db.session.delete(archive)
+    ContributionSummary.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+    ArchivedReference.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+    return earliest
@@ -0,0 +1,64 @@
+"""Chama analytics: ad-hoc SQL versus the columnar snapshot.
+
+For the chama with the most contributions, times the aggregates behind the
+analytics page as per-request SQL (payment-method mix, weekly totals and
+the distinct member-months that cohorts and regularity are built from),
+rebuilding the snapshot on every request, and refreshing a cached snapshot
+before running the vectorized analytics. Writes
+benchmarks/results/analytics-<commit>.json.
+
+    python -m benchmarks.bench_analytics --scale small
+"""
+
+from benchmarks.bench_core import timeit
+from benchmarks.common import bench_parser, bench_setup, write_results
+
+def main():
+    parser = bench_parser(__doc__)
+    args = parser.parse_args()
+
+    app, counts = bench_setup('analytics', args)
+    from analytics import (build_snapshot, chama_insights, cohort_retention, contribution_regularity, get_snapshot,
+                           method_mix, moving_averages)
+    from extensions import db
+    from models import Chama, Contribution
+
+    results = {'dataset': {'scale': args.scale, 'seed': args.seed, **counts}, 'cases': {}}
+    with app.app_context():
+        db.create_all()
+        chama_id, rows = db.session.query(Contribution.chama_id, db.func.count()).group_by(Contribution.chama_id)\
+            .order_by(db.func.count().desc()).first()
+        chama = db.session.get(Chama, chama_id)
+        confirmed = db.session.query(Contribution).filter(Contribution.chama_id == chama_id,
+                                                          Contribution.status == 'confirmed')
+        week = db.func.strftime('%Y-%W', Contribution.contributed_at) if db.engine.dialect.name == 'sqlite' \
+            else db.func.date_trunc('week', Contribution.contributed_at)
+        month = db.func.strftime('%Y-%m', Contribution.contributed_at) if db.engine.dialect.name == 'sqlite' \
+            else db.func.date_trunc('month', Contribution.contributed_at)
+
+        def sql():
+            confirmed.with_entities(Contribution.payment_method, db.func.count(), db.func.sum(Contribution.amount))\
+                .group_by(Contribution.payment_method).all()
+            confirmed.with_entities(week, db.func.sum(Contribution.amount)).group_by(week).all()
+            confirmed.with_entities(Contribution.user_id, month).distinct().all()
+
+        def analyse(snapshot):
+            cohort_retention(snapshot)
+            contribution_regularity(snapshot, chama.contribution_frequency)
+            moving_averages(snapshot)
+            method_mix(snapshot)
+
+        results['cases']['sql'] = timeit(sql, args.repeat)
+        results['cases']['rebuild_snapshot'] = timeit(lambda: analyse(build_snapshot(chama_id)), args.repeat)
+        get_snapshot(chama_id)
+        results['cases']['cached_snapshot'] = timeit(lambda: analyse(get_snapshot(chama_id)), args.repeat)
+        results['cases']['chama_insights'] = timeit(lambda: chama_insights(chama), args.repeat)
+        results['snapshot_bytes'] = get_snapshot(chama_id).nbytes
+
+    print(f"chama {chama_id}: {rows} contributions, snapshot {results['snapshot_bytes']:,} bytes")
+    for name, stats in results['cases'].items():
+        print(f"{name:<40}{stats['median_ms']:>10.3f} ms")
+    print(f"Results written to {write_results('analytics', results)}")
+
+if __name__ == '__main__':
+    main()
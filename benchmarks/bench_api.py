@@ -0,0 +1,149 @@
+"""Concurrent mobile clients: async API vs the sync Flask routes.
+
+Serves the Flask app (threaded dev server) and the async API (uvicorn,
+one worker) from separate processes over the same database, then runs
+increasing numbers of long-lived keep-alive clients against each. Every
+client loops over a mobile screen (dashboard, chama stats) with think
+time in between, the way an app on a slow network holds its connection
+open. Reports throughput, p95 and errors per level, and the largest level
+each tier serves within the p95 SLO.
+
+    python -m benchmarks.bench_api --scale small --levels 50,200,500 --duration 20
+"""
+import asyncio
+import multiprocessing
+import os
+import random
+import time
+
+from benchmarks.bench_votes import session_cookies
+from benchmarks.common import bench_parser, bench_setup, summarize, write_results
+from benchmarks.loadtest import percentile, serve
+
+# (route, sync path, async path)
+SCREENS = [
+    ('dashboard', '/dashboard', '/api/v1/dashboard'),
+    ('chama_stats', '/api/chama/{chama_id}/stats', '/api/v1/chamas/{chama_id}/stats'),
+]
+
+def serve_api(database_url, port, ready):
+    """Child process: run the async API on uvicorn"""
+    import uvicorn
+
+    os.environ['DATABASE_URL'] = database_url
+    config = uvicorn.Config('api:api', host='127.0.0.1', port=port, log_level='error', workers=1)
+    server = uvicorn.Server(config)
+    ready.set()
+    server.run()
+
+def start(target, *args):
+    context = multiprocessing.get_context('fork')
+    ready = context.Event()
+    process = context.Process(target=target, args=(os.environ['DATABASE_URL'], *args, ready), daemon=True)
+    process.start()
+    ready.wait(30)
+    return process
+
+async def wait_until_up(base_url, cookie):
+    import httpx
+    async with httpx.AsyncClient(base_url=base_url, cookies={'session': cookie}) as client:
+        for _ in range(100):
+            try:
+                await client.get('/', timeout=1)
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.1)
+
+async def run_level(base_url, column, users, clients, duration, think_time, seed):
+    """`clients` concurrent keep-alive clients for `duration` seconds; returns latencies and statuses"""
+    import httpx
+
+    rng = random.Random(seed)
+    latencies, statuses = [], {}
+    # Build the clients up front: each one sets up its own SSL context, which is slow
+    clients = [(httpx.AsyncClient(base_url=base_url, cookies={'session': cookie}, timeout=30,
+                                  limits=httpx.Limits(max_connections=1)), chama_ids, random.Random(rng.random()))
+               for _, cookie, chama_ids in rng.choices(users, k=clients)]
+    deadline = time.perf_counter() + duration
+
+    async def client(http, chama_ids, client_rng):
+        async with http:
+            # Stagger start so the level ramps up rather than arriving as one burst
+            await asyncio.sleep(client_rng.uniform(0, think_time))
+            while time.perf_counter() < deadline:
+                _, sync_path, async_path = client_rng.choice(SCREENS)
+                path = (sync_path, async_path)[column].format(chama_id=client_rng.choice(chama_ids))
+                start = time.perf_counter()
+                try:
+                    status = (await http.get(path)).status_code
+                except httpx.HTTPError:
+                    status = 'exception'
+                latencies.append(time.perf_counter() - start)
+                statuses[status] = statuses.get(status, 0) + 1
+                await asyncio.sleep(client_rng.uniform(0, think_time))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(*args) for args in clients))
+    return latencies, statuses, time.perf_counter() - start
+
+def main():
+    parser = bench_parser(__doc__, repeat=None)
+    parser.add_argument('--levels', default='25,100,250', help='comma-separated concurrent client counts')
+    parser.add_argument('--duration', type=float, default=15, help='seconds per level')
+    parser.add_argument('--think-time', type=float, default=1.0, help='max seconds between requests')
+    parser.add_argument('--slo', type=float, default=200, help='p95 objective in ms')
+    parser.add_argument('--port', type=int, default=5057)
+    args = parser.parse_args()
+
+    app, counts = bench_setup('api', args)
+    from extensions import db
+    from models import Membership
+    with app.app_context():
+        memberships = {}
+        for user_id, chama_id in db.session.query(Membership.user_id, Membership.chama_id)\
+                .filter(Membership.is_active == True):
+            memberships.setdefault(user_id, []).append(chama_id)
+    cookies = session_cookies(app, memberships)
+    users = [(user_id, cookies[user_id], chama_ids) for user_id, chama_ids in memberships.items()]
+    levels = [int(level) for level in args.levels.split(',')]
+
+    tiers = {'sync': (serve, args.port), 'async': (serve_api, args.port + 1)}
+    results = {'dataset': {'scale': args.scale, 'seed': args.seed, **counts},
+               'think_time_s': args.think_time, 'slo_ms': args.slo, 'tiers': {}}
+    for column, (tier, (target, port)) in enumerate(tiers.items()):
+        server = start(target, port)
+        base_url = f'http://127.0.0.1:{port}'
+        rows = []
+        try:
+            asyncio.run(wait_until_up(base_url, users[0][1]))
+            for level in levels:
+                latencies, statuses, elapsed = asyncio.run(
+                    run_level(base_url, column, users, level, args.duration, args.think_time, args.seed))
+                ordered = sorted(latencies)
+                errors = sum(count for status, count in statuses.items()
+                             if status == 'exception' or status >= 400)
+                row = {
+                    'clients': level,
+                    'requests': len(latencies),
+                    'throughput_rps': round(len(latencies) / elapsed, 2),
+                    'p95_ms': round(percentile(ordered, 95) * 1000, 3) if ordered else None,
+                    'error_rate': round(errors / len(latencies), 4) if latencies else None,
+                    'latency': summarize(latencies),
+                    'statuses': {str(k): v for k, v in sorted(statuses.items(), key=str)},
+                }
+                rows.append(row)
+                print(f"{tier:5} {level:5} clients  {row['throughput_rps']:8.1f} req/s  "
+                      f"p95 {row['p95_ms']:8.1f} ms  errors {row['error_rate']:.2%}")
+        finally:
+            server.terminate()
+            server.join()
+        within = [row['clients'] for row in rows if row['p95_ms'] is not None
+                  and row['p95_ms'] <= args.slo and not row['error_rate']]
+        results['tiers'][tier] = {'levels': rows, 'max_clients_within_slo': max(within, default=0)}
+
+    for tier, summary in results['tiers'].items():
+        print(f"{tier}: up to {summary['max_clients_within_slo']} clients within p95 {args.slo:.0f} ms")
+    print(f"Results written to {write_results('api', results)}")
+
+if __name__ == '__main__':
+    main()
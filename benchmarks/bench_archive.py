@@ -0,0 +1,59 @@
+"""Hot-path aggregates before and after archiving closed months.
+
+Seeds a fresh dataset (archiving changes it, so it is always reseeded),
+times the contribution aggregates behind the profile, dashboard, chama and
+stats pages, archives everything older than --hot-months, and times them
+again. Also reports hot rows left and archive size. Writes
+benchmarks/results/archive-<commit>.json.
+
+    python -m benchmarks.bench_archive --scale small --hot-months 12
+"""
+import time
+
+from benchmarks.bench_core import build_cases, pick_targets, timeit
+from benchmarks.common import bench_parser, bench_setup, write_results
+
+AGGREGATE_CASES = ('view.profile', 'view.dashboard', 'view.chama_detail', 'api.chama_stats',
+                   'utils.get_contribution_summary.year', 'utils.get_contribution_summary.all')
+
+def time_cases(app, targets, repeat):
+    cases = build_cases(app, targets)
+    return {name: timeit(cases[name], repeat) for name in AGGREGATE_CASES}
+
+def main():
+    parser = bench_parser(__doc__, reseed=False)
+    parser.add_argument('--hot-months', type=int, default=12)
+    args = parser.parse_args()
+
+    app, counts = bench_setup('archive', args, reseed=True)
+    from archive import archive_contributions, archive_cutoff
+    from extensions import db
+    from models import Contribution, ContributionArchive, ContributionSummary
+
+    targets = pick_targets(app, args.seed)
+    before = time_cases(app, targets, args.repeat)
+    with app.app_context():
+        start = time.perf_counter()
+        archived = archive_contributions(archive_cutoff(hot_months=args.hot_months))
+        archive_s = time.perf_counter() - start
+        storage = {
+            'hot_rows': Contribution.query.count(),
+            'archived_rows': archived,
+            'archives': ContributionArchive.query.count(),
+            'archive_bytes': db.session.query(db.func.sum(db.func.length(ContributionArchive.data))).scalar() or 0,
+            'summaries': ContributionSummary.query.count(),
+            'archive_s': round(archive_s, 2),
+        }
+    after = time_cases(app, targets, args.repeat)
+
+    results = {'dataset': {'scale': args.scale, 'seed': args.seed, **counts}, 'hot_months': args.hot_months,
+               'storage': storage, 'cases': {}}
+    print(f"{'case':<40}{'before ms':>12}{'after ms':>12}")
+    for name in AGGREGATE_CASES:
+        results['cases'][name] = {'before': before[name], 'after': after[name]}
+        print(f"{name:<40}{before[name]['median_ms']:>12.3f}{after[name]['median_ms']:>12.3f}")
+    print(', '.join(f'{key} {value}' for key, value in storage.items()))
+    print(f"Results written to {write_results('archive', results)}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""Micro-benchmarks for the hot views, queries and helpers.
+
+Seeds a dataset with benchmarks.datagen (once per scale/seed), then times
+each case and writes the results to benchmarks/results/core-<commit>.json.
+Compare two runs with benchmarks.compare.
+
+    python -m benchmarks.bench_core --scale small --repeat 30
+"""
+import random
+import time
+
+from benchmarks.common import bench_parser, bench_setup, summarize, write_results
+
+def timeit(func, repeat, warmup=2):
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+def pick_targets(app, seed):
+    """Pick a busy user, their largest chama and one vote of each type"""
+    from extensions import db
+    from models import Membership, Contribution, Vote
+    rng = random.Random(seed)
+    with app.app_context():
+        chama_id, user_id = db.session.query(Contribution.chama_id, Contribution.user_id)\
+            .group_by(Contribution.chama_id, Contribution.user_id)\
+            .order_by(db.func.count().desc()).first()
+        votes = {}
+        for vote_type in ('binary', 'multiple_choice', 'percentage'):
+            vote = Vote.query.filter_by(vote_type=vote_type).order_by(Vote.id).first()
+            if vote:
+                member = Membership.query.filter_by(chama_id=vote.chama_id, is_active=True).first()
+                votes[vote_type] = (vote.chama_id, vote.id, member.user_id)
+    return {'user_id': user_id, 'chama_id': chama_id, 'votes': votes, 'rng': rng}
+
+def logged_in_client(app, user_id):
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(user_id)
+        sess['_fresh'] = True
+    return client
+
+def get_ok(client, url):
+    response = client.get(url)
+    assert response.status_code == 200, (url, response.status_code)
+
+def build_cases(app, targets):
+    import utils
+    from app import generate_join_code
+    from extensions import db
+    from models import Chama
+
+    user_client = logged_in_client(app, targets['user_id'])
+    chama_id = targets['chama_id']
+    cases = {
+        'view.profile': lambda: get_ok(user_client, '/profile'),
+        'view.dashboard': lambda: get_ok(user_client, '/dashboard'),
+        'view.chama_detail': lambda: get_ok(user_client, f'/chama/{chama_id}'),
+        'api.chama_stats': lambda: get_ok(user_client, f'/api/chama/{chama_id}/stats'),
+    }
+    for vote_type, (vote_chama_id, vote_id, voter_id) in targets['votes'].items():
+        voter = logged_in_client(app, voter_id)
+        url = f'/chama/{vote_chama_id}/vote/{vote_id}'
+        cases[f'view.view_vote.{vote_type}'] = lambda voter=voter, url=url: get_ok(voter, url)
+
+    def contribution_summary(period):
+        def run():
+            with app.app_context():
+                chama = db.session.get(Chama, chama_id)
+                utils.get_contribution_summary(chama, period=period)
+        return run
+    for period in ('month', 'year', 'all'):
+        cases[f'utils.get_contribution_summary.{period}'] = contribution_summary(period)
+
+    # 10k numbers in the mix of formats people actually type
+    rng = targets['rng']
+    formats = ['07{:08d}', '+254 7{:08d}', '2547{:08d}', '7{:08d}', '01{:08d}', '12{:08d}']
+    numbers = [rng.choice(formats).format(rng.randrange(10 ** 8)) for _ in range(10000)]
+    cases['utils.format_kenyan_phone.10k'] = lambda: [utils.format_kenyan_phone(n) for n in numbers]
+    cases['utils.validate_kenyan_phone.10k'] = lambda: [utils.validate_kenyan_phone(n) for n in numbers]
+    cases['utils.normalize_kenyan_phones.10k'] = lambda: utils.normalize_kenyan_phones(numbers)
+
+    cases['utils.generate_join_code.1k'] = lambda: [utils.generate_join_code() for _ in range(1000)]
+
+    def app_join_code():
+        with app.app_context():
+            for _ in range(100):
+                generate_join_code()
+    cases['app.generate_join_code.100'] = app_join_code
+    return cases
+
+def main():
+    parser = bench_parser(__doc__)
+    parser.add_argument('-k', dest='only', help='only run cases containing this substring')
+    args = parser.parse_args()
+
+    app, counts = bench_setup('bench', args)
+    targets = pick_targets(app, args.seed)
+    cases = build_cases(app, targets)
+
+    results = {'dataset': {'scale': args.scale, 'seed': args.seed, **counts}, 'cases': {}}
+    for name, func in cases.items():
+        if args.only and args.only not in name:
+            continue
+        results['cases'][name] = timeit(func, args.repeat)
+        print(f"{name:<42} median {results['cases'][name]['median_ms']:>10.3f} ms")
+    print(f"Results written to {write_results('core', results)}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Dividend share-out cost.
+
+Times dividends.share_out() on --rows synthetic contributions spread over
+--members members (the vectorised core: per-member weights and the exact
+largest-remainder split), then compute_distribution() end to end (query,
+load and split) for the largest chama of a seeded dataset and for a chama
+of --chama-rows confirmed contributions added to it once; the first call,
+which fills in the chama's capital summaries, is reported separately.
+Checks that payouts add up to the pool to the cent. Writes
+benchmarks/results/dividends-<commit>.json.
+
+    python -m benchmarks.bench_dividends --rows 1000000 --members 5000
+"""
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from benchmarks.bench_core import timeit
+from benchmarks.common import bench_parser, bench_setup, write_results
+
+def main():
+    parser = bench_parser(__doc__, repeat=5)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--members', type=int, default=5_000)
+    parser.add_argument('--chama-rows', type=int, default=1_000_000, help='contributions in the big chama')
+    args = parser.parse_args()
+
+    from dividends import share_out
+    rng = np.random.default_rng(args.seed)
+    user_ids = rng.integers(1, args.members + 1, args.rows, dtype=np.int64)
+    cents = rng.integers(100, 5_000_000, args.rows, dtype=np.int64)
+    days = rng.integers(1, 366, args.rows, dtype=np.int64)
+    pool = 987_654_321
+    payouts = share_out(user_ids, cents, cents * days, pool)[3]
+    assert int(payouts.sum()) == pool
+    synthetic = timeit(lambda: share_out(user_ids, cents, cents * days, pool), args.repeat)
+
+    app, counts = bench_setup('dividends', args)
+    from dividends import compute_distribution
+    from extensions import db
+    from models import CapitalSummary, Chama, Contribution, Membership
+
+    def distribute(chama_id):
+        # The first call fills in the chama's capital summaries; later ones read them
+        CapitalSummary.query.filter_by(chama_id=chama_id).delete()
+        first = time.perf_counter()
+        result = compute_distribution(chama_id, start, end, 1_000_000)
+        first = (time.perf_counter() - first) * 1000
+        assert sum(round(payout['amount'] * 100) for payout in result['payouts']) == round(result['pool'] * 100)
+        return result, {'first_ms': first,
+                        **timeit(lambda: compute_distribution(chama_id, start, end, 1_000_000), args.repeat)}
+
+    with app.app_context():
+        chama_id, rows = db.session.query(Contribution.chama_id, db.func.count()).group_by(Contribution.chama_id)\
+            .order_by(db.func.count().desc()).first()
+        end = datetime.utcnow().replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
+        start = end.replace(year=end.year - 1)
+        result, end_to_end = distribute(chama_id)
+
+        # Three years of payments from the members of the largest chama, a third of them in the period
+        name = f'Benchmark {args.chama_rows} contributions'
+        big = Chama.query.filter_by(name=name).first()
+        if big is None:
+            users = [user_id for (user_id,) in db.session.query(Membership.user_id).filter_by(chama_id=chama_id)]
+            big = Chama(name=name, join_code=f'B{args.chama_rows}'[:10], contribution_amount=1000,
+                        contribution_frequency='monthly', created_by=users[0], created_at=end - timedelta(days=3 * 365))
+            db.session.add(big)
+            db.session.flush()
+            db.session.add_all(Membership(user_id=user_id, chama_id=big.id, role='member', is_active=True)
+                               for user_id in users)
+            user_index = rng.integers(0, len(users), args.chama_rows)
+            amounts = rng.integers(100, 5_000, args.chama_rows)
+            seconds = rng.integers(0, 3 * 365 * 86400, args.chama_rows)
+            db.session.execute(db.insert(Contribution), [
+                {'user_id': users[index], 'chama_id': big.id, 'amount': amount, 'status': 'confirmed',
+                 'payment_method': 'mpesa', 'contributed_at': end - timedelta(seconds=offset)}
+                for index, amount, offset in zip(user_index.tolist(), amounts.tolist(), seconds.tolist())])
+            db.session.commit()
+        big_result, big_end_to_end = distribute(big.id)
+
+    results = {'dataset': {'scale': args.scale, 'seed': args.seed, **counts},
+               'share_out': {'rows': args.rows, 'members': args.members, **synthetic},
+               'compute_distribution': {'chama_id': chama_id, 'contributions': rows,
+                                        'members': len(result['payouts']), **end_to_end},
+               'compute_distribution_big': {'chama_id': big.id, 'contributions': args.chama_rows,
+                                            'members': len(big_result['payouts']), **big_end_to_end}}
+    print(f"share_out: {args.rows} rows, {args.members} members: {synthetic['median_ms']:.1f} ms")
+    print(f"compute_distribution: chama {chama_id}, {rows} contributions: {end_to_end['median_ms']:.1f} ms "
+          f"({end_to_end['first_ms']:.1f} ms first)")
+    print(f"compute_distribution: chama {big.id}, {args.chama_rows} contributions: "
+          f"{big_end_to_end['median_ms']:.1f} ms ({big_end_to_end['first_ms']:.1f} ms first)")
+    print(f"Results written to {write_results('dividends', results)}")
+
+if __name__ == '__main__':
+    main()
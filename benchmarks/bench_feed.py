@@ -0,0 +1,61 @@
+"""Activity feed: publish cost and first-page reads.
+
+Publishes --events activities spread over the dataset's chamas, then for
+the member with the most chamas times the first and a deep feed page read
+from the fanned-out inbox, and the same reads with every activity left to
+fan-out on read. Writes benchmarks/results/feed-<commit>.json.
+
+    python -m benchmarks.bench_feed --scale small
+"""
+import random
+
+from benchmarks.bench_core import timeit
+from benchmarks.common import bench_parser, bench_setup, write_results
+
+def main():
+    parser = bench_parser(__doc__, repeat=50)
+    parser.add_argument('--events', type=int, default=20_000)
+    args = parser.parse_args()
+
+    app, counts = bench_setup('feed', args)
+    import feed
+    from extensions import db
+    from models import Activity, Chama, InboxItem, Membership
+
+    rng = random.Random(args.seed)
+    results = {'dataset': {'scale': args.scale, 'seed': args.seed, 'events': args.events, **counts}, 'cases': {}}
+    with app.app_context():
+        db.create_all()
+        InboxItem.query.delete()
+        Activity.query.delete()
+        db.session.commit()
+        chama_ids = [chama_id for (chama_id,) in db.session.query(Chama.id)]
+        user_id = db.session.query(Membership.user_id).filter_by(is_active=True).group_by(Membership.user_id)\
+            .order_by(db.func.count().desc()).first()[0]
+
+        def publish():
+            feed.publish(rng.choice(chama_ids), 'contributed', 'Benchmark event')
+        results['cases']['publish'] = timeit(publish, args.repeat)
+        for _ in range(args.events):
+            publish()
+        db.session.commit()
+
+        _, deep = feed.feed_page(user_id, limit=feed.MAX_PAGE)
+        for _ in range(3):
+            _, deep = feed.feed_page(user_id, before=deep, limit=feed.MAX_PAGE)
+        results['cases']['inbox.first_page'] = timeit(lambda: feed.feed_page(user_id), args.repeat)
+        results['cases']['inbox.deep_page'] = timeit(lambda: feed.feed_page(user_id, before=deep), args.repeat)
+
+        Activity.query.update({'fanned_out': False})
+        InboxItem.query.delete()
+        db.session.commit()
+        results['cases']['on_read.first_page'] = timeit(lambda: feed.feed_page(user_id), args.repeat)
+        results['cases']['on_read.deep_page'] = timeit(lambda: feed.feed_page(user_id, before=deep), args.repeat)
+
+    print(f'user {user_id}, {args.events} events over {len(chama_ids)} chamas')
+    for name, stats in results['cases'].items():
+        print(f"{name:<40}{stats['median_ms']:>10.3f} ms")
+    print(f"Results written to {write_results('feed', results)}")
+
+if __name__ == '__main__':
+    main()
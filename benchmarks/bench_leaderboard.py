@@ -0,0 +1,65 @@
+"""Leaderboard lookups: aggregate-and-sort versus the maintained board.
+
+For the chama with the most contributions, times top-N and "my rank" the
+old way (SUM per member over all contributions, sorted) and from the
+maintained leaderboard, plus one in-place update after a confirmation, for
+boards of --members synthetic members. Writes
+benchmarks/results/leaderboard-<commit>.json.
+
+    python -m benchmarks.bench_leaderboard --scale small
+"""
+import random
+
+from benchmarks.bench_core import timeit
+from benchmarks.common import bench_parser, bench_setup, write_results
+
+def main():
+    parser = bench_parser(__doc__, repeat=50)
+    parser.add_argument('--members', type=int, default=100_000)
+    args = parser.parse_args()
+
+    app, counts = bench_setup('leaderboard', args)
+    from archive import all_contributions
+    from extensions import db
+    from leaderboard import Board, Standing, get_board, member_rank, rebuild_leaderboard, top_members
+    from models import Contribution, Membership
+
+    results = {'dataset': {'scale': args.scale, 'seed': args.seed, **counts}, 'cases': {}}
+    with app.app_context():
+        rebuild_leaderboard()
+        chama_id, rows = db.session.query(Contribution.chama_id, db.func.count()).group_by(Contribution.chama_id)\
+            .order_by(db.func.count().desc()).first()
+        user_id = db.session.query(Membership.user_id).filter_by(chama_id=chama_id, is_active=True).first()[0]
+
+        def aggregate_rank():
+            facts = all_contributions()
+            totals = db.session.query(facts.c.user_id, db.func.sum(facts.c.amount).label('total'))\
+                .join(Membership, db.and_(Membership.user_id == facts.c.user_id,
+                                          Membership.chama_id == facts.c.chama_id))\
+                .filter(facts.c.chama_id == chama_id, facts.c.status == 'confirmed', Membership.is_active == True)\
+                .group_by(facts.c.user_id).order_by(db.desc('total'), facts.c.user_id).all()
+            top = totals[:5]
+            return top, next(rank for rank, (member, _) in enumerate(totals, 1) if member == user_id)
+
+        def board_rank():
+            return top_members(chama_id), member_rank(chama_id, user_id)
+
+        get_board(chama_id)
+        results['cases']['aggregate'] = timeit(aggregate_rank, args.repeat)
+        results['cases']['board'] = timeit(board_rank, args.repeat)
+
+    rng = random.Random(args.seed)
+    board = Board({member: Standing(rng.randrange(10_000_000), 0, None, 0.0) for member in range(args.members)})
+    def synthetic_update():
+        member = rng.randrange(args.members)
+        board.update(member, board.standings[member]._replace(cents=board.standings[member].cents + 100_000))
+        board.rank(member)
+    results['cases'][f'board.update_and_rank.{args.members}'] = timeit(synthetic_update, args.repeat * 20)
+
+    print(f'chama {chama_id}: {rows} contributions')
+    for name, stats in results['cases'].items():
+        print(f"{name:<40}{stats['median_ms']:>10.3f} ms")
+    print(f"Results written to {write_results('leaderboard', results)}")
+
+if __name__ == '__main__':
+    main()
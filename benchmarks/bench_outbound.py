@@ -0,0 +1,126 @@
+"""Outbound calls under a misbehaving provider.
+
+Runs MPesaService and SMSService against the local stubs and degrades
+them while timing each call: healthy, hanging (every response stalls for
+--hang-ms), recovering, flaky (--error-rate of calls answer 503) and
+M-Pesa hanging while SMS is healthy, from --threads concurrent callers.
+A bare requests call with no timeout against the hanging stub is the
+baseline. Timeouts and the breaker's reset are scaled down so the run
+takes seconds; the /metrics series it leaves are printed at the end.
+Writes benchmarks/results/outbound-<commit>.json.
+
+    python -m benchmarks.bench_outbound
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import summarize, write_results
+from benchmarks.stubs import StubIntegrationServer, StubSMSClient, install_stubs
+
+SETTINGS = {
+    'mpesa': {'connect_timeout': 0.5, 'read_timeout': 1.0, 'deadline': 2.0, 'retries': 2,
+              'backoff': 0.05, 'max_backoff': 0.2, 'failures': 5, 'reset_after': 2.0},
+    'sms': {'connect_timeout': 0.5, 'read_timeout': 1.0, 'deadline': 2.0, 'retries': 1,
+            'backoff': 0.05, 'max_backoff': 0.2, 'failures': 5, 'reset_after': 2.0},
+}
+
+def run(calls, func):
+    """Time `calls` calls of func(); returns latency summary and success count"""
+    samples, ok = [], 0
+    for _ in range(calls):
+        start = time.perf_counter()
+        ok += bool(func())
+        samples.append(time.perf_counter() - start)
+    return {**summarize(samples), 'ok': ok}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--calls', type=int, default=40)
+    parser.add_argument('--hang-ms', type=int, default=5000)
+    parser.add_argument('--error-rate', type=float, default=0.3)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    os.environ.setdefault('DATABASE_URL', 'sqlite://')
+    import requests
+
+    import outbound
+    from app import app
+    from extensions import metrics
+    from utils import MPesaService, SMSService
+
+    stub = StubIntegrationServer(latency_ms=(20, 60), seed=args.seed, hang_ms=args.hang_ms).start()
+    sms_stub = StubSMSClient(latency_ms=(20, 60), seed=args.seed, hang_ms=args.hang_ms)
+    install_stubs(app, stub.url, sms_stub)
+    app.config['OUTBOUND_DEPENDENCIES'] = SETTINGS
+    outbound.reset_clients()
+
+    results = {'settings': SETTINGS, 'hang_ms': args.hang_ms, 'error_rate': args.error_rate, 'cases': {}}
+    cases = results['cases']
+    with app.app_context():
+        mpesa, sms = MPesaService(), SMSService()
+        breaker = outbound.get_client('mpesa').breaker
+
+        def push():
+            return mpesa.initiate_stk_push('0712345678', 100, 'bench', 'Benchmark')
+
+        def text():
+            return sms.send_sms('0712345678', 'Benchmark')
+
+        cases['healthy.stk_push'] = run(args.calls, push)
+        cases['healthy.sms'] = run(args.calls, text)
+
+        stub.hang_rate = sms_stub.hang_rate = 1.0
+        start = time.perf_counter()
+        requests.get(f'{stub.url}/oauth/v1/generate')
+        cases['hanging.no_timeout'] = summarize([time.perf_counter() - start])
+        cases['hanging.stk_push'] = run(args.calls, push)
+        cases['hanging.breaker'] = breaker.state
+        cases['hanging.sms'] = run(args.calls, text)
+
+        stub.hang_rate = sms_stub.hang_rate = 0.0
+        time.sleep(SETTINGS['mpesa']['reset_after'])
+        cases['recovered.stk_push'] = run(1, push)
+        cases['recovered.breaker'] = breaker.state
+
+        stub.error_rate = args.error_rate
+        cases['flaky.stk_push'] = run(args.calls, push)
+        cases['flaky.breaker'] = breaker.state
+        stub.error_rate = 0.0
+        outbound.reset_clients()
+
+        # A hung provider must not hold up calls to the other
+        stub.hang_rate = 1.0
+        with ThreadPoolExecutor(args.threads) as pool:
+            def call(func):
+                with app.app_context():
+                    start = time.perf_counter()
+                    func()
+                    return time.perf_counter() - start
+            pushes = [pool.submit(call, push) for _ in range(args.threads // 2)]
+            texts = [pool.submit(call, text) for _ in range(args.calls)]
+            cases['isolation.sms'] = summarize([future.result() for future in texts])
+            cases['isolation.stk_push'] = summarize([future.result() for future in pushes])
+        stub.hang_rate = 0.0
+
+        app.config['METRICS_TOKEN'] = 'bench'
+        with app.test_request_context(headers={'Authorization': 'Bearer bench'}):
+            exposition = metrics.metrics_view().get_data(as_text=True)
+    stub.stop()
+
+    for name, stats in cases.items():
+        if isinstance(stats, dict):
+            print(f"{name:<24}{stats['median_ms']:>10.1f} ms median{stats['max_ms']:>10.1f} ms max"
+                  + (f"{stats['ok']:>6}/{stats['runs']} ok" if 'ok' in stats else ''))
+        else:
+            print(f'{name:<24}{stats:>10}')
+    print()
+    print('\n'.join(line for line in exposition.splitlines()
+                    if line.startswith(('chamastack_outbound_requests_total', 'chamastack_outbound_circuit'))))
+    print(f"Results written to {write_results('outbound', results)}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""API payload size per endpoint and representation.
+
+Fetches each /api endpoint (Flask and the async /api/v1 tier) as JSON and
+MessagePack, uncompressed, gzip and brotli, and reports bytes on the wire,
+server-side encode time and the estimated transfer time on a 3G link.
+Writes benchmarks/results/payloads-<commit>.json.
+
+    python -m benchmarks.bench_payloads --scale small
+"""
+import asyncio
+import time
+
+from benchmarks.bench_core import logged_in_client, pick_targets
+from benchmarks.bench_votes import session_cookies
+from benchmarks.common import bench_parser, bench_setup, write_results
+
+# (name, Accept, Accept-Encoding)
+REPRESENTATIONS = [
+    ('json', 'application/json', 'identity'),
+    ('json+gzip', 'application/json', 'gzip'),
+    ('json+br', 'application/json', 'br'),
+    ('msgpack', 'application/msgpack', 'identity'),
+    ('msgpack+br', 'application/msgpack', 'br'),
+]
+
+# Typical 3G: ~400 kbit/s down, 300 ms round trip
+LINK_BYTES_PER_S = 400_000 / 8
+LINK_RTT_S = 0.3
+
+def transfer_ms(size):
+    return round((LINK_RTT_S + size / LINK_BYTES_PER_S) * 1000, 1)
+
+def measure(fetch, repeat):
+    """Median fetch time and the body size of the last response"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        size = fetch()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return size, round(samples[len(samples) // 2] * 1000, 3)
+
+def flask_cases(app, targets, repeat):
+    client = logged_in_client(app, targets['user_id'])
+    paths = {
+        'chama_stats_api': f"/api/chama/{targets['chama_id']}/stats",
+        'search_api': '/api/search?q=ama',
+    }
+    results = {}
+    for endpoint, path in paths.items():
+        for name, accept, encoding in REPRESENTATIONS:
+            def fetch():
+                response = client.get(path, headers={'Accept': accept, 'Accept-Encoding': encoding})
+                assert response.status_code == 200, (path, response.status_code)
+                return len(response.data)
+            results.setdefault(endpoint, {})[name] = measure(fetch, repeat)
+    return results
+
+async def async_cases(app, targets, repeat):
+    import httpx
+    from api import api
+
+    chama_id = targets['chama_id']
+    paths = {
+        'v1.dashboard': '/api/v1/dashboard',
+        'v1.chama_detail': f'/api/v1/chamas/{chama_id}',
+        'v1.contributions': f'/api/v1/chamas/{chama_id}/contributions',
+        'v1.contributions.fields': f'/api/v1/chamas/{chama_id}/contributions?fields=contributions.id,'
+                                   f'contributions.amount,contributions.contributed_at,next_before',
+    }
+    cookie = session_cookies(app, [targets['user_id']])[targets['user_id']]
+    results = {}
+    async with api.router.lifespan_context(api):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=api), base_url='http://api',
+                                     cookies={'session': cookie}) as client:
+            for endpoint, path in paths.items():
+                for name, accept, encoding in REPRESENTATIONS:
+                    samples = []
+                    for _ in range(repeat):
+                        start = time.perf_counter()
+                        response = await client.get(path, headers={'Accept': accept, 'Accept-Encoding': encoding})
+                        samples.append(time.perf_counter() - start)
+                    assert response.status_code == 200, (path, response.status_code)
+                    samples.sort()
+                    results.setdefault(endpoint, {})[name] = (response.num_bytes_downloaded,
+                                                              round(samples[len(samples) // 2] * 1000, 3))
+    return results
+
+def main():
+    parser = bench_parser(__doc__)
+    args = parser.parse_args()
+
+    app, counts = bench_setup('bench', args)
+    # Compress everything so small payloads show up in the comparison too
+    app.extensions['payloads'].min_size = 0
+    app.config['API_COMPRESS_MIN_SIZE'] = 0
+    targets = pick_targets(app, args.seed)
+    measured = flask_cases(app, targets, args.repeat)
+    measured.update(asyncio.run(async_cases(app, targets, args.repeat)))
+
+    results = {'dataset': {'scale': args.scale, 'seed': args.seed, **counts}, 'endpoints': {}}
+    print(f"{'endpoint':<26}" + ''.join(f'{name:>22}' for name, *_ in REPRESENTATIONS))
+    for endpoint, representations in measured.items():
+        row = results['endpoints'][endpoint] = {
+            name: {'bytes': size, 'median_ms': ms, 'transfer_3g_ms': transfer_ms(size)}
+            for name, (size, ms) in representations.items()
+        }
+        print(f'{endpoint:<26}' + ''.join(f"{row[name]['bytes']:>9} B {row[name]['median_ms']:>7.2f} ms  "
+                                          for name, *_ in REPRESENTATIONS))
+    print(f"Results written to {write_results('payloads', results)}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""Arrears and late-penalty job: full and incremental runs.
+
+Gives every chama of a seeded dataset a penalty rule, times a full
+compute_penalties() run, an incremental run straight after (nothing new),
+and one after a back-dated contribution is confirmed in the largest chama.
+Then --rounds incremental runs over --chamas chamas, each after new and
+back-dated payments, are checked cell for cell against a full recompute
+at the same time; any difference fails the benchmark.
+Writes benchmarks/results/penalties-<commit>.json.
+
+    python -m benchmarks.bench_penalties --scale small
+"""
+import random
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.common import bench_parser, bench_setup, write_results
+
+def main():
+    parser = bench_parser(__doc__, repeat=None)
+    parser.add_argument('--rounds', type=int, default=4, help='incremental runs before the consistency check')
+    parser.add_argument('--chamas', type=int, default=6, help='chamas changed between those runs')
+    args = parser.parse_args()
+
+    app, counts = bench_setup('penalties', args)
+    from extensions import db
+    from models import Chama, Contribution, MemberPenalty, Membership, PenaltyRule
+    from penalties import compute_penalties, invalidate_penalties, save_rule
+
+    def run(label, chama_id=None):
+        start = time.perf_counter()
+        cells = compute_penalties(chama_id)
+        elapsed = time.perf_counter() - start
+        print(f'{label:<24}{cells:>10} cells{elapsed:>10.2f} s')
+        return {'cells': cells, 'seconds': round(elapsed, 3)}
+
+    results = {'dataset': {'scale': args.scale, 'seed': args.seed, **counts}}
+    with app.app_context():
+        for chama in Chama.query.all():
+            save_rule(chama.id, grace_days=3, fine_type='percent', fine_amount=10, max_fine=500, max_total=5000)
+        db.session.commit()
+        results['full'] = run('full')
+        results['stored_cells'] = MemberPenalty.query.count()
+        results['incremental'] = run('incremental')
+
+        chama_id = db.session.query(Contribution.chama_id).group_by(Contribution.chama_id)\
+            .order_by(db.func.count().desc()).limit(1).scalar()
+        pending = Contribution.query.filter_by(chama_id=chama_id, status='pending')\
+            .order_by(Contribution.contributed_at).first()
+        if pending is not None:
+            pending.status = 'confirmed'
+            invalidate_penalties(chama_id, pending.contributed_at)
+            db.session.commit()
+            results['back_dated'] = run(f'back-dated {pending.contributed_at:%Y-%m-%d}')
+        db.session.rollback()
+
+        # Incremental runs must store exactly what a full recompute would
+        rng = random.Random(args.seed)
+        now = datetime.utcnow()
+        chama_ids = [chama_id for (chama_id,) in db.session.query(Contribution.chama_id)
+                     .group_by(Contribution.chama_id).order_by(db.func.count().desc()).limit(args.chamas)]
+        compute_penalties(now=now)
+        for _ in range(args.rounds):
+            for chama_id in chama_ids:
+                members = [user_id for (user_id,) in db.session.query(Membership.user_id)
+                           .filter_by(chama_id=chama_id, is_active=True)]
+                amount = db.session.get(Chama, chama_id).contribution_amount
+                for user_id in rng.sample(members, min(3, len(members))):
+                    # New payments since the last run, and back-dated ones up to a year old
+                    for days in (rng.uniform(0, 7), rng.uniform(7, 365)):
+                        contributed_at = now - timedelta(days=days)
+                        db.session.add(Contribution(user_id=user_id, chama_id=chama_id, amount=amount,
+                                                    status='confirmed', contributed_at=contributed_at))
+                        invalidate_penalties(chama_id, contributed_at)
+            db.session.commit()
+            compute_penalties(now=now)
+
+        def cells():
+            return {(cell.chama_id, cell.user_id, cell.period_start):
+                    (cell.shortfall, cell.outstanding, cell.settled_at, cell.days_late, cell.fine)
+                    for cell in MemberPenalty.query.filter(MemberPenalty.chama_id.in_(chama_ids))}
+        incremental = cells()
+        PenaltyRule.query.update({'computed_at': None})
+        db.session.commit()
+        compute_penalties(now=now)
+        full = cells()
+        differing = sorted(key for key in incremental.keys() | full.keys() if incremental.get(key) != full.get(key))
+        results['consistency'] = {'rounds': args.rounds, 'chamas': len(chama_ids), 'cells': len(full),
+                                  'differing': len(differing)}
+        print(f'incremental vs full: {len(differing)} of {len(full)} cells differ')
+        for key in differing[:10]:
+            print(f'  {key}: incremental {incremental.get(key)}, full {full.get(key)}')
+    print(f"Results written to {write_results('penalties', results)}")
+    if results['consistency']['differing']:
+        raise SystemExit('Incremental runs disagree with a full recompute')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""Cold-start benchmark: time to import the app and serve a first request.
+
+Each run is a fresh interpreter so nothing is cached between runs.
+
+    python -m benchmarks.bench_startup --runs 20
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+from benchmarks.common import ROOT, summarize, write_results
+
+COLD_START = """
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.app.test_client()
+client.get('/')
+served = time.perf_counter()
+print(json.dumps({'import': imported - start, 'first_request': served - imported}))
+"""
+
+def run_once():
+    output = subprocess.check_output([sys.executable, '-c', COLD_START], cwd=ROOT)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+def slowest_imports(limit=15):
+    """Return the modules with the largest cumulative import time"""
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'],
+                          cwd=ROOT, capture_output=True, text=True, check=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, module = line.split('|')
+        rows.append({'module': module.strip(), 'cumulative_ms': int(cumulative_us) / 1000})
+    rows.sort(key=lambda row: row['cumulative_ms'], reverse=True)
+    return rows[:limit]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    samples = [run_once() for _ in range(args.runs)]
+    results = {
+        'import': summarize([s['import'] for s in samples]),
+        'first_request': summarize([s['first_request'] for s in samples]),
+        'total': summarize([s['import'] + s['first_request'] for s in samples]),
+        'slowest_imports': slowest_imports(),
+    }
+    path = write_results('startup', results)
+    for key in ('import', 'first_request', 'total'):
+        print(f"{key:>14}: median {results[key]['median_ms']:.1f} ms")
+    print(f'Results written to {path}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Monthly statements: per-member loading versus one load per chama, and the pool.
+
+For the month of the latest contribution, renders --chamas chamas' statements
+one member at a time (queries per member) and a chama at a time, then the
+whole dataset with generate_statements() serially and across --workers
+processes. Files go to a temporary directory. Writes
+benchmarks/results/statements-<commit>.json.
+
+    python -m benchmarks.bench_statements --scale small --workers 4
+"""
+import os
+import tempfile
+import time
+
+from benchmarks.bench_core import timeit
+from benchmarks.common import bench_parser, bench_setup, write_results
+
+def main():
+    parser = bench_parser(__doc__, repeat=3)
+    parser.add_argument('--chamas', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    app, counts = bench_setup('statements', args)
+    app.config['STATEMENT_DIR'] = tempfile.mkdtemp(prefix='statements-')
+    from archive import month_start
+    from extensions import db
+    from models import Chama, Contribution, Membership, Statement
+    from statements import generate_chama, generate_statements
+
+    results = {'dataset': {'scale': args.scale, 'seed': args.seed, 'workers': args.workers, **counts}, 'cases': {}}
+    with app.app_context():
+        db.create_all()
+        start = month_start(db.session.query(db.func.max(Contribution.contributed_at)).scalar())
+        chama_ids = [chama_id for (chama_id,) in db.session.query(Chama.id).order_by(Chama.id).limit(args.chamas)]
+        members = db.session.query(Membership.chama_id, Membership.user_id)\
+            .filter(Membership.chama_id.in_(chama_ids), Membership.is_active == True).all()
+
+        def per_member():
+            for chama_id, user_id in members:
+                generate_chama(chama_id, start, user_ids=[user_id])
+            db.session.rollback()
+
+        def per_chama():
+            for chama_id in chama_ids:
+                generate_chama(chama_id, start)
+            db.session.rollback()
+
+        # Fill balance checkpoints first so no case pays for them
+        per_chama()
+        db.session.commit()
+        results['cases'][f'per_member.{len(members)}'] = timeit(per_member, args.repeat)
+        results['cases'][f'per_chama.{len(members)}'] = timeit(per_chama, args.repeat)
+
+        for workers in sorted({1, args.workers}):
+            Statement.query.delete()
+            db.session.commit()
+            began = time.perf_counter()
+            count = generate_statements(app, start, workers=workers)
+            elapsed = time.perf_counter() - began
+            results['cases'][f'generate_statements.workers_{workers}'] = {
+                'statements': count, 'seconds': elapsed, 'per_second': count / elapsed}
+
+    print(f'{start:%B %Y}')
+    for name, stats in results['cases'].items():
+        if 'median_ms' in stats:
+            print(f"{name:<40}{stats['median_ms']:>10.1f} ms")
+        else:
+            print(f"{name:<40}{stats['seconds']:>10.2f} s  {stats['statements']} statements")
+    print(f"Results written to {write_results('statements', results)}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Delta sync versus a full reload.
+
+Pages a busy member through /api/sync from 0 (what a fresh install or the
+old re-download-everything launch costs), then applies N writes to their
+chama and syncs again from the saved cursor, reporting requests, rows,
+bytes and time for each. Writes benchmarks/results/sync-<commit>.json.
+
+    python -m benchmarks.bench_sync --scale small --changes 10
+"""
+import time
+
+from benchmarks.bench_core import logged_in_client, pick_targets
+from benchmarks.common import bench_parser, bench_setup, write_results
+
+def sync(client, since, limit):
+    """Page until has_more is clear; returns (cursor, requests, rows, bytes, seconds)"""
+    requests = rows = size = 0
+    start = time.perf_counter()
+    while True:
+        response = client.get(f'/api/sync?since={since}&limit={limit}')
+        assert response.status_code == 200, response.status_code
+        page = response.get_json()
+        requests += 1
+        rows += len(page['changes'])
+        size += len(response.data)
+        since = page['cursor']
+        if not page['has_more']:
+            return since, requests, rows, size, time.perf_counter() - start
+
+def make_changes(app, chama_id, count):
+    """Touch `count` contributions in the chama and delete one expense"""
+    from extensions import db
+    from models import Contribution, Expense
+    with app.app_context():
+        for contribution in Contribution.query.filter_by(chama_id=chama_id)\
+                .order_by(Contribution.id.desc()).limit(count):
+            contribution.transaction_ref = f'SYNC{contribution.id}'
+        expense = Expense.query.filter_by(chama_id=chama_id).first()
+        if expense:
+            db.session.delete(expense)
+        db.session.commit()
+
+def main():
+    parser = bench_parser(__doc__, repeat=None)
+    parser.add_argument('--changes', type=int, default=10)
+    parser.add_argument('--limit', type=int, default=200, help='page size')
+    args = parser.parse_args()
+
+    app, counts = bench_setup('sync', args)
+    targets = pick_targets(app, args.seed)
+    client = logged_in_client(app, targets['user_id'])
+
+    measured = {}
+    cursor, *measured['full'] = sync(client, 0, args.limit)
+    make_changes(app, targets['chama_id'], args.changes)
+    _, *measured['delta'] = sync(client, cursor, args.limit)
+
+    results = {'dataset': {'scale': args.scale, 'seed': args.seed, **counts},
+               'changes': args.changes, 'limit': args.limit, 'syncs': {}}
+    print(f"{'sync':<8}{'requests':>10}{'rows':>10}{'bytes':>12}{'ms':>10}")
+    for name, (requests, rows, size, seconds) in measured.items():
+        results['syncs'][name] = {'requests': requests, 'rows': rows, 'bytes': size,
+                                  'ms': round(seconds * 1000, 1)}
+        print(f'{name:<8}{requests:>10}{rows:>10}{size:>12}{seconds * 1000:>10.1f}')
+    print(f"Results written to {write_results('sync', results)}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""Concurrent vote submission test.
+
+Opens a fresh vote in every chama of the dataset, then has every active
+member submit to it --repeat times, all fired in parallel over HTTP
+against a forked server. Afterwards it checks that each member ended up
+with exactly one response, and reports throughput and status codes.
+Shed requests (429/503) are retried after Retry-After. Exits non-zero if
+any response is missing or duplicated.
+
+    python -m benchmarks.bench_votes --scale tiny --repeat 3 --concurrency 64
+"""
+import multiprocessing
+import os
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from benchmarks.common import bench_parser, bench_setup, summarize, write_results
+from benchmarks.loadtest import percentile, serve
+
+def open_votes(app, seed):
+    """Create one open vote per chama; return [(chama_id, vote_id, vote_type, option_ids, member_ids)]"""
+    from extensions import db
+    from models import Chama, Membership, Vote, VoteOption
+
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    targets = []
+    with app.app_context():
+        members = {}
+        for chama_id, user_id in db.session.query(Membership.chama_id, Membership.user_id)\
+                .filter(Membership.is_active == True):
+            members.setdefault(chama_id, []).append(user_id)
+        for chama in Chama.query.filter(Chama.id.in_(members)).all():
+            vote_type = rng.choice(['binary', 'multiple_choice', 'percentage'])
+            vote = Vote(chama_id=chama.id, title='Concurrency test', created_by=chama.created_by,
+                        closes_at=now + timedelta(hours=1), vote_type=vote_type)
+            db.session.add(vote)
+            db.session.flush()
+            texts = {'binary': ['Yes', 'No'], 'multiple_choice': ['A', 'B', 'C'], 'percentage': []}[vote_type]
+            options = [VoteOption(vote_id=vote.id, option_text=text) for text in texts]
+            db.session.add_all(options)
+            db.session.flush()
+            targets.append((chama.id, vote.id, vote_type, [o.id for o in options], members[chama.id]))
+        db.session.commit()
+    return targets
+
+def session_cookies(app, user_ids):
+    """Signed Flask-Login session cookies, so the test doesn't spend its time hashing passwords"""
+    serializer = app.session_interface.get_signing_serializer(app)
+    return {user_id: serializer.dumps({'_user_id': str(user_id), '_fresh': True}) for user_id in user_ids}
+
+def main():
+    parser = bench_parser(__doc__, repeat=None, scale='tiny')
+    parser.add_argument('--repeat', type=int, default=3, help='submissions per member per vote')
+    parser.add_argument('--concurrency', type=int, default=64, help='parallel client threads')
+    parser.add_argument('--port', type=int, default=5056)
+    args = parser.parse_args()
+
+    app, counts = bench_setup('votes', args)
+    targets = open_votes(app, args.seed)
+    cookies = session_cookies(app, {user_id for *_, member_ids in targets for user_id in member_ids})
+
+    rng = random.Random(args.seed)
+    submissions = []
+    for chama_id, vote_id, vote_type, option_ids, member_ids in targets:
+        for user_id in member_ids:
+            for _ in range(args.repeat):
+                if vote_type == 'percentage':
+                    data = {'percentage': rng.randint(0, 100)}
+                else:
+                    data = {'option_id': rng.choice(option_ids)}
+                submissions.append((f'/chama/{chama_id}/vote/{vote_id}/vote', user_id, data))
+    rng.shuffle(submissions)
+
+    ready = multiprocessing.get_context('fork').Event()
+    server = multiprocessing.get_context('fork').Process(
+        target=serve, args=(os.environ['DATABASE_URL'], args.port, ready), daemon=True)
+    server.start()
+    ready.wait(30)
+    base_url = f'http://127.0.0.1:{args.port}'
+
+    import requests
+    local = threading.local()
+    statuses = Counter()
+    latencies = []
+    lock = threading.Lock()
+
+    def submit(submission):
+        path, user_id, data = submission
+        http = getattr(local, 'http', None)
+        if http is None:
+            http = local.http = requests.Session()
+        while True:
+            # Connections are shared between users; only ever send this user's session
+            http.cookies.clear()
+            start = time.perf_counter()
+            response = http.post(base_url + path, data=data, cookies={'session': cookies[user_id]},
+                                 allow_redirects=False, timeout=30)
+            with lock:
+                latencies.append(time.perf_counter() - start)
+                statuses[response.status_code] += 1
+            if response.status_code not in (429, 503):
+                return
+            time.sleep(float(response.headers.get('Retry-After', 1)) * random.uniform(0.1, 0.5))
+
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            list(pool.map(submit, submissions))
+    finally:
+        elapsed = time.perf_counter() - start
+        server.terminate()
+        server.join()
+
+    from extensions import db
+    from models import VoteResponse
+    from sqlalchemy import func
+    vote_ids = [vote_id for _, vote_id, *_ in targets]
+    with app.app_context():
+        recorded = dict(((vote_id, user_id), count) for vote_id, user_id, count in
+                        db.session.query(VoteResponse.vote_id, VoteResponse.user_id, func.count(VoteResponse.id))
+                        .filter(VoteResponse.vote_id.in_(vote_ids))
+                        .group_by(VoteResponse.vote_id, VoteResponse.user_id))
+    expected = {(vote_id, user_id) for _, vote_id, _, _, member_ids in targets for user_id in member_ids}
+    missing = len(expected - set(recorded))
+    duplicated = sum(1 for count in recorded.values() if count > 1)
+
+    results = {
+        'dataset': {'scale': args.scale, 'seed': args.seed, **counts},
+        'votes': len(targets),
+        'submissions': len(submissions),
+        'concurrency': args.concurrency,
+        'elapsed_s': round(elapsed, 2),
+        'throughput_rps': round(sum(statuses.values()) / elapsed, 2),
+        'statuses': {str(k): v for k, v in sorted(statuses.items())},
+        'latency': summarize(latencies),
+        'p95_ms': round(percentile(sorted(latencies), 95) * 1000, 3),
+        'expected_responses': len(expected),
+        'recorded_responses': sum(recorded.values()),
+        'missing': missing,
+        'duplicated': duplicated,
+    }
+    print(f"{len(submissions)} submissions ({len(expected)} distinct member/vote pairs) "
+          f"in {elapsed:.1f}s, {results['throughput_rps']} req/s, statuses {results['statuses']}")
+    print(f"p50 {results['latency']['median_ms']:.1f} ms, p95 {results['p95_ms']:.1f} ms")
+    print(f"Recorded {results['recorded_responses']} responses: {missing} missing, {duplicated} duplicated")
+    print(f"Results written to {write_results('votes', results)}")
+    if missing or duplicated:
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import warnings
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+def git_revision():
+    """Return the short hash of the checked-out commit, or 'unknown'"""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def summarize(samples):
+    """Summarize a list of timings (seconds) in milliseconds"""
+    ordered = sorted(samples)
+    return {
+        'runs': len(ordered),
+        'min_ms': round(ordered[0] * 1000, 3),
+        'median_ms': round(statistics.median(ordered) * 1000, 3),
+        'mean_ms': round(statistics.fmean(ordered) * 1000, 3),
+        'max_ms': round(ordered[-1] * 1000, 3),
+    }
+
+def write_results(name, results):
+    """Write benchmark results to benchmarks/results/<name>-<commit>.json"""
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    revision = git_revision()
+    payload = {
+        'benchmark': name,
+        'commit': revision,
+        'recorded_at': datetime.utcnow().isoformat(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'results': results,
+    }
+    path = os.path.join(RESULTS_DIR, f'{name}-{revision}.json')
+    with open(path, 'w') as f:
+        json.dump(payload, f, indent=2)
+    return path
+
+def schema_revision():
+    """Alembic head revision, so a dataset seeded under an older schema is noticed"""
+    from alembic.script import ScriptDirectory
+    return ScriptDirectory(os.path.join(ROOT, 'migrations')).get_current_head()
+
+def setup_database(name, scale, seed, reseed=False, database_url=None, now=None):
+    """Point the app at the benchmark database, seeding it if needed.
+
+    Defaults to a SQLite file under benchmarks/results, reseeded whenever
+    it was seeded at another migration head. An explicit database_url is
+    only (re)seeded when reseed is set, since seeding drops every table.
+    """
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f'{name}-{scale}-{seed}.db')
+    os.environ['DATABASE_URL'] = database_url or f'sqlite:///{path}'
+    # The models' overlapping relationships warn on first mapper configuration
+    warnings.filterwarnings('ignore', message='relationship .* will copy column')
+
+    from app import app
+    from benchmarks.datagen import SCALES, generate
+    marker = path + '.json'
+    revision = schema_revision()
+    seeded = None
+    if os.path.exists(marker):
+        with open(marker) as f:
+            seeded = json.load(f)
+    current = seeded is not None and seeded.get('schema') == revision
+    if reseed or (not database_url and not current):
+        with app.app_context():
+            counts = generate(seed=seed, now=now, **SCALES[scale])
+        seeded = {'schema': revision, 'counts': counts}
+        with open(marker, 'w') as f:
+            json.dump(seeded, f)
+    elif seeded is None:
+        raise SystemExit('Dataset not seeded yet; pass --reseed to seed it')
+    elif not current:
+        raise SystemExit(f"Dataset was seeded at schema {seeded.get('schema')}, not {revision}; "
+                         'pass --reseed to seed it again')
+    return app, seeded['counts']
+
+def bench_parser(description, repeat=20, scale='small', reseed=True):
+    """Argument parser with the dataset options every seeded benchmark takes.
+
+    Pass repeat=None for benchmarks that are not timed in repeated runs and
+    reseed=False for those that always reseed; add any other options to the
+    returned parser.
+    """
+    from benchmarks.datagen import SCALES
+    parser = argparse.ArgumentParser(description=description, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', choices=sorted(SCALES), default=scale)
+    parser.add_argument('--seed', type=int, default=42)
+    if repeat is not None:
+        parser.add_argument('--repeat', type=int, default=repeat)
+    if reseed:
+        parser.add_argument('--reseed', action='store_true', help='regenerate the dataset')
+    parser.add_argument('--database-url', help='benchmark against this database instead of SQLite')
+    return parser
+
+def bench_setup(name, args, reseed=None):
+    """setup_database() with the options parsed by bench_parser()"""
+    if reseed is None:
+        reseed = args.reseed
+    return setup_database(name, args.scale, args.seed, reseed, args.database_url)
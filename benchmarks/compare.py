@@ -0,0 +1,44 @@
+"""Compare two benchmark result files and flag regressions.
+
+    python -m benchmarks.compare benchmarks/results/core-abc123.json benchmarks/results/core-def456.json
+"""
+import argparse
+import json
+import sys
+
+def load_cases(path):
+    with open(path) as f:
+        payload = json.load(f)
+    results = payload['results']
+    return payload.get('commit', '?'), results.get('cases', results)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='percent slowdown in the median that counts as a regression')
+    args = parser.parse_args()
+
+    base_commit, base = load_cases(args.baseline)
+    cand_commit, cand = load_cases(args.candidate)
+    print(f"{'case':<42} {base_commit:>12} {cand_commit:>12} {'change':>9}")
+
+    regressions = 0
+    for name in sorted(set(base) | set(cand)):
+        old = base.get(name, {}).get('median_ms') if isinstance(base.get(name), dict) else None
+        new = cand.get(name, {}).get('median_ms') if isinstance(cand.get(name), dict) else None
+        if old is None or new is None:
+            print(f"{name:<42} {old or '-':>12} {new or '-':>12} {'':>9}")
+            continue
+        change = (new - old) / old * 100 if old else 0.0
+        flag = ''
+        if change > args.threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        print(f'{name:<42} {old:>12.3f} {new:>12.3f} {change:>+8.1f}%{flag}')
+
+    sys.exit(1 if regressions else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+"""Seeded synthetic dataset generator.
+
+Builds users, chamas, memberships, contributions, expenses, votes and vote
+responses through the models in models.py. The same seed and scale always
+produce the same rows, so benchmark runs are comparable between commits.
+
+    DATABASE_URL=sqlite:////tmp/bench.db python -m benchmarks.datagen --scale full
+"""
+import argparse
+import random
+import string
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, text
+from werkzeug.security import generate_password_hash
+
+SCALES = {
+    'tiny': dict(users=200, chamas=40, contributions=5000, vote_responses=500),
+    'small': dict(users=2000, chamas=400, contributions=100000, vote_responses=5000),
+    'full': dict(users=10000, chamas=2000, contributions=1000000, vote_responses=50000),
+}
+
+# Every generated user logs in with this password
+PASSWORD = 'password123'
+
+FIRST_NAMES = ['Wanjiku', 'Kamau', 'Achieng', 'Otieno', 'Njeri', 'Mwangi', 'Akinyi', 'Ochieng',
+               'Wairimu', 'Kiprono', 'Chebet', 'Mutua', 'Nduta', 'Kipchoge', 'Atieno', 'Omondi',
+               'Wambui', 'Kariuki', 'Nafula', 'Wekesa', 'Muthoni', 'Barasa', 'Jepkosgei', 'Maina']
+LAST_NAMES = ['Kamau', 'Otieno', 'Wanjiru', 'Odhiambo', 'Mutiso', 'Kiptoo', 'Njoroge', 'Ouma',
+              'Mwende', 'Korir', 'Gitau', 'Onyango', 'Chege', 'Rotich', 'Wafula', 'Nyambura']
+CHAMA_WORDS = ['Umoja', 'Tujenge', 'Jirani', 'Maendeleo', 'Harambee', 'Imani', 'Baraka', 'Upendo',
+               'Mwangaza', 'Tumaini', 'Amani', 'Neema', 'Faida', 'Shangwe', 'Pamoja', 'Wekeza']
+CHAMA_KINDS = ['Women Group', 'Investment Club', 'Welfare', 'Sacco', 'Merry-Go-Round', 'Youth Group']
+PAYMENT_METHODS = ['mpesa'] * 8 + ['cash', 'bank']
+EXPENSE_TITLES = ['Meeting venue', 'Bank charges', 'Welfare support', 'Stationery', 'Land rates',
+                  'Transport', 'Investment deposit', 'Audit fees']
+
+CHUNK = 10000
+
+def phone_number(rng, index):
+    """Kenyan mobile number, unique per index, in one of the formats people type"""
+    digits = f'7{index:08d}' if index < 10 ** 8 else f'1{index % 10 ** 8:08d}'
+    style = rng.random()
+    if style < 0.6:
+        return f'0{digits}'
+    if style < 0.85:
+        return f'+254{digits}'
+    return f'254{digits}'
+
+def transaction_ref(rng):
+    """M-Pesa style receipt number, e.g. QFT4K2L9XA"""
+    alphabet = string.ascii_uppercase + string.digits
+    return ''.join(rng.choice(alphabet) for _ in range(10))
+
+def _insert(model, rows):
+    from extensions import db
+    for start in range(0, len(rows), CHUNK):
+        db.session.execute(insert(model), rows[start:start + CHUNK])
+
+def _reset_sequences(models):
+    """Move PostgreSQL id sequences past the explicitly assigned ids"""
+    from extensions import db
+    if db.engine.dialect.name != 'postgresql':
+        return
+    for model in models:
+        table = model.__tablename__
+        db.session.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('\"{table}\"', 'id'), "
+            f"COALESCE((SELECT MAX(id) FROM \"{table}\"), 1))"
+        ))
+
+def generate(seed=42, users=2000, chamas=400, contributions=100000, vote_responses=5000,
+             years=3, now=None):
+    """Drop and recreate all tables, then fill them with a seeded dataset.
+
+    Must be called inside an app context. Returns a dict of row counts.
+    """
+    from extensions import db
+    from models import (User, Chama, Membership, Contribution, Expense, Goal, Vote,
+                        VoteOption, VoteResponse)
+    from utils import normalize_kenyan_phones
+
+    rng = random.Random(seed)
+    now = now or datetime(2026, 1, 1)
+    history_start = now - timedelta(days=365 * years)
+    history_seconds = int((now - history_start).total_seconds())
+
+    db.drop_all()
+    db.create_all()
+
+    # One hash for everyone; hashing 10k passwords would dominate the run
+    password_hash = generate_password_hash(PASSWORD)
+    user_rows = [{
+        'id': i,
+        'phone_number': phone_number(rng, i),
+        'name': f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+        'password_hash': password_hash,
+        'joined_at': history_start + timedelta(seconds=rng.randrange(history_seconds)),
+    } for i in range(1, users + 1)]
+    for row, canonical in zip(user_rows, normalize_kenyan_phones(row['phone_number'] for row in user_rows)):
+        row['phone_e164'] = canonical
+    _insert(User, user_rows)
+
+    chama_rows = []
+    join_codes = set()
+    for i in range(1, chamas + 1):
+        code = ''.join(rng.choice(string.ascii_uppercase + string.digits) for _ in range(8))
+        while code in join_codes:
+            code = ''.join(rng.choice(string.ascii_uppercase + string.digits) for _ in range(8))
+        join_codes.add(code)
+        chama_rows.append({
+            'id': i,
+            'name': f'{rng.choice(CHAMA_WORDS)} {rng.choice(CHAMA_KINDS)} {i}',
+            'description': 'Synthetic benchmark chama',
+            'join_code': code,
+            'contribution_amount': float(rng.choice([200, 500, 1000, 2000, 5000])),
+            'contribution_frequency': rng.choice(['weekly', 'weekly', 'monthly']),
+            'created_by': rng.randint(1, users),
+            'created_at': history_start,
+            'is_active': True,
+        })
+    _insert(Chama, chama_rows)
+
+    # Chama sizes follow a long tail: most are small, a few are very large
+    members_by_chama = {}
+    membership_rows = []
+    for chama in chama_rows:
+        size = min(users, max(3, int(rng.paretovariate(1.5) * 8)))
+        members = rng.sample(range(1, users + 1), size)
+        if chama['created_by'] not in members:
+            members[0] = chama['created_by']
+        members_by_chama[chama['id']] = members
+        for user_id in members:
+            membership_rows.append({
+                'id': len(membership_rows) + 1,
+                'user_id': user_id,
+                'chama_id': chama['id'],
+                'role': 'admin' if user_id == chama['created_by'] else 'member',
+                'joined_at': history_start,
+                'is_active': rng.random() > 0.03,
+            })
+    _insert(Membership, membership_rows)
+
+    # Contributions are spread over chamas in proportion to their size
+    weights = [len(members_by_chama[c['id']]) for c in chama_rows]
+    chama_ids = [c['id'] for c in chama_rows]
+    amounts = {c['id']: c['contribution_amount'] for c in chama_rows}
+    admins = {c['id']: c['created_by'] for c in chama_rows}
+    contribution_count = 0
+    while contribution_count < contributions:
+        batch = []
+        picks = rng.choices(chama_ids, weights=weights, k=min(CHUNK, contributions - contribution_count))
+        for chama_id in picks:
+            contribution_count += 1
+            status = 'confirmed' if rng.random() < 0.9 else rng.choice(['pending', 'pending', 'failed'])
+            batch.append({
+                'id': contribution_count,
+                'user_id': rng.choice(members_by_chama[chama_id]),
+                'chama_id': chama_id,
+                'amount': amounts[chama_id] * rng.choice([1, 1, 1, 1, 0.5, 2]),
+                'payment_method': rng.choice(PAYMENT_METHODS),
+                'transaction_ref': transaction_ref(rng),
+                'status': status,
+                'contributed_at': history_start + timedelta(seconds=rng.randrange(history_seconds)),
+                'confirmed_by': admins[chama_id] if status == 'confirmed' else None,
+            })
+        _insert(Contribution, batch)
+
+    expense_rows = []
+    goal_rows = []
+    for chama in chama_rows:
+        for _ in range(rng.randint(0, 12)):
+            expense_rows.append({
+                'id': len(expense_rows) + 1,
+                'chama_id': chama['id'],
+                'title': rng.choice(EXPENSE_TITLES),
+                'amount': float(rng.randint(5, 200) * 100),
+                'created_at': history_start + timedelta(seconds=rng.randrange(history_seconds)),
+            })
+        for _ in range(rng.randint(0, 3)):
+            goal_rows.append({
+                'id': len(goal_rows) + 1,
+                'chama_id': chama['id'],
+                'title': rng.choice(['Land purchase', 'Emergency fund', 'Year-end party', 'Matatu']),
+                'target_amount': float(rng.randint(50, 2000) * 1000),
+                'is_achieved': False,
+                'created_at': history_start,
+            })
+    _insert(Expense, expense_rows)
+    _insert(Goal, goal_rows)
+
+    # Votes: a few per chama, responses spread over the electorate of each vote
+    vote_rows = []
+    option_rows = []
+    options_by_vote = {}
+    for chama in chama_rows:
+        for _ in range(rng.randint(0, 4)):
+            vote_id = len(vote_rows) + 1
+            vote_type = rng.choice(['binary', 'binary', 'multiple_choice', 'percentage'])
+            created_at = now - timedelta(days=rng.randint(0, 60))
+            vote_rows.append({
+                'id': vote_id,
+                'chama_id': chama['id'],
+                'title': f'Resolution {vote_id}',
+                'description': 'Synthetic benchmark vote',
+                'created_by': chama['created_by'],
+                'created_at': created_at,
+                'closes_at': created_at + timedelta(days=14),
+                'is_active': rng.random() < 0.5,
+                'vote_type': vote_type,
+                'minimum_approval': 60 if vote_type == 'percentage' else None,
+            })
+            if vote_type == 'binary':
+                texts = ['Yes', 'No']
+            elif vote_type == 'multiple_choice':
+                texts = [f'Option {n}' for n in range(1, rng.randint(3, 5) + 1)]
+            else:
+                texts = []
+            options_by_vote[vote_id] = []
+            for option_text in texts:
+                option_id = len(option_rows) + 1
+                option_rows.append({'id': option_id, 'vote_id': vote_id, 'option_text': option_text})
+                options_by_vote[vote_id].append(option_id)
+    _insert(Vote, vote_rows)
+    _insert(VoteOption, option_rows)
+
+    response_rows = []
+    vote_weights = [len(members_by_chama[v['chama_id']]) for v in vote_rows]
+    voted = set()
+    attempts = 0
+    while vote_rows and len(response_rows) < vote_responses and attempts < vote_responses * 5:
+        attempts += 1
+        vote = rng.choices(vote_rows, weights=vote_weights)[0]
+        user_id = rng.choice(members_by_chama[vote['chama_id']])
+        if (vote['id'], user_id) in voted:
+            continue
+        voted.add((vote['id'], user_id))
+        options = options_by_vote[vote['id']]
+        response_rows.append({
+            'id': len(response_rows) + 1,
+            'vote_id': vote['id'],
+            'user_id': user_id,
+            'option_id': rng.choice(options) if options else None,
+            'percentage': rng.randint(0, 100) if not options else None,
+            'responded_at': vote['created_at'] + timedelta(hours=rng.randint(1, 300)),
+        })
+    _insert(VoteResponse, response_rows)
+
+    _reset_sequences([User, Chama, Membership, Contribution, Expense, Goal, Vote, VoteOption,
+                      VoteResponse])
+    db.session.commit()
+
+    return {
+        'users': len(user_rows),
+        'chamas': len(chama_rows),
+        'memberships': len(membership_rows),
+        'contributions': contribution_count,
+        'expenses': len(expense_rows),
+        'goals': len(goal_rows),
+        'votes': len(vote_rows),
+        'vote_options': len(option_rows),
+        'vote_responses': len(response_rows),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    from app import app
+    with app.app_context():
+        counts = generate(seed=args.seed, **SCALES[args.scale])
+    for table, count in counts.items():
+        print(f'{table:>15}: {count:,}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,292 @@
+"""End-to-end "contribution day" load harness.
+
+Seeds a dataset, serves the app from a separate process (or targets an
+already running server with --target), then replays a login burst followed
+by a weighted mix of member traffic from concurrent virtual users. M-Pesa
+and SMS are served by the local stubs in benchmarks.stubs.
+
+Reports p50/p95/p99 latency, throughput and error rate per route, checks
+them against the p95 SLO and writes benchmarks/results/load-<commit>.json.
+
+    python -m benchmarks.loadtest --scale small --vus 50 --duration 60
+"""
+import argparse
+import multiprocessing
+import random
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from benchmarks.common import setup_database, write_results
+from benchmarks.datagen import PASSWORD, SCALES
+
+# Relative weight of each action during the steady-state phase
+TRAFFIC_MIX = {
+    'dashboard': 25,
+    'chama_detail': 20,
+    'contribute_get': 5,
+    'contribute_post': 20,
+    'view_vote': 10,
+    'submit_vote': 8,
+    'chama_stats_api': 7,
+    'login': 5,
+}
+
+# Default p95 latency objectives (ms); --slo overrides per route
+DEFAULT_SLO_MS = {'login': 1000, 'contribute_post': 500, 'submit_vote': 500}
+DEFAULT_ROUTE_SLO_MS = 300
+
+def percentile(ordered, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return None
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+def load_plans(app, vus, seed):
+    """Pick the virtual users and the chamas/votes each of them can act on"""
+    from extensions import db
+    from models import Membership, User, Vote, VoteOption
+
+    rng = random.Random(seed)
+    with app.app_context():
+        rows = db.session.query(Membership.user_id, Membership.chama_id)\
+            .filter(Membership.is_active.is_(True)).all()
+        chamas_by_user = defaultdict(list)
+        for user_id, chama_id in rows:
+            chamas_by_user[user_id].append(chama_id)
+        user_ids = rng.sample(sorted(chamas_by_user), min(vus, len(chamas_by_user)))
+        phones = dict(db.session.query(User.id, User.phone_number).filter(User.id.in_(user_ids)).all())
+
+        votes_by_chama = defaultdict(list)
+        options = defaultdict(list)
+        for vote_id, option_id in db.session.query(VoteOption.vote_id, VoteOption.id).all():
+            options[vote_id].append(option_id)
+        for vote in Vote.query.filter_by(is_active=True).all():
+            votes_by_chama[vote.chama_id].append((vote.id, vote.vote_type, options[vote.id]))
+
+    plans = []
+    for user_id in user_ids:
+        chama_ids = chamas_by_user[user_id]
+        plans.append({
+            'user_id': user_id,
+            'phone_number': phones[user_id],
+            'chama_ids': chama_ids,
+            'votes': [(chama_id, *vote) for chama_id in chama_ids for vote in votes_by_chama[chama_id]],
+        })
+    return plans
+
+def serve(database_url, port, ready, per_client_limits=False):
+    """Child process: run the app on a threaded dev server with stubbed integrations"""
+    import logging
+    import os
+    from werkzeug.serving import make_server
+
+    from benchmarks.stubs import StubIntegrationServer, install_stubs
+
+    os.environ['DATABASE_URL'] = database_url
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    from app import app
+    # Every virtual user shares one address, so per-IP buckets would throttle the harness itself
+    app.extensions['admission'].per_client = per_client_limits
+    stub = StubIntegrationServer().start()
+    install_stubs(app, stub.url)
+    server = make_server('127.0.0.1', port, app, threaded=True)
+    ready.set()
+    server.serve_forever()
+
+class Recorder:
+    """Thread-safe per-route latency and status collection"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.errors = defaultdict(int)
+        self.shed = defaultdict(int)
+
+    def record(self, route, seconds, status):
+        with self.lock:
+            self.latencies[route].append(seconds)
+            self.statuses[route][status] += 1
+            # 429/503 from admission control are deliberate fast rejections, not failures
+            if status in (429, 503):
+                self.shed[route] += 1
+            elif status == 'exception' or status >= 500:
+                self.errors[route] += 1
+
+class VirtualUser:
+    def __init__(self, base_url, plan, recorder, rng):
+        import requests
+        self.base_url = base_url
+        self.plan = plan
+        self.recorder = recorder
+        self.rng = rng
+        self.http = requests.Session()
+
+    def request(self, route, method, path, data=None):
+        start = time.perf_counter()
+        response = None
+        try:
+            response = self.http.request(method, self.base_url + path, data=data,
+                                         allow_redirects=False, timeout=30)
+            status = response.status_code
+        except Exception:
+            status = 'exception'
+        self.recorder.record(route, time.perf_counter() - start, status)
+        return response
+
+    def login(self, attempts=5):
+        # Shed logins are retried after Retry-After (with jitter), as a real client would
+        for _ in range(attempts):
+            response = self.request('login', 'POST', '/login',
+                                    {'phone_number': self.plan['phone_number'], 'password': PASSWORD})
+            if response is None or response.status_code not in (429, 503):
+                return
+            time.sleep(float(response.headers.get('Retry-After', 1)) * self.rng.uniform(1, 2))
+
+    def act(self, action):
+        chama_id = self.rng.choice(self.plan['chama_ids'])
+        if action == 'login':
+            self.login()
+        elif action == 'dashboard':
+            self.request(action, 'GET', '/dashboard')
+        elif action == 'chama_detail':
+            self.request(action, 'GET', f'/chama/{chama_id}')
+        elif action == 'chama_stats_api':
+            self.request(action, 'GET', f'/api/chama/{chama_id}/stats')
+        elif action == 'contribute_get':
+            self.request(action, 'GET', f'/chama/{chama_id}/contribute')
+        elif action == 'contribute_post':
+            self.request(action, 'POST', f'/chama/{chama_id}/contribute', {
+                'amount': self.rng.choice([200, 500, 1000, 2000]),
+                'payment_method': 'mpesa',
+                'transaction_ref': ''.join(self.rng.choice('ABCDEFGHJKLMNPQRSTUVWXYZ0123456789')
+                                           for _ in range(10)),
+            })
+        elif action in ('view_vote', 'submit_vote'):
+            if not self.plan['votes']:
+                return self.act('chama_detail')
+            vote_chama_id, vote_id, vote_type, option_ids = self.rng.choice(self.plan['votes'])
+            path = f'/chama/{vote_chama_id}/vote/{vote_id}'
+            if action == 'view_vote':
+                return self.request(action, 'GET', path)
+            if vote_type == 'percentage':
+                data = {'percentage': self.rng.randint(0, 100)}
+            else:
+                data = {'option_id': self.rng.choice(option_ids) if option_ids else ''}
+            self.request(action, 'POST', path + '/vote', data)
+
+def run_phase(vus, target):
+    threads = [threading.Thread(target=target, args=(vu,)) for vu in vus]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+def report(recorder, elapsed, slos):
+    routes = {}
+    for route in sorted(recorder.latencies):
+        ordered = sorted(recorder.latencies[route])
+        count = len(ordered)
+        p95 = percentile(ordered, 95) * 1000
+        slo = slos.get(route, DEFAULT_ROUTE_SLO_MS)
+        routes[route] = {
+            'requests': count,
+            'throughput_rps': round(count / elapsed, 2) if elapsed else None,
+            'p50_ms': round(percentile(ordered, 50) * 1000, 2),
+            'p95_ms': round(p95, 2),
+            'p99_ms': round(percentile(ordered, 99) * 1000, 2),
+            'max_ms': round(ordered[-1] * 1000, 2),
+            'error_rate': round(recorder.errors[route] / count, 4),
+            'shed_rate': round(recorder.shed[route] / count, 4),
+            'statuses': {str(k): v for k, v in recorder.statuses[route].items()},
+            'slo_p95_ms': slo,
+            'slo_met': p95 <= slo and recorder.errors[route] == 0,
+        }
+    return routes
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--vus', type=int, default=50, help='concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=30, help='steady-state seconds')
+    parser.add_argument('--think-time', type=float, default=0.0, help='max seconds between actions')
+    parser.add_argument('--reuse', action='store_true', help='keep data written by a previous run')
+    parser.add_argument('--database-url', help='load test against this database instead of SQLite')
+    parser.add_argument('--target', help='base URL of an already running server')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--per-client-limits', action='store_true',
+                        help='keep per-user/per-IP rate limits on (all virtual users share one IP)')
+    parser.add_argument('--slo', action='append', default=[], metavar='ROUTE=MS',
+                        help='p95 objective for a route, e.g. --slo dashboard=200')
+    args = parser.parse_args()
+
+    slos = dict(DEFAULT_SLO_MS)
+    for item in args.slo:
+        route, ms = item.split('=')
+        slos[route] = float(ms)
+
+    # Seed relative to today so that recent votes are still open
+    app, counts = setup_database('load', args.scale, args.seed, reseed=not args.reuse,
+                                 database_url=args.database_url, now=datetime.utcnow())
+    plans = load_plans(app, args.vus, args.seed)
+
+    server = None
+    base_url = args.target
+    if not base_url:
+        import os
+        ready = multiprocessing.get_context('fork').Event()
+        server = multiprocessing.get_context('fork').Process(
+            target=serve, args=(os.environ['DATABASE_URL'], args.port, ready, args.per_client_limits),
+            daemon=True)
+        server.start()
+        ready.wait(30)
+        base_url = f'http://127.0.0.1:{args.port}'
+
+    recorder = Recorder()
+    rng = random.Random(args.seed)
+    vus = [VirtualUser(base_url, plan, recorder, random.Random(rng.random())) for plan in plans]
+    actions, weights = zip(*TRAFFIC_MIX.items())
+
+    try:
+        burst = run_phase(vus, VirtualUser.login)
+        print(f'Login burst: {len(vus)} logins in {burst:.2f}s')
+
+        deadline = time.perf_counter() + args.duration
+        def steady(vu):
+            while time.perf_counter() < deadline:
+                vu.act(vu.rng.choices(actions, weights)[0])
+                if args.think_time:
+                    time.sleep(vu.rng.uniform(0, args.think_time))
+        elapsed = run_phase(vus, steady)
+    finally:
+        if server:
+            server.terminate()
+            server.join()
+
+    routes = report(recorder, elapsed, slos)
+    total = sum(r['requests'] for r in routes.values())
+    print(f"{'route':<18} {'reqs':>7} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'err%':>6} {'shed%':>6}  SLO")
+    for route, r in routes.items():
+        print(f"{route:<18} {r['requests']:>7} {r['throughput_rps']:>8.1f} {r['p50_ms']:>8.1f} "
+              f"{r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f} {r['error_rate'] * 100:>6.2f} {r['shed_rate'] * 100:>6.2f}  "
+              f"{'ok' if r['slo_met'] else 'MISSED'} (p95 <= {r['slo_p95_ms']:.0f}ms)")
+    print(f'Total: {total} requests in {elapsed:.1f}s ({total / elapsed:.1f} req/s)')
+
+    results = {
+        'dataset': {'scale': args.scale, 'seed': args.seed, **counts},
+        'vus': len(vus),
+        'duration_s': round(elapsed, 2),
+        'login_burst_s': round(burst, 2),
+        'throughput_rps': round(total / elapsed, 2),
+        'routes': routes,
+    }
+    print(f"Results written to {write_results('load', results)}")
+
+if __name__ == '__main__':
+    main()
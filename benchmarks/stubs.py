@@ -0,0 +1,157 @@
+"""Local stand-ins for the M-Pesa and Africa's Talking APIs.
+
+StubIntegrationServer speaks just enough of the Safaricom Daraja API
+(OAuth token and STK push) for MPesaService, with configurable latency.
+StubSMSClient replaces the Africa's Talking SMS client in-process.
+
+Both inject faults for exercising outbound.py: `error_rate` of calls fail
+(HTTP 503 from the server, an SDK error from the SMS client) and
+`hang_rate` of calls stall for `hang_ms` before answering. The rates and
+latency are plain attributes, so a benchmark can degrade a running stub.
+"""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+# What the simulated USSD gateway puts on the callback URL
+USSD_KEY = 'stub-ussd-key'
+
+class StubIntegrationServer:
+    """Threaded HTTP server faking the M-Pesa endpoints on localhost"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency_ms=(50, 250), seed=0, error_rate=0.0, hang_rate=0.0,
+                 hang_ms=30000):
+        self.latency_ms = latency_ms
+        self.rng = random.Random(seed)
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.hang_ms = hang_ms
+        self.requests = 0
+        self.failed = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, payload):
+                body = json.dumps(payload).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # The client timed out while we hung
+
+            def do_GET(self):
+                if not stub.delay():
+                    return self._reply(503, {'errorMessage': 'Service unavailable'})
+                if self.path.startswith('/oauth/v1/generate'):
+                    return self._reply(200, {'access_token': 'stub-token', 'expires_in': '3599'})
+                self._reply(404, {'errorMessage': 'Not found'})
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                request = json.loads(self.rfile.read(length) or b'{}')
+                if not stub.delay():
+                    return self._reply(503, {'errorMessage': 'Service unavailable'})
+                if self.path == '/mpesa/stkpush/v1/processrequest':
+                    return self._reply(200, {
+                        'MerchantRequestID': f"stub-{stub.requests}",
+                        'CheckoutRequestID': f"ws_CO_stub_{stub.requests}",
+                        'ResponseCode': '0',
+                        'ResponseDescription': 'Success. Request accepted for processing',
+                        'CustomerMessage': 'Success. Request accepted for processing',
+                        'AccountReference': request.get('AccountReference'),
+                    })
+                self._reply(404, {'errorMessage': 'Not found'})
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def delay(self):
+        """Wait like the real API would; False if this call should fail"""
+        self.requests += 1
+        return _misbehave(self)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def _misbehave(stub, timeout=None):
+    """Sleep for a normal or hung response; False if the call should fail instead.
+
+    A hang longer than `timeout` (seconds) ends in requests.ReadTimeout,
+    as a real client would give up.
+    """
+    roll = stub.rng.random()
+    if roll < stub.hang_rate:
+        if timeout is not None and stub.hang_ms / 1000 > timeout:
+            time.sleep(timeout)
+            raise requests.ReadTimeout(f'stub timed out after {timeout:.2f}s')
+        time.sleep(stub.hang_ms / 1000)
+    else:
+        low, high = stub.latency_ms
+        time.sleep(stub.rng.uniform(low, high) / 1000)
+    if roll >= 1 - stub.error_rate:
+        stub.failed += 1
+        return False
+    return True
+
+class StubSMSClient:
+    """Drop-in for africastalking.SMS that records messages instead of sending"""
+
+    def __init__(self, latency_ms=(20, 80), seed=0, error_rate=0.0, hang_rate=0.0, hang_ms=30000):
+        self.latency_ms = latency_ms
+        self.rng = random.Random(seed)
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.hang_ms = hang_ms
+        self.sent = 0
+        self.failed = 0
+
+    def send(self, message, recipients, timeout=None):
+        # The SDK hands `timeout` to requests; the read half bounds a hung response
+        if not _misbehave(self, timeout[1] if isinstance(timeout, tuple) else timeout):
+            from africastalking.Service import AfricasTalkingException
+            raise AfricasTalkingException('{"errorMessage": "Service unavailable"}')
+        self.sent += 1
+        return {'SMSMessageData': {
+            'Message': f'Sent to {len(recipients)}/{len(recipients)}',
+            'Recipients': [{'number': number, 'status': 'Success', 'cost': 'KES 0.8000'}
+                           for number in recipients],
+        }}
+
+def install_stubs(app, mpesa_url, sms_client=None):
+    """Point the app's integrations at the stubs"""
+    import utils
+    app.config.update(
+        MPESA_BASE_URL=mpesa_url,
+        MPESA_CONSUMER_KEY='stub-key',
+        MPESA_CONSUMER_SECRET='stub-secret',
+        MPESA_SHORTCODE='174379',
+        MPESA_PASSKEY='stub-passkey',
+        AFRICASTALKING_USERNAME='sandbox',
+        AFRICASTALKING_API_KEY='stub-key',
+        USSD_CALLBACK_SECRET=USSD_KEY,
+    )
+    sms_client = sms_client or StubSMSClient()
+    utils.get_sms_client = lambda username, api_key: sms_client
+    return sms_client
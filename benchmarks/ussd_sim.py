@@ -0,0 +1,187 @@
+"""Local Africa's Talking USSD gateway simulator.
+
+Posts sessionId/phoneNumber/text hops to /ussd the way the gateway does.
+By default it seeds a dataset, serves the app from a separate process
+(M-Pesa stubbed) and runs many concurrent sessions walking the balance,
+what's due, contribute and vote journeys with think time between hops,
+then reports per-hop latency and how many hops missed the gateway budget.
+Writes benchmarks/results/ussd-<commit>.json.
+
+    python -m benchmarks.ussd_sim --scale small --sessions 500 --concurrency 50
+    python -m benchmarks.ussd_sim --target http://127.0.0.1:5000 --phone 0712345678   # dial in by hand
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from benchmarks.common import setup_database, summarize, write_results
+from benchmarks.datagen import SCALES
+from benchmarks.loadtest import percentile, serve
+from benchmarks.stubs import USSD_KEY
+
+JOURNEYS = {'balance': '1', 'due': '2', 'contribute': '3', 'vote': '4'}
+MAX_HOPS = 10
+SERVICE_CODE = '*384*1234#'
+
+class Gateway:
+    """One USSD session: accumulates inputs into `text` like the real gateway"""
+
+    def __init__(self, http, base_url, phone_number, key=USSD_KEY):
+        self.http = http
+        self.url = f'{base_url}/ussd?key={key}'
+        self.phone_number = phone_number
+        self.session_id = 'ATUid_' + uuid.uuid4().hex
+        self.inputs = []
+
+    def send(self, value=None):
+        """Send the next hop (None dials in); returns (reply, seconds)"""
+        if value is not None:
+            self.inputs.append(value)
+        start = time.perf_counter()
+        response = self.http.post(self.url, data={
+            'sessionId': self.session_id, 'serviceCode': SERVICE_CODE, 'networkCode': '63902',
+            'phoneNumber': self.phone_number, 'text': '*'.join(self.inputs),
+        }, timeout=10)
+        response.raise_for_status()
+        return response.text, time.perf_counter() - start
+
+def answer(reply, rng):
+    """What a member would type at this screen"""
+    if 'amount' in reply:
+        return str(rng.choice([200, 500, 1000, 2000]))
+    if '0-100' in reply:
+        return str(rng.randint(0, 100))
+    if 'via M-Pesa?' in reply:
+        return '1'
+    return '1'
+
+def run_session(http, base_url, phone_number, journey, rng, think_time, key=USSD_KEY):
+    """Walk one journey; returns [(hop, seconds)] and the final reply"""
+    gateway = Gateway(http, base_url, phone_number, key)
+    reply, seconds = gateway.send()
+    hops = [('dial', seconds)]
+    value = JOURNEYS[journey]
+    while reply.startswith('CON') and len(hops) < MAX_HOPS:
+        time.sleep(rng.uniform(0, think_time))
+        reply, seconds = gateway.send(value)
+        hops.append((journey, seconds))
+        value = answer(reply, rng)
+    return hops, reply
+
+def interactive(base_url, phone_number, key):
+    import requests
+    gateway = Gateway(requests.Session(), base_url, phone_number, key)
+    reply, seconds = gateway.send()
+    while True:
+        print(f'{reply[4:]}\n  ({seconds * 1000:.0f} ms)')
+        if not reply.startswith('CON'):
+            return
+        reply, seconds = gateway.send(input('> ').strip())
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--sessions', type=int, default=300)
+    parser.add_argument('--concurrency', type=int, default=30, help='sessions in flight')
+    parser.add_argument('--think-time', type=float, default=0.5, help='max seconds between hops')
+    parser.add_argument('--budget', type=float, default=1000, help='per-hop latency budget in ms')
+    parser.add_argument('--reseed', action='store_true', help='regenerate the dataset')
+    parser.add_argument('--database-url', help='run against this database instead of SQLite')
+    parser.add_argument('--target', help='base URL of an already running server')
+    parser.add_argument('--phone', help='dial in interactively as this number (needs --target)')
+    parser.add_argument('--port', type=int, default=5058)
+    parser.add_argument('--key', default=os.environ.get('USSD_CALLBACK_SECRET', USSD_KEY),
+                        help="USSD_CALLBACK_SECRET of the --target server")
+    args = parser.parse_args()
+
+    if args.phone:
+        if not args.target:
+            parser.error('--phone needs --target')
+        return interactive(args.target, args.phone, args.key)
+
+    # Seed relative to today so that votes are still open
+    app, counts = setup_database('ussd', args.scale, args.seed, args.reseed, args.database_url,
+                                 now=datetime.utcnow())
+    from extensions import db
+    from models import Membership, User
+    with app.app_context():
+        phones = [phone for (phone,) in db.session.query(User.phone_number).join(
+            Membership, Membership.user_id == User.id).filter(
+            Membership.is_active == True, User.phone_e164.isnot(None)).distinct()]
+
+    server = None
+    base_url = args.target
+    key = args.key if args.target else USSD_KEY
+    if not base_url:
+        ready = multiprocessing.get_context('fork').Event()
+        server = multiprocessing.get_context('fork').Process(
+            target=serve, args=(os.environ['DATABASE_URL'], args.port, ready), daemon=True)
+        server.start()
+        ready.wait(30)
+        base_url = f'http://127.0.0.1:{args.port}'
+
+    import requests
+    rng = random.Random(args.seed)
+    plans = [(rng.choice(phones), rng.choice(list(JOURNEYS)), random.Random(rng.random()))
+             for _ in range(args.sessions)]
+    local = threading.local()
+    lock = threading.Lock()
+    latencies = defaultdict(list)
+    endings = Counter()
+
+    def session(plan):
+        http = getattr(local, 'http', None)
+        if http is None:
+            http = local.http = requests.Session()
+        phone_number, journey, session_rng = plan
+        hops, reply = run_session(http, base_url, phone_number, journey, session_rng, args.think_time, key)
+        with lock:
+            for hop, seconds in hops:
+                latencies[hop].append(seconds)
+            endings[f"{journey}: {reply[4:].split(chr(10))[0][:40]}"] += 1
+
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            list(pool.map(session, plans))
+    finally:
+        elapsed = time.perf_counter() - start
+        if server:
+            server.terminate()
+            server.join()
+
+    budget = args.budget / 1000
+    everything = sorted(seconds for samples in latencies.values() for seconds in samples)
+    results = {
+        'dataset': {'scale': args.scale, 'seed': args.seed, **counts},
+        'sessions': args.sessions,
+        'concurrency': args.concurrency,
+        'elapsed_s': round(elapsed, 2),
+        'budget_ms': args.budget,
+        'hops': {},
+        'over_budget': sum(1 for seconds in everything if seconds > budget),
+        'endings': dict(endings.most_common()),
+    }
+    print(f"{'hop':<12}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for hop, samples in sorted(latencies.items()) + [('all', everything)]:
+        ordered = sorted(samples)
+        row = results['hops'][hop] = {
+            **summarize(ordered),
+            'p95_ms': round(percentile(ordered, 95) * 1000, 3),
+            'p99_ms': round(percentile(ordered, 99) * 1000, 3),
+        }
+        print(f"{hop:<12}{row['runs']:>8}{row['median_ms']:>10.1f}{row['p95_ms']:>10.1f}"
+              f"{row['p99_ms']:>10.1f}{row['max_ms']:>10.1f}")
+    print(f"{results['over_budget']} of {len(everything)} hops over the {args.budget:.0f} ms budget")
+    print(f"Results written to {write_results('ussd', results)}")
+
+if __name__ == '__main__':
+    main()
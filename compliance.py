@@ -0,0 +1,225 @@
+"""Member x period contribution compliance.
+
+Periods follow the chama's contribution_frequency (weeks starting Monday,
+or calendar months) from the week/month the chama was created. Paid
+amounts for all members and periods come from one grouped query that
+buckets confirmed contributions by period index in SQL; the result is
+pivoted into a flat array('d') of members x periods.
+
+Closed periods are frozen into ComplianceSnapshot rows, so later reports
+only aggregate the periods that are still open (or were invalidated by a
+back-dated write through invalidate_compliance()). Archived contributions
+(see archive.py) are bucketed in Python on the rare rebuild that reaches
+back into archived months.
+"""
+import json
+from array import array
+from bisect import bisect_right
+from datetime import datetime, timedelta
+
+from sqlalchemy import Integer, cast, extract, func, literal
+from sqlalchemy.exc import IntegrityError
+
+from archive import all_contributions, archived_rows, month_start, next_month
+from extensions import db
+from models import ComplianceSnapshot, Contribution, Membership, User
+
+def period_starts(frequency, first, until):
+    """Start of every period from the one containing `first` up to `until`"""
+    if frequency == 'weekly':
+        start = (first - timedelta(days=first.weekday())).replace(hour=0, minute=0, second=0, microsecond=0)
+        step = lambda d: d + timedelta(weeks=1)
+    else:
+        start = month_start(first)
+        step = next_month
+    starts = []
+    while start < until:
+        starts.append(start)
+        start = step(start)
+    return starts
+
+def owed_to_date(starts, joined_at, expected):
+    """Amount due for the closed periods since the member joined"""
+    first_due = max(0, bisect_right(starts, joined_at) - 1) if joined_at else 0
+    return max(0, len(starts) - 1 - first_due) * expected
+
+def _period_index(frequency, origin):
+    """SQL expression for the 0-based period a contribution falls in"""
+    column = Contribution.contributed_at
+    if frequency != 'weekly':
+        return (extract('year', column) - origin.year) * 12 + extract('month', column) - origin.month
+    if db.engine.dialect.name == 'sqlite':
+        return cast((func.julianday(column) - func.julianday(literal(origin))) / 7, Integer)
+    return func.floor(extract('epoch', column - literal(origin)) / 604800)
+
+def _period_of(frequency, origin, when):
+    """_period_index() for one date, in Python"""
+    if frequency != 'weekly':
+        return (when.year - origin.year) * 12 + when.month - origin.month
+    return (when - origin).days // 7
+
+def _paid_by_period(chama, frequency, origin, start, end):
+    """{(user_id, period_index): amount} for [start, end) in one grouped query"""
+    index = _period_index(frequency, origin).label('period')
+    rows = db.session.query(Contribution.user_id, index, func.sum(Contribution.amount))\
+        .filter(Contribution.chama_id == chama.id,
+                Contribution.status == 'confirmed',
+                Contribution.contributed_at >= start,
+                Contribution.contributed_at < end)\
+        .group_by(Contribution.user_id, index).all()
+    paid = {(user_id, int(period)): amount for user_id, period, amount in rows}
+    for row in archived_rows(chama.id, start, end):
+        if row['status'] == 'confirmed':
+            key = (row['user_id'], _period_of(frequency, origin, row['contributed_at']))
+            paid[key] = paid.get(key, 0) + row['amount']
+    return paid
+
+class ComplianceMatrix:
+    """Paid amounts for members (rows) x periods (columns), stored row-major"""
+
+    def __init__(self, chama, periods, members, paid, now):
+        self.chama = chama
+        self.expected = chama.contribution_amount
+        self.periods = periods
+        self.members = members  # [(user_id, name, joined_at)]
+        self.paid = paid
+        self.width = len(periods)
+        self.now = now
+
+        # First period each member owes; arrears count closed periods only, but any
+        # payment (including the open period) goes towards them
+        self.first_due = array('i', [self._first_due(joined_at) for _, _, joined_at in members])
+        self.arrears = array('d', [0.0] * len(members))
+        closed = max(0, self.width - 1)
+        for row in range(len(members)):
+            offset = row * self.width
+            owed = max(0, closed - self.first_due[row]) * self.expected
+            paid_total = sum(self.paid[offset:offset + self.width])
+            self.arrears[row] = max(0.0, owed - paid_total)
+
+    def _first_due(self, joined_at):
+        """Column of the period the member joined in"""
+        if joined_at is None:
+            return 0
+        return max(0, bisect_right(self.periods, joined_at) - 1)
+
+    def cell(self, row, col):
+        return self.paid[row * self.width + col]
+
+    def status(self, row, col):
+        if col < self.first_due[row]:
+            return 'not_due'
+        paid = self.cell(row, col)
+        if paid >= self.expected:
+            return 'paid'
+        return 'partial' if paid > 0 else 'unpaid'
+
+    @property
+    def total_arrears(self):
+        return sum(self.arrears)
+
+    def members_in_arrears(self):
+        return sum(1 for amount in self.arrears if amount > 0)
+
+    def rows(self, last=None):
+        """(member, cells, arrears) per member; cells are (paid, status) for the last N periods"""
+        first_col = max(0, self.width - last) if last else 0
+        for row, member in enumerate(self.members):
+            cells = [(self.cell(row, col), self.status(row, col)) for col in range(first_col, self.width)]
+            yield member, cells, self.arrears[row]
+
+def build_compliance(chama, now=None):
+    """Build the compliance matrix for a chama's active members up to the current period"""
+    now = now or datetime.utcnow()
+    frequency = chama.contribution_frequency
+    periods = period_starts(frequency, chama.created_at or now, now)
+    members = db.session.query(User.id, User.name, Membership.joined_at)\
+        .join(Membership, Membership.user_id == User.id)\
+        .filter(Membership.chama_id == chama.id, Membership.is_active == True)\
+        .order_by(User.name).all()
+    width = len(periods)
+    row_of = {user_id: row for row, (user_id, _, _) in enumerate(members)}
+    paid = array('d', bytes(8 * width * len(members)))
+    if not periods:
+        return ComplianceMatrix(chama, periods, members, paid, now)
+
+    # A period is closed once the next one has started
+    closed = width - 1
+    column_of = {start: col for col, start in enumerate(periods)}
+    snapshots = ComplianceSnapshot.query.filter(
+        ComplianceSnapshot.chama_id == chama.id,
+        ComplianceSnapshot.frequency == frequency,
+        ComplianceSnapshot.period_start >= periods[0],
+    ).all()
+    cached = set()
+    for snapshot in snapshots:
+        col = column_of.get(snapshot.period_start)
+        if col is None or col >= closed:
+            continue
+        cached.add(col)
+        for user_id, amount in json.loads(snapshot.paid_json).items():
+            row = row_of.get(int(user_id))
+            if row is not None:
+                paid[row * width + col] = amount
+
+    # Aggregate everything from the first uncached period onwards
+    first_missing = next((col for col in range(width) if col not in cached), width)
+    by_period = _paid_by_period(chama, frequency, periods[0], periods[first_missing], now + timedelta(seconds=1))
+    fresh = {}
+    for (user_id, col), amount in by_period.items():
+        if col in cached or not 0 <= col < width:
+            continue
+        fresh.setdefault(col, {})[str(user_id)] = amount
+        row = row_of.get(user_id)
+        if row is not None:
+            paid[row * width + col] = amount
+
+    new_snapshots = [ComplianceSnapshot(chama_id=chama.id, frequency=frequency, period_start=periods[col],
+                                        paid_json=json.dumps(fresh.get(col, {})))
+                     for col in range(first_missing, closed) if col not in cached]
+    if new_snapshots:
+        try:
+            with db.session.begin_nested():
+                db.session.add_all(new_snapshots)
+        except IntegrityError:
+            pass
+
+    return ComplianceMatrix(chama, periods, members, paid, now)
+
+def invalidate_compliance(chama_id, since):
+    """Drop frozen periods that could include entries dated at or after `since`"""
+    # Snapshots are keyed by period start; the period containing `since` starts up to a month earlier
+    ComplianceSnapshot.query.filter(
+        ComplianceSnapshot.chama_id == chama_id,
+        ComplianceSnapshot.period_start > since - timedelta(days=31),
+    ).delete(synchronize_session=False)
+
+def arrears_by_chama(chamas, now=None):
+    """{chama_id: (members_in_arrears, total_arrears)} for several chamas in two queries.
+
+    Uses the same rule as ComplianceMatrix (closed periods since the member
+    joined, against everything they have paid) without building the grid.
+    """
+    now = now or datetime.utcnow()
+    chama_ids = [chama.id for chama in chamas]
+    if not chama_ids:
+        return {}
+    members = db.session.query(Membership.chama_id, Membership.user_id, Membership.joined_at)\
+        .filter(Membership.chama_id.in_(chama_ids), Membership.is_active == True).all()
+    facts = all_contributions()
+    paid = dict(((chama_id, user_id), amount) for chama_id, user_id, amount in
+                db.session.query(facts.c.chama_id, facts.c.user_id, func.sum(facts.c.amount))
+                .filter(facts.c.chama_id.in_(chama_ids), facts.c.status == 'confirmed')
+                .group_by(facts.c.chama_id, facts.c.user_id))
+
+    periods = {chama.id: period_starts(chama.contribution_frequency, chama.created_at or now, now)
+               for chama in chamas}
+    expected = {chama.id: chama.contribution_amount for chama in chamas}
+    result = {chama_id: (0, 0.0) for chama_id in chama_ids}
+    for chama_id, user_id, joined_at in members:
+        owed = owed_to_date(periods[chama_id], joined_at, expected[chama_id])
+        arrears = owed - (paid.get((chama_id, user_id)) or 0)
+        if arrears > 0:
+            count, total = result[chama_id]
+            result[chama_id] = (count + 1, total + arrears)
+    return result
@@ -17,6 +17,7 @@ class Config:
     MPESA_CONSUMER_SECRET = os.environ.get('MPESA_CONSUMER_SECRET')
     MPESA_SHORTCODE = os.environ.get('MPESA_SHORTCODE')
     MPESA_PASSKEY = os.environ.get('MPESA_PASSKEY')
+    MPESA_BASE_URL = os.environ.get('MPESA_BASE_URL') or 'https://sandbox.safaricom.co.ke'
     
     # Email Configuration (for notifications)
     MAIL_SERVER = os.environ.get('MAIL_SERVER')
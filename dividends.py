@@ -0,0 +1,203 @@
+"""Year-end dividend distribution.
+
+A chama shares out a period's income (interest and profit, entered by the
+treasurer) less the expenses recorded in the period, in proportion to each
+member's time-weighted capital: every confirmed contribution earns
+amount x days held up to the end of the period, and capital paid in before
+the period counts for all of it. Only members still active share.
+
+Money is handled in integer cents throughout. Closed months are read from
+CapitalSummary rows (per member: cents, and cents x day number, so the
+cent-days to any later date follow exactly), filled in on demand by
+ensure_capital() and dropped by ledger.invalidate_checkpoints() after a
+back-dated change. Only the partial months at either end of the period are read row
+by row. Weights are summed per member with NumPy (one sort and
+np.add.reduceat); the pool is then split by largest remainder, so payouts
+add up to the pool exactly, to the cent.
+"""
+from datetime import datetime
+from decimal import ROUND_HALF_UP, Decimal
+from itertools import chain
+
+import numpy as np
+from sqlalchemy import extract, func, select
+from sqlalchemy.exc import IntegrityError
+
+from archive import archived_rows, month_start, next_month
+from extensions import db
+from models import CapitalSummary, Contribution, Distribution, DistributionPayout, Expense, Membership
+
+EPOCH = datetime(1970, 1, 1)
+
+class DistributionError(ValueError):
+    pass
+
+def to_cents(value):
+    """Integer cents of an amount, rounding half up"""
+    return int(Decimal(str(value)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP) * 100)
+
+def _day(when):
+    return (when - EPOCH).days
+
+def _day_number(column):
+    """SQL expression for fractional days since the Unix epoch"""
+    if db.engine.dialect.name == 'sqlite':
+        return func.julianday(column) - 2440587.5
+    return extract('epoch', column) / 86400
+
+def share_out(user_ids, cents, weights, pool):
+    """Split `pool` cents in proportion to cent-days held.
+
+    user_ids, cents and weights (cent-days) are parallel int64 arrays with
+    one entry per contribution or per member-month. Returns (members,
+    capital, weights, payouts) with one entry per member in user id order;
+    payouts sum to `pool`.
+    """
+    order = np.argsort(user_ids, kind='stable')
+    sorted_ids = user_ids[order]
+    starts = np.flatnonzero(np.concatenate(([True], sorted_ids[1:] != sorted_ids[:-1])))
+    members = sorted_ids[starts]
+    capital = np.add.reduceat(cents[order], starts)
+    weights = np.add.reduceat(weights[order], starts)
+
+    # pool x weight overflows int64, so the split itself is in Python ints (one per member)
+    total = int(weights.sum())
+    products = [pool * weight for weight in weights.tolist()]
+    payouts = [product // total for product in products]
+    leftover = pool - sum(payouts)
+    # The cents lost to rounding go to the largest remainders, lowest user id first on ties
+    ranked = sorted(range(len(products)), key=lambda i: (-(products[i] % total), i))
+    for i in ranked[:leftover]:
+        payouts[i] += 1
+    return members, capital, weights, np.array(payouts, dtype=np.int64)
+
+def _rows(chama_id, start, end):
+    """(user_ids, cents, day numbers) of confirmed contributions dated in [start, end), hot and archived"""
+    query = select(Contribution.user_id, Contribution.amount, _day_number(Contribution.contributed_at))\
+        .where(Contribution.chama_id == chama_id, Contribution.status == 'confirmed',
+               Contribution.contributed_at >= start, Contribution.contributed_at < end)
+    # Straight from the DBAPI cursor into one flat array: building a Row per contribution costs
+    # far more than the query itself at a million rows
+    result = db.session.connection().execute(query)
+    try:
+        rows = np.fromiter(chain.from_iterable(result.cursor), dtype=np.float64).reshape(-1, 3)
+    finally:
+        result.close()
+    cold = [(row['user_id'], row['amount'], _day(row['contributed_at']))
+            for row in archived_rows(chama_id, start, end) if row['status'] == 'confirmed']
+    if cold:
+        rows = np.concatenate((rows, np.array(cold, dtype=np.float64)))
+    return rows[:, 0].astype(np.int64), np.rint(rows[:, 1] * 100).astype(np.int64), \
+        np.floor(rows[:, 2]).astype(np.int64)
+
+def ensure_capital(chama_id, before):
+    """Fill in the CapitalSummary rows of closed months before `before`; the caller commits.
+
+    Months are filled in order and dropped from a month on, so the rows
+    present always cover every month up to the latest of them.
+    """
+    target = month_start(min(before, datetime.utcnow()))
+    latest = db.session.query(func.max(CapitalSummary.period_start))\
+        .filter(CapitalSummary.chama_id == chama_id).scalar()
+    first = next_month(latest) if latest is not None else EPOCH
+    if first >= target:
+        return
+
+    user_ids, cents, days = _rows(chama_id, first, target)
+    if not len(user_ids):
+        return
+    months = (days.astype('datetime64[D]').astype('datetime64[M]') - np.datetime64('1970-01', 'M')).astype(np.int64)
+    keys = user_ids * 100_000 + months
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1])))
+    totals = np.add.reduceat(cents[order], starts)
+    cent_days = np.add.reduceat(cents[order] * days[order], starts)
+    summaries = [CapitalSummary(chama_id=chama_id, user_id=key // 100_000,
+                                period_start=datetime(1970 + key % 100_000 // 12, key % 100_000 % 12 + 1, 1),
+                                cents=total, cent_days=weight)
+                 for key, total, weight in zip(sorted_keys[starts].tolist(), totals.tolist(), cent_days.tolist())]
+    # Another request may be filling the same months; theirs are equivalent
+    try:
+        with db.session.begin_nested():
+            db.session.add_all(summaries)
+    except IntegrityError:
+        pass
+
+def load_contributions(chama_id, start, end):
+    """(user_ids, cents, cent-days held) of confirmed contributions made before `end`.
+
+    Capital brought in before `start` counts for the whole period. Closed
+    months come from the capital summaries, summed per member (weights are
+    linear in them); the months `start` and `end` fall in (and the current
+    one) are read row by row.
+    """
+    closed = month_start(datetime.utcnow())
+    low = min(month_start(start), closed)
+    whole_from = start if start == low else next_month(low)
+    whole_to = max(whole_from, min(month_start(end), closed))
+    ensure_capital(chama_id, whole_to)
+
+    end_day = _day(end)
+    held = end_day - _day(start)
+    parts = []
+    for user_ids, cents, days in (_rows(chama_id, low, whole_from), _rows(chama_id, whole_to, end)):
+        parts.append((user_ids, cents, cents * np.minimum(end_day - days, held)))
+    before_period = CapitalSummary.period_start < low
+    rows = db.session.query(
+        CapitalSummary.user_id, func.sum(CapitalSummary.cents), func.sum(CapitalSummary.cent_days), before_period
+    ).filter(
+        CapitalSummary.chama_id == chama_id, CapitalSummary.period_start < whole_to,
+        before_period | (CapitalSummary.period_start >= whole_from)
+    ).group_by(CapitalSummary.user_id, before_period)
+    summaries = np.array([tuple(row) for row in rows], dtype=np.int64).reshape(-1, 4)
+    before = summaries[:, 3] == 1
+    # Before the period: held throughout. Inside it: sum of cents x (end - day) = end x cents - cent_days
+    weights = np.where(before, summaries[:, 1] * held, summaries[:, 1] * end_day - summaries[:, 2])
+    parts.append((summaries[:, 0], summaries[:, 1], weights))
+    return tuple(np.concatenate(column) for column in zip(*parts))
+
+def compute_distribution(chama_id, start, end, income):
+    """Preview the share-out of `income` less expenses over [start, end)"""
+    if end <= start:
+        raise DistributionError('The period must end after it starts')
+    expenses = db.session.query(func.coalesce(func.sum(Expense.amount), 0)).filter(
+        Expense.chama_id == chama_id, Expense.created_at >= start, Expense.created_at < end).scalar()
+    pool = to_cents(income) - to_cents(expenses)
+    if pool <= 0:
+        raise DistributionError("Nothing to distribute: income doesn't cover the period's expenses")
+
+    user_ids, cents, weights = load_contributions(chama_id, start, end)
+    active = np.array([user_id for (user_id,) in db.session.query(Membership.user_id).filter(
+        Membership.chama_id == chama_id, Membership.is_active == True)], dtype=np.int64)
+    held = np.isin(user_ids, active) & (cents > 0)
+    if not held.any():
+        raise DistributionError('No member held capital during the period')
+
+    members, capital, weights, payouts = share_out(user_ids[held], cents[held], weights[held], pool)
+    total = int(weights.sum())
+    return {
+        'income': to_cents(income) / 100,
+        'expenses': to_cents(expenses) / 100,
+        'pool': pool / 100,
+        'payouts': [{'user_id': user_id, 'capital': member_capital / 100, 'weight': weight,
+                     'share': weight / total * 100, 'amount': amount / 100}
+                    for user_id, member_capital, weight, amount in
+                    zip(members.tolist(), capital.tolist(), weights.tolist(), payouts.tolist())],
+    }
+
+def create_distribution(chama_id, start, end, income, created_by):
+    """Compute and record a distribution and its payouts; the caller commits"""
+    if Distribution.query.filter_by(chama_id=chama_id, period_start=start, period_end=end).first():
+        raise DistributionError('This period has already been distributed')
+    result = compute_distribution(chama_id, start, end, income)
+    distribution = Distribution(chama_id=chama_id, period_start=start, period_end=end, income=result['income'],
+                                expenses=result['expenses'], pool=result['pool'], created_by=created_by)
+    db.session.add(distribution)
+    db.session.flush()
+    db.session.bulk_insert_mappings(DistributionPayout, [
+        {'distribution_id': distribution.id, 'user_id': payout['user_id'], 'capital': payout['capital'],
+         'weight': payout['weight'], 'amount': payout['amount']}
+        for payout in result['payouts']
+    ])
+    return distribution
@@ -1,6 +1,14 @@
 
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
+from metrics import Metrics
+from querylog import QueryLog
+from admission import AdmissionControl
+from payloads import CompactPayloads
 
 db = SQLAlchemy()
-login_manager = LoginManager()
\ No newline at end of file
+login_manager = LoginManager()
+metrics = Metrics()
+query_log = QueryLog()
+admission = AdmissionControl()
+payloads = CompactPayloads()
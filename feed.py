@@ -0,0 +1,131 @@
+"""Activity feed across a member's chamas.
+
+publish() writes each event once as an Activity and fans it out to the
+inboxes of the chama's active members with one INSERT ... SELECT. Chamas
+with more than FANOUT_LIMIT members skip the fan-out: their activities are
+marked fanned_out=False and merged in when the feed is read instead
+(fan-out on read), so a busy chama doesn't write thousands of rows per
+event.
+
+feed_page() is one indexed statement per user: the newest inbox entries
+UNION ALL the newest unfanned activities of the user's chamas, keyset
+paginated on activity id (`before`) and capped at MAX_PAGE items.
+trim_feeds() keeps every inbox to INBOX_LIMIT entries and drops
+activities (and their inbox entries) older than RETENTION_DAYS.
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, insert, literal, select, union_all
+
+from extensions import db
+from models import Activity, Goal, InboxItem, Membership, Vote
+
+FANOUT_LIMIT = 500
+PAGE_SIZE = 20
+DASHBOARD_FEED = 10
+MAX_PAGE = 50
+INBOX_LIMIT = 500
+RETENTION_DAYS = 180
+CLOSING_WINDOW = timedelta(hours=24)
+
+def _ksh(amount):
+    return f'KSh {amount:,.0f}'
+
+def publish(chama_id, kind, message, actor_id=None, subject_id=None):
+    """Record an event and deliver it to the chama's members; the caller commits"""
+    members = db.session.query(func.count(Membership.id))\
+        .filter(Membership.chama_id == chama_id, Membership.is_active == True).scalar()
+    activity = Activity(chama_id=chama_id, kind=kind, message=message[:200], actor_id=actor_id,
+                        subject_id=subject_id, fanned_out=members <= FANOUT_LIMIT)
+    db.session.add(activity)
+    db.session.flush()
+    if activity.fanned_out:
+        db.session.execute(insert(InboxItem).from_select(
+            ['user_id', 'activity_id'],
+            select(Membership.user_id, literal(activity.id))
+            .where(Membership.chama_id == chama_id, Membership.is_active == True)
+        ))
+    return activity
+
+# Events
+
+def contribution_made(contribution, name):
+    return publish(contribution.chama_id, 'contributed', f'{name} contributed {_ksh(contribution.amount)}',
+                   contribution.user_id, contribution.id)
+
+def contribution_confirmed(contribution, name):
+    return publish(contribution.chama_id, 'confirmed',
+                   f"{name}'s contribution of {_ksh(contribution.amount)} was confirmed",
+                   contribution.user_id, contribution.id)
+
+def member_joined(membership, name):
+    return publish(membership.chama_id, 'joined', f'{name} joined', membership.user_id, membership.user_id)
+
+def vote_opened(vote):
+    closes = f", closes {vote.closes_at.strftime('%b %d %H:%M')}" if vote.closes_at else ''
+    return publish(vote.chama_id, 'vote_opened', f'New vote: {vote.title}{closes}', vote.created_by, vote.id)
+
+def vote_closed(vote):
+    return publish(vote.chama_id, 'vote_closed', f'Vote closed: {vote.title}', subject_id=vote.id)
+
+def goals_reached(chama_id, since):
+    """Announce goals of a chama that became achieved at or after `since`"""
+    goals = Goal.query.filter(Goal.chama_id == chama_id, Goal.is_achieved == True, Goal.achieved_at >= since).all()
+    return [publish(chama_id, 'goal_reached', f'Goal reached: {goal.title} ({_ksh(goal.target_amount)})',
+                    subject_id=goal.id) for goal in goals]
+
+def announce_closing_votes(now=None):
+    """Publish a reminder for open votes closing within CLOSING_WINDOW, once each; the caller commits"""
+    now = now or datetime.utcnow()
+    announced = select(Activity.subject_id).where(Activity.kind == 'vote_closing')
+    votes = Vote.query.filter(Vote.is_active == True, Vote.closes_at > now, Vote.closes_at <= now + CLOSING_WINDOW,
+                              ~Vote.id.in_(announced)).all()
+    for vote in votes:
+        publish(vote.chama_id, 'vote_closing',
+                f"Vote closing soon: {vote.title} (closes {vote.closes_at.strftime('%b %d %H:%M')})",
+                subject_id=vote.id)
+    return len(votes)
+
+# Reading
+
+def feed_page(user_id, before=None, limit=PAGE_SIZE):
+    """(activities, next cursor) for a user, newest first; pass the cursor as `before` for the next page"""
+    limit = max(1, min(limit, MAX_PAGE))
+    inbox = select(InboxItem.activity_id.label('id')).where(InboxItem.user_id == user_id)
+    chamas = select(Membership.chama_id).where(Membership.user_id == user_id, Membership.is_active == True)
+    unfanned = select(Activity.id.label('id')).where(Activity.chama_id.in_(chamas), Activity.fanned_out == False)
+    if before is not None:
+        inbox = inbox.where(InboxItem.activity_id < before)
+        unfanned = unfanned.where(Activity.id < before)
+    newest = union_all(
+        select(inbox.order_by(InboxItem.activity_id.desc()).limit(limit).subquery()),
+        select(unfanned.order_by(Activity.id.desc()).limit(limit).subquery()),
+    ).subquery()
+    activities = Activity.query.filter(Activity.id.in_(select(newest.c.id)))\
+        .order_by(Activity.id.desc()).limit(limit).all()
+    cursor = activities[-1].id if len(activities) == limit else None
+    return activities, cursor
+
+# Retention
+
+def trim_feeds(now=None):
+    """Apply INBOX_LIMIT and RETENTION_DAYS; the caller commits. Returns (inbox rows, activities) removed."""
+    now = now or datetime.utcnow()
+    ranked = select(InboxItem.id, func.row_number().over(
+        partition_by=InboxItem.user_id, order_by=InboxItem.activity_id.desc()).label('position')).subquery()
+    overflow = db.session.execute(delete(InboxItem).where(
+        InboxItem.id.in_(select(ranked.c.id).where(ranked.c.position > INBOX_LIMIT)))).rowcount
+
+    # Ids grow with time, so everything below the first id inside the window has expired
+    cutoff = db.session.query(func.min(Activity.id))\
+        .filter(Activity.created_at >= now - timedelta(days=RETENTION_DAYS)).scalar()
+    if cutoff is None:
+        cutoff = (db.session.query(func.max(Activity.id)).scalar() or 0) + 1
+    expired_items = db.session.execute(delete(InboxItem).where(InboxItem.activity_id < cutoff)).rowcount
+    activities = db.session.execute(delete(Activity).where(Activity.id < cutoff)).rowcount
+    return overflow + expired_items, activities
+
+def forget_actor(user_id):
+    """Detach a deleted user from the feed; the caller commits"""
+    InboxItem.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+    Activity.query.filter_by(actor_id=user_id).update({'actor_id': None}, synchronize_session=False)
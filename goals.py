@@ -0,0 +1,109 @@
+"""Goal funding.
+
+Contributions (or parts of them) are earmarked for goals with
+GoalAllocation rows. Goal.current_amount is a running total that only
+counts confirmed contributions: it is bumped in a single UPDATE when a
+contribution is confirmed, and is_achieved flips in the same statement once
+the target is reached. Nothing here sums contribution history per goal,
+except rebuild_goal_totals() which exists to repair drift.
+"""
+from datetime import datetime
+
+from sqlalchemy import case, func, update
+
+from extensions import db
+from models import Contribution, Goal, GoalAllocation
+
+class AllocationError(ValueError):
+    pass
+
+def allocate_contribution(contribution, allocations):
+    """Split a contribution across goals.
+
+    `allocations` is an iterable of (goal_id, amount) pairs. Goals must
+    belong to the contribution's chama and the amounts may not exceed the
+    contribution. If the contribution is already confirmed the goals are
+    funded straight away. The caller commits.
+    """
+    allocations = [(int(goal_id), float(amount)) for goal_id, amount in allocations if amount]
+    if not allocations:
+        return []
+    if any(amount < 0 for _, amount in allocations):
+        raise AllocationError('Allocation amounts must be positive')
+    if sum(amount for _, amount in allocations) > contribution.amount + 0.005:
+        raise AllocationError('Allocations exceed the contribution amount')
+
+    goal_ids = {goal_id for goal_id, _ in allocations}
+    valid_ids = {goal_id for (goal_id,) in db.session.query(Goal.id).filter(
+        Goal.id.in_(goal_ids), Goal.chama_id == contribution.chama_id
+    )}
+    if valid_ids != goal_ids:
+        raise AllocationError('Invalid goal')
+
+    rows = [GoalAllocation(goal_id=goal_id, contribution_id=contribution.id, amount=amount)
+            for goal_id, amount in allocations]
+    db.session.add_all(rows)
+    if contribution.status == 'confirmed':
+        for goal_id, amount in allocations:
+            apply_goal_funding(goal_id, amount)
+    return rows
+
+def apply_goal_funding(goal_id, delta):
+    """Atomically move a goal's funded total and update its achieved flag"""
+    new_amount = Goal.current_amount + delta
+    achieved = new_amount >= Goal.target_amount
+    db.session.execute(
+        update(Goal)
+        .where(Goal.id == goal_id)
+        .values(
+            current_amount=new_amount,
+            is_achieved=achieved,
+            achieved_at=case((achieved, func.coalesce(Goal.achieved_at, datetime.utcnow())), else_=None),
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+def fund_goals(contribution):
+    """Apply a newly confirmed contribution's allocations to its goals"""
+    allocations = db.session.query(GoalAllocation.goal_id, GoalAllocation.amount)\
+        .filter_by(contribution_id=contribution.id).all()
+    for goal_id, amount in allocations:
+        apply_goal_funding(goal_id, amount)
+    return len(allocations)
+
+def release_contributions(contribution_ids):
+    """Undo goal funding for contributions that are about to be deleted"""
+    if not contribution_ids:
+        return
+    rows = db.session.query(GoalAllocation.goal_id, func.sum(GoalAllocation.amount))\
+        .join(Contribution, Contribution.id == GoalAllocation.contribution_id)\
+        .filter(GoalAllocation.contribution_id.in_(contribution_ids), Contribution.status == 'confirmed')\
+        .group_by(GoalAllocation.goal_id).all()
+    for goal_id, amount in rows:
+        apply_goal_funding(goal_id, -amount)
+    GoalAllocation.query.filter(GoalAllocation.contribution_id.in_(contribution_ids))\
+        .delete(synchronize_session=False)
+
+def get_active_goals(chama_id):
+    """Every unfinished goal of a chama with its progress, in one query"""
+    return Goal.query.filter_by(chama_id=chama_id, is_achieved=False)\
+        .order_by(Goal.target_date.is_(None), Goal.target_date, Goal.created_at).all()
+
+def rebuild_goal_totals(chama_id=None):
+    """Recompute funded totals from allocations of confirmed contributions"""
+    funded = db.session.query(func.coalesce(func.sum(GoalAllocation.amount), 0))\
+        .join(Contribution, Contribution.id == GoalAllocation.contribution_id)\
+        .filter(GoalAllocation.goal_id == Goal.id, Contribution.status == 'confirmed')\
+        .scalar_subquery()
+    query = update(Goal).values(current_amount=funded)
+    if chama_id is not None:
+        query = query.where(Goal.chama_id == chama_id)
+    db.session.execute(query.execution_options(synchronize_session=False))
+    apply_query = update(Goal).values(
+        is_achieved=Goal.current_amount >= Goal.target_amount,
+        achieved_at=case((Goal.current_amount >= Goal.target_amount,
+                          func.coalesce(Goal.achieved_at, datetime.utcnow())), else_=None),
+    )
+    if chama_id is not None:
+        apply_query = apply_query.where(Goal.chama_id == chama_id)
+    db.session.execute(apply_query.execution_options(synchronize_session=False))
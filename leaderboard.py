@@ -0,0 +1,216 @@
+"""Per-chama contribution leaderboard.
+
+LeaderboardEntry rows hold each member's confirmed total and on-time
+streak. record_confirmed() updates them as contributions are confirmed, so
+ranking never aggregates contribution history. A streak counts consecutive
+periods paid in full within the period; it is shown as broken once a
+period closes without full payment.
+
+Each process keeps a SortedList of (-total in cents, user_id) per chama,
+loaded from the entries in one query and cached for BOARD_TTL seconds, so
+"my rank" is an O(log n) lookup, top N is a slice and a confirmation is an
+O(log n) remove and add. Other workers pick up a confirmation when their
+copy expires. rebuild_leaderboard() recomputes the entries from the
+contributions, archived months included, by replaying them through the
+same steps as record_confirmed().
+"""
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from sortedcontainers import SortedList
+from sqlalchemy import and_
+
+from archive import archived_rows
+from compliance import period_starts
+from extensions import db
+from models import Chama, Contribution, LeaderboardEntry, Membership, User
+from utils import ExpiringCache
+
+BOARD_TTL = 60
+MAX_BOARDS = 1000
+TOP_N = 5
+
+Standing = namedtuple('Standing', 'cents streak last_period last_period_paid')
+
+def _period(frequency, when):
+    """Start of the period containing `when`"""
+    return period_starts(frequency, when, when + timedelta(microseconds=1))[0]
+
+def _following(frequency, start):
+    return period_starts(frequency, start, start + timedelta(days=32))[1]
+
+def _advance(standing, frequency, expected, period, amount):
+    """Standing after a confirmed payment in `period`, which is not before standing.last_period"""
+    streak, last_period, paid = standing.streak, standing.last_period, standing.last_period_paid
+    if last_period is None or period > last_period:
+        # The streak carries on only from a fully paid previous period
+        if last_period is None or paid < expected or period != _following(frequency, last_period):
+            streak = 0
+        last_period, paid = period, 0.0
+    if paid < expected <= paid + amount:
+        streak += 1
+    return Standing(standing.cents + round(amount * 100), streak, last_period, paid + amount)
+
+def current_streak(standing, frequency, expected, now=None):
+    """Streak as of `now`: broken if a closed period since the last payment wasn't paid in full"""
+    if standing.last_period is None:
+        return 0
+    open_period = _period(frequency, now or datetime.utcnow())
+    if standing.last_period == open_period:
+        return standing.streak
+    if _following(frequency, standing.last_period) == open_period and standing.last_period_paid >= expected:
+        return standing.streak
+    return 0
+
+class Board:
+    """Active members of a chama ordered by confirmed total, ties by user id"""
+
+    def __init__(self, standings):
+        self.lock = threading.Lock()
+        self.standings = standings
+        self.ranked = SortedList((-standing.cents, user_id) for user_id, standing in standings.items())
+
+    def __len__(self):
+        return len(self.ranked)
+
+    def update(self, user_id, standing):
+        with self.lock:
+            old = self.standings.get(user_id)
+            if old is not None:
+                self.ranked.remove((-old.cents, user_id))
+            self.standings[user_id] = standing
+            self.ranked.add((-standing.cents, user_id))
+
+    def rank(self, user_id):
+        with self.lock:
+            standing = self.standings.get(user_id)
+            if standing is None:
+                return None
+            return self.ranked.index((-standing.cents, user_id)) + 1
+
+    def top(self, n):
+        with self.lock:
+            return [(rank, user_id, self.standings[user_id])
+                    for rank, (_, user_id) in enumerate(self.ranked.islice(0, n), 1)]
+
+_boards = ExpiringCache(BOARD_TTL, MAX_BOARDS)
+
+def _entry_standing(entry):
+    return Standing(round(entry.total * 100), entry.streak, entry.last_period, entry.last_period_paid)
+
+def _load_board(chama_id):
+    rows = db.session.query(Membership.user_id, LeaderboardEntry.total, LeaderboardEntry.streak,
+                            LeaderboardEntry.last_period, LeaderboardEntry.last_period_paid)\
+        .outerjoin(LeaderboardEntry, and_(LeaderboardEntry.chama_id == Membership.chama_id,
+                                          LeaderboardEntry.user_id == Membership.user_id))\
+        .filter(Membership.chama_id == chama_id, Membership.is_active == True).all()
+    if rows and all(total is None for _, total, _, _, _ in rows) \
+            and Contribution.query.filter_by(chama_id=chama_id, status='confirmed').first() is not None:
+        # Never built (e.g. right after the migration)
+        _rebuild_chama(db.session.get(Chama, chama_id))
+        db.session.commit()
+        return _load_board(chama_id)
+    return Board({user_id: Standing(round((total or 0) * 100), streak or 0, last_period, last_period_paid or 0.0)
+                  for user_id, total, streak, last_period, last_period_paid in rows})
+
+def get_board(chama_id, reload=False):
+    board = None if reload else _boards.get(chama_id)
+    if board is None:
+        board = _load_board(chama_id)
+        _boards.set(chama_id, board)
+    return board
+
+def top_members(chama_id, n=TOP_N, now=None):
+    """The first `n` members as dicts with rank, user_id, name, total and streak"""
+    chama = db.session.get(Chama, chama_id)
+    leaders = get_board(chama_id).top(n)
+    names = dict(db.session.query(User.id, User.name).filter(User.id.in_([user_id for _, user_id, _ in leaders])))
+    return [{'rank': rank, 'user_id': user_id, 'name': names.get(user_id), 'total': standing.cents / 100,
+             'streak': current_streak(standing, chama.contribution_frequency, chama.contribution_amount, now)}
+            for rank, user_id, standing in leaders]
+
+def member_rank(chama_id, user_id, now=None):
+    """A member's rank, out of how many, total and streak; None if they aren't an active member"""
+    board = get_board(chama_id)
+    rank = board.rank(user_id)
+    if rank is None:
+        # Joined since the board was loaded
+        board = get_board(chama_id, reload=True)
+        rank = board.rank(user_id)
+        if rank is None:
+            return None
+    chama = db.session.get(Chama, chama_id)
+    standing = board.standings[user_id]
+    return {'rank': rank, 'of': len(board), 'total': standing.cents / 100,
+            'streak': current_streak(standing, chama.contribution_frequency, chama.contribution_amount, now)}
+
+def record_confirmed(contribution):
+    """Count a newly confirmed contribution in its member's entry and this process's board.
+
+    The caller commits. A contribution dated before the member's latest
+    counted period means their streak has to be replayed from history.
+    """
+    chama = db.session.get(Chama, contribution.chama_id)
+    entry = LeaderboardEntry.query.filter_by(chama_id=chama.id, user_id=contribution.user_id)\
+        .with_for_update().first()
+    if entry is None:
+        entry = LeaderboardEntry(chama_id=chama.id, user_id=contribution.user_id, total=0.0, streak=0,
+                                 last_period_paid=0.0)
+        db.session.add(entry)
+    period = _period(chama.contribution_frequency, contribution.contributed_at)
+    if entry.last_period is not None and period < entry.last_period:
+        standing = _standings(chama, contribution.user_id).get(contribution.user_id, Standing(0, 0, None, 0.0))
+    else:
+        standing = _advance(_entry_standing(entry), chama.contribution_frequency, chama.contribution_amount,
+                            period, contribution.amount)
+    entry.total = standing.cents / 100
+    entry.streak = standing.streak
+    entry.last_period = standing.last_period
+    entry.last_period_paid = standing.last_period_paid
+    entry.updated_at = datetime.utcnow()
+
+    board = _boards.get(chama.id)
+    if board is not None:
+        board.update(contribution.user_id, standing)
+
+def _standings(chama, user_id=None):
+    """{user_id: Standing} replayed from confirmed contributions, hot and archived"""
+    query = db.session.query(Contribution.user_id, Contribution.contributed_at, Contribution.amount)\
+        .filter(Contribution.chama_id == chama.id, Contribution.status == 'confirmed')
+    if user_id is not None:
+        query = query.filter(Contribution.user_id == user_id)
+    payments = [tuple(row) for row in query]
+    payments += [(row['user_id'], row['contributed_at'], row['amount']) for row in archived_rows(chama.id)
+                 if row['status'] == 'confirmed' and (user_id is None or row['user_id'] == user_id)]
+    payments.sort(key=lambda payment: payment[1])
+
+    frequency, expected = chama.contribution_frequency, chama.contribution_amount
+    standings = {}
+    for payer, contributed_at, amount in payments:
+        standing = standings.get(payer, Standing(0, 0, None, 0.0))
+        standings[payer] = _advance(standing, frequency, expected, _period(frequency, contributed_at), amount)
+    return standings
+
+def _rebuild_chama(chama):
+    standings = _standings(chama)
+    LeaderboardEntry.query.filter_by(chama_id=chama.id).delete(synchronize_session=False)
+    now = datetime.utcnow()
+    db.session.bulk_insert_mappings(LeaderboardEntry, [
+        {'chama_id': chama.id, 'user_id': user_id, 'total': standing.cents / 100, 'streak': standing.streak,
+         'last_period': standing.last_period, 'last_period_paid': standing.last_period_paid, 'updated_at': now}
+        for user_id, standing in standings.items()
+    ])
+    _boards.pop(chama.id)
+
+def rebuild_leaderboard(chama_id=None):
+    """Recompute leaderboard entries from contributions; commits per chama. Returns chamas rebuilt."""
+    query = Chama.query.order_by(Chama.id)
+    if chama_id is not None:
+        query = query.filter(Chama.id == chama_id)
+    count = 0
+    for chama in query.all():
+        _rebuild_chama(chama)
+        db.session.commit()
+        count += 1
+    return count
@@ -0,0 +1,169 @@
+"""Chama ledger and point-in-time balances.
+
+The ledger is confirmed contributions in and expenses out. Balances are
+answered from monthly BalanceCheckpoint rows (balance of everything dated
+before the first of a month) plus a scan of the entries since the nearest
+checkpoint, which is at most a month of rows. Missing checkpoints for
+closed months are filled in on demand from one grouped query per side.
+
+Back-dated writes (an expense with a past date, a confirmation of an old
+contribution, deleted contributions) must call invalidate_checkpoints() so
+later checkpoints (and the capital summaries dividends.py keeps the same
+way) get recomputed; rebuild_checkpoints() recomputes a chama
+from scratch. Contributions in archived months (see archive.py) are counted
+from their frozen summaries, and listed from the archive in statements.
+"""
+from datetime import datetime
+
+from sqlalchemy import extract, func
+from sqlalchemy.exc import IntegrityError
+
+from archive import all_contributions, archived_rows, archived_total, month_start, next_month
+from extensions import db
+from models import BalanceCheckpoint, CapitalSummary, Contribution, Expense, User
+
+def _contributions(chama_id):
+    return db.session.query(Contribution).filter(
+        Contribution.chama_id == chama_id, Contribution.status == 'confirmed')
+
+def _all_contributions(chama_id):
+    """Hot and archived contributions, for month-aligned aggregates"""
+    facts = all_contributions()
+    return db.session.query(facts).filter(facts.c.chama_id == chama_id, facts.c.status == 'confirmed'), facts
+
+def _expenses(chama_id):
+    return db.session.query(Expense).filter(Expense.chama_id == chama_id)
+
+def _sum_between(query, column, amount, start, end):
+    if start is not None:
+        query = query.filter(column >= start)
+    if end is not None:
+        query = query.filter(column < end)
+    return query.with_entities(func.coalesce(func.sum(amount), 0)).scalar()
+
+def _monthly_totals(query, column, amount, start, end):
+    """{(year, month): total} for entries in [start, end), one grouped query"""
+    year, month = extract('year', column), extract('month', column)
+    if start is not None:
+        query = query.filter(column >= start)
+    rows = query.filter(column < end)\
+        .with_entities(year, month, func.sum(amount)).group_by(year, month).all()
+    return {(int(y), int(m)): total for y, m, total in rows}
+
+def _first_activity(chama_id):
+    query, facts = _all_contributions(chama_id)
+    first_in = query.with_entities(func.min(facts.c.contributed_at)).scalar()
+    first_out = _expenses(chama_id).with_entities(func.min(Expense.created_at)).scalar()
+    dates = [d for d in (first_in, first_out) if d is not None]
+    return min(dates) if dates else None
+
+def ensure_checkpoints(chama_id, when):
+    """Return the latest checkpoint at or before `when`, creating missing ones.
+
+    Only closed months are checkpointed. Returns None when the chama has no
+    entries before the current month. The caller commits.
+    """
+    target = month_start(min(when, datetime.utcnow()))
+    latest = BalanceCheckpoint.query.filter(
+        BalanceCheckpoint.chama_id == chama_id, BalanceCheckpoint.as_of <= target
+    ).order_by(BalanceCheckpoint.as_of.desc()).first()
+    if latest is not None and latest.as_of == target:
+        return latest
+
+    if latest is not None:
+        boundary, total_in, total_out = latest.as_of, latest.total_in, latest.total_out
+    else:
+        first = _first_activity(chama_id)
+        if first is None or first >= target:
+            return None
+        boundary, total_in, total_out = month_start(first), 0.0, 0.0
+
+    query, facts = _all_contributions(chama_id)
+    monthly_in = _monthly_totals(query, facts.c.contributed_at, facts.c.amount, boundary, target)
+    monthly_out = _monthly_totals(_expenses(chama_id), Expense.created_at, Expense.amount,
+                                  boundary, target)
+    checkpoints = []
+    while boundary < target:
+        key = (boundary.year, boundary.month)
+        total_in += monthly_in.get(key, 0)
+        total_out += monthly_out.get(key, 0)
+        boundary = next_month(boundary)
+        checkpoints.append(BalanceCheckpoint(chama_id=chama_id, as_of=boundary, total_in=total_in,
+                                             total_out=total_out, balance=total_in - total_out))
+
+    # Another request may be filling the same months; theirs are equivalent
+    try:
+        with db.session.begin_nested():
+            db.session.add_all(checkpoints)
+    except IntegrityError:
+        pass
+    return BalanceCheckpoint.query.filter_by(chama_id=chama_id, as_of=target).first()
+
+def balance_at(chama_id, when):
+    """Balance (in, out, net) from every entry dated before `when`"""
+    checkpoint = ensure_checkpoints(chama_id, when)
+    start = checkpoint.as_of if checkpoint else None
+    total_in = (checkpoint.total_in if checkpoint else 0) + _sum_between(
+        _contributions(chama_id), Contribution.contributed_at, Contribution.amount, start, when
+    ) + archived_total(chama_id, start, when)
+    total_out = (checkpoint.total_out if checkpoint else 0) + _sum_between(
+        _expenses(chama_id), Expense.created_at, Expense.amount, start, when)
+    return {'total_in': total_in, 'total_out': total_out, 'balance': total_in - total_out}
+
+def ledger_entries(chama_id, start, end):
+    """Contributions and expenses in [start, end), oldest first, with running balance"""
+    opening = balance_at(chama_id, start)
+    contributions = _contributions(chama_id).filter(
+        Contribution.contributed_at >= start, Contribution.contributed_at < end).all()
+    expenses = _expenses(chama_id).filter(Expense.created_at >= start, Expense.created_at < end).all()
+
+    archived = [row for row in archived_rows(chama_id, start, end) if row['status'] == 'confirmed']
+
+    entries = [{'date': c.contributed_at, 'kind': 'contribution', 'description': c.user.name,
+                'reference': c.transaction_ref, 'amount_in': c.amount, 'amount_out': 0}
+               for c in contributions]
+    if archived:
+        names = dict(db.session.query(User.id, User.name).filter(User.id.in_({row['user_id'] for row in archived})))
+        entries += [{'date': row['contributed_at'], 'kind': 'contribution', 'description': names.get(row['user_id']),
+                     'reference': row['transaction_ref'], 'amount_in': row['amount'], 'amount_out': 0}
+                    for row in archived]
+    entries += [{'date': e.created_at, 'kind': 'expense', 'description': e.title,
+                 'reference': e.description, 'amount_in': 0, 'amount_out': e.amount}
+                for e in expenses]
+    entries.sort(key=lambda entry: entry['date'])
+
+    running = opening['balance']
+    for entry in entries:
+        running += entry['amount_in'] - entry['amount_out']
+        entry['balance'] = running
+    return opening['balance'], entries, running
+
+def invalidate_checkpoints(chama_id, since):
+    """Drop checkpoints (and dividend capital summaries) that include entries dated at or after `since`"""
+    BalanceCheckpoint.query.filter(
+        BalanceCheckpoint.chama_id == chama_id, BalanceCheckpoint.as_of > since
+    ).delete(synchronize_session=False)
+    CapitalSummary.query.filter(
+        CapitalSummary.chama_id == chama_id, CapitalSummary.period_start >= month_start(since)
+    ).delete(synchronize_session=False)
+
+def rebuild_checkpoints(chama_id=None):
+    """Recompute checkpoints for one chama (or all) up to the current month.
+
+    Capital summaries are only dropped; dividends fills them in again on demand.
+    """
+    for model in (BalanceCheckpoint, CapitalSummary):
+        query = model.query
+        if chama_id is not None:
+            query = query.filter_by(chama_id=chama_id)
+        query.delete(synchronize_session=False)
+
+    if chama_id is not None:
+        chama_ids = [chama_id]
+    else:
+        from models import Chama
+        chama_ids = [c_id for (c_id,) in db.session.query(Chama.id)]
+    now = datetime.utcnow()
+    for c_id in chama_ids:
+        ensure_checkpoints(c_id, now)
+    return len(chama_ids)
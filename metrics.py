@@ -0,0 +1,279 @@
+"""Request instrumentation exposed in Prometheus text format on /metrics.
+
+Per endpoint it records request latency, SQL statement count and DB time
+(SQLAlchemy engine events), Jinja render time, response size and
+connection-pool checkout wait. Caches report hits and misses through
+record_cache(), and the API payload layer reports body sizes before and
+after compression through record_payload(). Outbound API calls (see
+outbound.py) report latency, outcome and circuit state per dependency
+through record_outbound(). Everything is kept in process memory behind one lock, so
+each worker exposes its own series; scrape every worker (or aggregate in
+Prometheus) when running several. /metrics is open in debug mode and
+otherwise needs an `Authorization: Bearer <METRICS_TOKEN>` header.
+"""
+import hmac
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, abort, g, has_request_context, request
+from flask import before_render_template, template_rendered
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by a tuple of label values"""
+
+    def __init__(self, name, help_text, label_names, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for labels, (counts, total, count) in sorted(self.series.items()):
+            label_str = _labels(self.label_names, labels)
+            sep = ',' if label_str else ''
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{label_str}{sep}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{label_str}{sep}le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{{label_str}}} {total}')
+            lines.append(f'{self.name}_count{{{label_str}}} {count}')
+        return lines
+
+class Counter:
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.series = {}
+
+    def inc(self, labels, amount=1):
+        self.series[labels] = self.series.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        for labels, value in sorted(self.series.items()):
+            lines.append(f'{self.name}{{{_labels(self.label_names, labels)}}} {value}')
+        return lines
+
+def _labels(names, values):
+    return ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                    for name, value in zip(names, values))
+
+class Metrics:
+    """Flask extension collecting per-endpoint request metrics"""
+
+    def __init__(self, app=None, db=None):
+        self.lock = threading.Lock()
+        self.request_duration = Histogram(
+            'chamastack_request_duration_seconds', 'Request latency by endpoint.',
+            ('endpoint', 'method'), LATENCY_BUCKETS)
+        self.requests = Counter(
+            'chamastack_requests_total', 'Requests by endpoint and status code.',
+            ('endpoint', 'method', 'status'))
+        self.sql_statements = Histogram(
+            'chamastack_request_sql_statements', 'SQL statements executed per request.',
+            ('endpoint',), COUNT_BUCKETS)
+        self.sql_duration = Histogram(
+            'chamastack_request_sql_duration_seconds', 'Total DB time per request.',
+            ('endpoint',), LATENCY_BUCKETS)
+        self.render_duration = Histogram(
+            'chamastack_template_render_seconds', 'Jinja render time per request.',
+            ('endpoint',), LATENCY_BUCKETS)
+        self.response_size = Histogram(
+            'chamastack_response_size_bytes', 'Response body size.',
+            ('endpoint',), SIZE_BUCKETS)
+        self.pool_wait = Histogram(
+            'chamastack_db_pool_checkout_seconds', 'Time spent waiting for a pooled DB connection.',
+            ('endpoint',), LATENCY_BUCKETS)
+        self.cache_requests = Counter(
+            'chamastack_cache_requests_total', 'Cache lookups by cache and result.',
+            ('cache', 'result'))
+        self.payload_size = Histogram(
+            'chamastack_api_payload_bytes', 'API body size before (raw) and after (sent) compression.',
+            ('endpoint', 'format', 'encoding', 'stage'), SIZE_BUCKETS)
+        self.outbound_duration = Histogram(
+            'chamastack_outbound_request_seconds', 'Outbound API call latency by dependency and outcome.',
+            ('dependency', 'operation', 'outcome'), LATENCY_BUCKETS)
+        self.outbound_requests = Counter(
+            'chamastack_outbound_requests_total', 'Outbound API calls by dependency and outcome, '
+            'including retries and calls refused by an open circuit.',
+            ('dependency', 'operation', 'outcome'))
+        self.circuit_states = {}
+        self.db = None
+        self.engines = []
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db=None):
+        if db is None:
+            from extensions import db
+        self.db = db
+        app.extensions['metrics'] = self
+        if not app.config.setdefault('METRICS_ENABLED', True):
+            return
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+
+        with app.app_context():
+            for engine in db.engines.values():
+                self.instrument_engine(engine)
+
+    def instrument_engine(self, engine):
+        """Hook SQL timing, compiled-cache stats and pool checkout wait into an engine"""
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+        event.listen(engine, 'handle_error', self._handle_error)
+
+        raw_connection = engine.raw_connection
+        def timed_raw_connection():
+            start = time.perf_counter()
+            try:
+                return raw_connection()
+            finally:
+                if has_request_context():
+                    g._metrics_pool_wait = getattr(g, '_metrics_pool_wait', 0.0) + time.perf_counter() - start
+        engine.raw_connection = timed_raw_connection
+        self.engines.append(engine)
+
+    def record_cache(self, cache, hit):
+        """Count a cache lookup; exported as a hit/miss counter per cache"""
+        with self.lock:
+            self.cache_requests.inc((cache, 'hit' if hit else 'miss'))
+
+    def record_payload(self, endpoint, encoding, content_type, raw_size, sent_size):
+        """Record an API body's size before and after compression"""
+        labels = (endpoint, content_type.split('/')[-1], encoding)
+        with self.lock:
+            self.payload_size.observe(labels + ('raw',), raw_size)
+            self.payload_size.observe(labels + ('sent',), sent_size)
+
+    def record_outbound(self, dependency, operation, outcome, elapsed, circuit_state):
+        """Record one attempt at an outbound call; `elapsed` is None if it never went out"""
+        labels = (dependency, operation, outcome)
+        with self.lock:
+            self.outbound_requests.inc(labels)
+            if elapsed is not None:
+                self.outbound_duration.observe(labels, elapsed)
+            self.circuit_states[dependency] = circuit_state
+
+    # Request lifecycle
+
+    def _before_request(self):
+        g._metrics_start = time.perf_counter()
+        g._metrics_sql_count = 0
+        g._metrics_sql_time = 0.0
+        g._metrics_render_time = 0.0
+
+    def _after_request(self, response):
+        size = response.calculate_content_length() if not response.is_streamed else None
+        self._record(response.status_code, size)
+        return response
+
+    def _teardown_request(self, exc):
+        # Unhandled exceptions skip after_request
+        if exc is not None:
+            self._record(500, None)
+
+    def _record(self, status, size):
+        start = g.pop('_metrics_start', None)
+        if start is None:
+            return
+        elapsed = time.perf_counter() - start
+        endpoint = request.endpoint or 'unmatched'
+        with self.lock:
+            self.request_duration.observe((endpoint, request.method), elapsed)
+            self.requests.inc((endpoint, request.method, status))
+            self.sql_statements.observe((endpoint,), g._metrics_sql_count)
+            self.sql_duration.observe((endpoint,), g._metrics_sql_time)
+            self.render_duration.observe((endpoint,), g._metrics_render_time)
+            self.pool_wait.observe((endpoint,), g.get('_metrics_pool_wait', 0.0))
+            if size is not None:
+                self.response_size.observe((endpoint,), size)
+
+    def _before_render(self, sender, template, context, **extra):
+        if has_request_context():
+            g._metrics_render_start = time.perf_counter()
+
+    def _after_render(self, sender, template, context, **extra):
+        if has_request_context() and '_metrics_render_start' in g:
+            g._metrics_render_time += time.perf_counter() - g.pop('_metrics_render_start')
+
+    # SQLAlchemy events
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('_metrics_query_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['_metrics_query_start'].pop()
+        if has_request_context() and '_metrics_start' in g:
+            g._metrics_sql_count += 1
+            g._metrics_sql_time += elapsed
+        cache_hit = getattr(context, 'cache_hit', None)
+        if cache_hit is not None and cache_hit.name in ('CACHE_HIT', 'CACHE_MISS'):
+            self.record_cache('sql_compiled', cache_hit.name == 'CACHE_HIT')
+
+    def _handle_error(self, context):
+        # A failed statement never reaches after_cursor_execute; drop its start time
+        starts = context.connection.info.get('_metrics_query_start') if context.connection is not None else None
+        if starts:
+            starts.pop()
+
+    # Exposition
+
+    def metrics_view(self):
+        from flask import current_app
+        # Open in debug mode, otherwise only with `Authorization: Bearer <METRICS_TOKEN>`
+        token = current_app.config.get('METRICS_TOKEN')
+        if not current_app.debug and (not token or not hmac.compare_digest(
+                request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode())):
+            abort(403)
+
+        lines = []
+        with self.lock:
+            for metric in (self.request_duration, self.requests, self.sql_statements,
+                           self.sql_duration, self.render_duration, self.response_size,
+                           self.pool_wait, self.cache_requests, self.payload_size,
+                           self.outbound_duration, self.outbound_requests):
+                lines.extend(metric.render())
+            lines.extend(self._circuit_gauges())
+        lines.extend(self._pool_gauges())
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+    def _circuit_gauges(self):
+        lines = ['# HELP chamastack_outbound_circuit_open 1 while calls to a dependency are refused '
+                 '(open or half-open) as of its last call.',
+                 '# TYPE chamastack_outbound_circuit_open gauge']
+        for dependency, state in sorted(self.circuit_states.items()):
+            lines.append(f'chamastack_outbound_circuit_open{{dependency="{dependency}"}} {int(state != "closed")}')
+        return lines
+
+    def _pool_gauges(self):
+        lines = ['# HELP chamastack_db_pool_checked_out Connections currently checked out.',
+                 '# TYPE chamastack_db_pool_checked_out gauge']
+        for index, engine in enumerate(self.engines):
+            checkedout = getattr(engine.pool, 'checkedout', None)
+            if checkedout is not None:
+                lines.append(f'chamastack_db_pool_checked_out{{engine="{index}"}} {checkedout()}')
+        return lines
@@ -0,0 +1,70 @@
+"""Contribution archive and frozen summaries
+
+Revision ID: 0b6d2e94c1a8
+Revises: f3c81a7d5e90
+Create Date: 2026-10-19 22:00:00.000000
+
+"""
+import json
+import zlib
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0b6d2e94c1a8'
+down_revision = 'f3c81a7d5e90'
+branch_labels = None
+depends_on = None
+
+# archive.ARCHIVED_COLUMNS
+ARCHIVED_COLUMNS = ('id', 'user_id', 'amount', 'payment_method', 'transaction_ref', 'status',
+                    'contributed_at', 'confirmed_by')
+
+
+def upgrade():
+    op.create_table('contribution_archive',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('chama_id', sa.Integer(), nullable=False),
+        sa.Column('period_start', sa.DateTime(), nullable=False),
+        sa.Column('row_count', sa.Integer(), nullable=False),
+        sa.Column('data', sa.LargeBinary(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['chama_id'], ['chama.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('chama_id', 'period_start')
+    )
+    op.create_table('contribution_summary',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('chama_id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('period_start', sa.DateTime(), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('entries', sa.Integer(), nullable=False),
+        sa.Column('amount', sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(['chama_id'], ['chama.id'], ),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('chama_id', 'user_id', 'period_start', 'status')
+    )
+    with op.batch_alter_table('contribution_summary', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_contribution_summary_user_id'), ['user_id'], unique=False)
+
+
+def downgrade():
+    # Put archived rows back in the hot table before dropping the archive
+    contribution = sa.table('contribution', sa.column('chama_id'),
+                            *[sa.column(column) for column in ARCHIVED_COLUMNS])
+    for chama_id, data in op.get_bind().execute(sa.text('SELECT chama_id, data FROM contribution_archive')).all():
+        rows = [dict(zip(ARCHIVED_COLUMNS, values), chama_id=chama_id) for values in json.loads(zlib.decompress(data))]
+        for row in rows:
+            row['contributed_at'] = datetime.fromisoformat(row['contributed_at'])
+        op.bulk_insert(contribution, rows)
+
+    with op.batch_alter_table('contribution_summary', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_contribution_summary_user_id'))
+
+    op.drop_table('contribution_summary')
+    op.drop_table('contribution_archive')
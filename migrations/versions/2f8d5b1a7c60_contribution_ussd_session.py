@@ -0,0 +1,28 @@
+"""USSD session id on contributions
+
+Revision ID: 2f8d5b1a7c60
+Revises: 6a3f9c2e8d14
+Create Date: 2026-10-24 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2f8d5b1a7c60'
+down_revision = '6a3f9c2e8d14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('contribution', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('ussd_session_id', sa.String(length=100), nullable=True))
+        batch_op.create_unique_constraint('uq_contribution_ussd_session_id', ['ussd_session_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('contribution', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_contribution_ussd_session_id', type_='unique')
+        batch_op.drop_column('ussd_session_id')
@@ -0,0 +1,41 @@
+"""Frozen monthly capital per member for dividends
+
+Revision ID: 3b7e9d1c4a26
+Revises: 8c4e2a6f1b93
+Create Date: 2026-10-24 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b7e9d1c4a26'
+down_revision = '8c4e2a6f1b93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Filled in on demand by dividends.ensure_capital()
+    op.create_table('capital_summary',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('chama_id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('period_start', sa.DateTime(), nullable=False),
+        sa.Column('cents', sa.BigInteger(), nullable=False),
+        sa.Column('cent_days', sa.BigInteger(), nullable=False),
+        sa.ForeignKeyConstraint(['chama_id'], ['chama.id'], ),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('chama_id', 'period_start', 'user_id')
+    )
+    with op.batch_alter_table('capital_summary', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_capital_summary_user_id'), ['user_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('capital_summary', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_capital_summary_user_id'))
+
+    op.drop_table('capital_summary')
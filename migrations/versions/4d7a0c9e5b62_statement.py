@@ -0,0 +1,36 @@
+"""Monthly statement cache index
+
+Revision ID: 4d7a0c9e5b62
+Revises: e8b3f61d2a94
+Create Date: 2026-10-22 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4d7a0c9e5b62'
+down_revision = 'e8b3f61d2a94'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Files live in STATEMENT_DIR; fill with `flask generate-statements --month YYYY-MM`
+    op.create_table('statement',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('chama_id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('period_start', sa.DateTime(), nullable=False),
+        sa.Column('digest', sa.String(length=64), nullable=False),
+        sa.Column('generated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['chama_id'], ['chama.id'], ),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('chama_id', 'user_id', 'period_start')
+    )
+
+
+def downgrade():
+    op.drop_table('statement')
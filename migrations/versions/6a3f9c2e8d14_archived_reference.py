@@ -0,0 +1,95 @@
+"""Transaction references of archived contributions
+
+Revision ID: 6a3f9c2e8d14
+Revises: 9e2b7d4c1f83
+Create Date: 2026-10-23 15:00:00.000000
+
+"""
+import json
+import zlib
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6a3f9c2e8d14'
+down_revision = '9e2b7d4c1f83'
+branch_labels = None
+depends_on = None
+
+# archive.ARCHIVED_COLUMNS
+ARCHIVED_COLUMNS = ('id', 'user_id', 'amount', 'payment_method', 'transaction_ref', 'status',
+                    'contributed_at', 'confirmed_by')
+
+
+def upgrade():
+    op.create_table('archived_reference',
+        sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('chama_id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('period_start', sa.DateTime(), nullable=False),
+        sa.Column('contributed_at', sa.DateTime(), nullable=False),
+        sa.Column('transaction_ref', sa.String(length=100), nullable=False),
+        sa.Column('amount', sa.Float(), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.ForeignKeyConstraint(['chama_id'], ['chama.id'], ),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('archived_reference', schema=None) as batch_op:
+        batch_op.create_index('ix_archived_reference_chama_ref', ['chama_id', 'transaction_ref'], unique=False)
+        batch_op.create_index(batch_op.f('ix_archived_reference_user_id'), ['user_id'], unique=False)
+
+    # Index the references of months archived so far
+    contribution_archive = sa.table('contribution_archive', sa.column('chama_id'),
+                                    sa.column('period_start', sa.DateTime()), sa.column('data', sa.LargeBinary()))
+    archived_reference = sa.table('archived_reference', sa.column('id'), sa.column('chama_id'), sa.column('user_id'),
+                                  sa.column('period_start', sa.DateTime()), sa.column('contributed_at', sa.DateTime()),
+                                  sa.column('transaction_ref'), sa.column('amount'), sa.column('status'))
+    archives = op.get_bind().execute(sa.select(contribution_archive.c.chama_id, contribution_archive.c.period_start,
+                                               contribution_archive.c.data)).all()
+    for chama_id, period_start, data in archives:
+        rows = [dict(zip(ARCHIVED_COLUMNS, values)) for values in json.loads(zlib.decompress(data))]
+        references = [{'id': row['id'], 'chama_id': chama_id, 'user_id': row['user_id'], 'period_start': period_start,
+                       'contributed_at': datetime.fromisoformat(row['contributed_at']),
+                       'transaction_ref': row['transaction_ref'], 'amount': row['amount'], 'status': row['status']}
+                      for row in rows if row['transaction_ref']]
+        if references:
+            op.bulk_insert(archived_reference, references)
+
+    # Searchable like contribution.transaction_ref (see c5e2a9d71f38 and search.py)
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute('CREATE INDEX ix_archived_reference_transaction_ref_trgm ON archived_reference '
+                   'USING gin (transaction_ref gin_trgm_ops)')
+    elif dialect == 'sqlite':
+        op.execute("CREATE VIRTUAL TABLE archived_reference_search USING fts5("
+                   "transaction_ref, content='archived_reference', content_rowid='id', tokenize='trigram')")
+        op.execute("CREATE TRIGGER archived_reference_search_ai AFTER INSERT ON archived_reference BEGIN "
+                   "INSERT INTO archived_reference_search(rowid, transaction_ref) VALUES (new.id, new.transaction_ref); END")
+        op.execute("CREATE TRIGGER archived_reference_search_ad AFTER DELETE ON archived_reference BEGIN "
+                   "INSERT INTO archived_reference_search(archived_reference_search, rowid, transaction_ref) "
+                   "VALUES ('delete', old.id, old.transaction_ref); END")
+        op.execute("CREATE TRIGGER archived_reference_search_au AFTER UPDATE OF transaction_ref ON archived_reference BEGIN "
+                   "INSERT INTO archived_reference_search(archived_reference_search, rowid, transaction_ref) "
+                   "VALUES ('delete', old.id, old.transaction_ref); "
+                   "INSERT INTO archived_reference_search(rowid, transaction_ref) VALUES (new.id, new.transaction_ref); END")
+        op.execute("INSERT INTO archived_reference_search(archived_reference_search) VALUES ('rebuild')")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute('DROP INDEX IF EXISTS ix_archived_reference_transaction_ref_trgm')
+    elif dialect == 'sqlite':
+        for suffix in ('ai', 'ad', 'au'):
+            op.execute(f'DROP TRIGGER IF EXISTS archived_reference_search_{suffix}')
+        op.execute('DROP TABLE IF EXISTS archived_reference_search')
+
+    with op.batch_alter_table('archived_reference', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_archived_reference_user_id'))
+        batch_op.drop_index('ix_archived_reference_chama_ref')
+
+    op.drop_table('archived_reference')
@@ -0,0 +1,50 @@
+"""Goal funding: funded totals and contribution allocations
+
+Revision ID: 7c1e5b2f9a31
+Revises: 4dd2abc5420e
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c1e5b2f9a31'
+down_revision = '4dd2abc5420e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('goal', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('current_amount', sa.Float(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('target_date', sa.Date(), nullable=True))
+        batch_op.add_column(sa.Column('achieved_at', sa.DateTime(), nullable=True))
+
+    op.create_table('goal_allocation',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('goal_id', sa.Integer(), nullable=False),
+        sa.Column('contribution_id', sa.Integer(), nullable=False),
+        sa.Column('amount', sa.Float(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['contribution_id'], ['contribution.id'], ),
+        sa.ForeignKeyConstraint(['goal_id'], ['goal.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('goal_id', 'contribution_id')
+    )
+    with op.batch_alter_table('goal_allocation', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_goal_allocation_contribution_id'), ['contribution_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_goal_allocation_goal_id'), ['goal_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('goal_allocation', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_goal_allocation_goal_id'))
+        batch_op.drop_index(batch_op.f('ix_goal_allocation_contribution_id'))
+
+    op.drop_table('goal_allocation')
+    with op.batch_alter_table('goal', schema=None) as batch_op:
+        batch_op.drop_column('achieved_at')
+        batch_op.drop_column('target_date')
+        batch_op.drop_column('current_amount')
@@ -0,0 +1,56 @@
+"""Dividend distributions and payouts
+
+Revision ID: 7c4e1f0a9b35
+Revises: 0b6d2e94c1a8
+Create Date: 2026-10-19 23:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c4e1f0a9b35'
+down_revision = '0b6d2e94c1a8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('distribution',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('chama_id', sa.Integer(), nullable=False),
+        sa.Column('period_start', sa.DateTime(), nullable=False),
+        sa.Column('period_end', sa.DateTime(), nullable=False),
+        sa.Column('income', sa.Float(), nullable=False),
+        sa.Column('expenses', sa.Float(), nullable=False),
+        sa.Column('pool', sa.Float(), nullable=False),
+        sa.Column('created_by', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['chama_id'], ['chama.id'], ),
+        sa.ForeignKeyConstraint(['created_by'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('chama_id', 'period_start', 'period_end')
+    )
+    op.create_table('distribution_payout',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('distribution_id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('capital', sa.Float(), nullable=False),
+        sa.Column('weight', sa.BigInteger(), nullable=False),
+        sa.Column('amount', sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(['distribution_id'], ['distribution.id'], ),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('distribution_id', 'user_id')
+    )
+    with op.batch_alter_table('distribution_payout', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_distribution_payout_distribution_id'), ['distribution_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('distribution_payout', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_distribution_payout_distribution_id'))
+
+    op.drop_table('distribution_payout')
+    op.drop_table('distribution')
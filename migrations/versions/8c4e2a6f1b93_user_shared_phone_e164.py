@@ -0,0 +1,71 @@
+"""Accounts sharing a phone number with an older account
+
+Revision ID: 8c4e2a6f1b93
+Revises: 2f8d5b1a7c60
+Create Date: 2026-10-24 12:00:00.000000
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c4e2a6f1b93'
+down_revision = '2f8d5b1a7c60'
+branch_labels = None
+depends_on = None
+
+# Same rules as utils.normalize_kenyan_phones, copied so the migration doesn't depend on app code
+_PHONE_JUNK = re.compile(r'[^\d+]')
+_KENYAN_MOBILE = re.compile(r'(?:\+?254|0)?([17]\d{8})')
+
+user_table = sa.table('user',
+    sa.column('id', sa.Integer),
+    sa.column('phone_number', sa.String),
+    sa.column('phone_e164', sa.String),
+    sa.column('shared_phone_e164', sa.String),
+)
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('shared_phone_e164', sa.String(length=16), nullable=True))
+        batch_op.create_index(batch_op.f('ix_user_shared_phone_e164'), ['shared_phone_e164'], unique=False)
+
+    # d4a7c3e91b06 left phone_e164 NULL on every account but the oldest for a number several
+    # accounts typed differently; record which number they share. Where the account that kept
+    # it has since been deleted, the oldest of them takes it over.
+    bind = op.get_bind()
+    held = {phone_e164 for (phone_e164,) in bind.execute(
+        sa.select(user_table.c.phone_e164).where(user_table.c.phone_e164.isnot(None)))}
+    unset = bind.execute(
+        sa.select(user_table.c.id, user_table.c.phone_number)
+        .where(user_table.c.phone_e164.is_(None))
+        .order_by(user_table.c.id)
+    ).all()
+    updates = []
+    for user_id, phone_number in unset:
+        match = _KENYAN_MOBILE.fullmatch(_PHONE_JUNK.sub('', phone_number)) if phone_number else None
+        if match is None:
+            continue
+        canonical = '+254' + match.group(1)
+        if canonical in held:
+            updates.append({'user_id': user_id, 'phone_e164': None, 'shared_phone_e164': canonical})
+        else:
+            held.add(canonical)
+            updates.append({'user_id': user_id, 'phone_e164': canonical, 'shared_phone_e164': None})
+    if updates:
+        bind.execute(
+            user_table.update()
+            .where(user_table.c.id == sa.bindparam('user_id'))
+            .values(phone_e164=sa.bindparam('phone_e164'), shared_phone_e164=sa.bindparam('shared_phone_e164')),
+            updates
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_user_shared_phone_e164'))
+        batch_op.drop_column('shared_phone_e164')
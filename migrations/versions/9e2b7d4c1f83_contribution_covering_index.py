@@ -0,0 +1,28 @@
+"""Covering index for whole-chama contribution reads
+
+Revision ID: 9e2b7d4c1f83
+Revises: 4d7a0c9e5b62
+Create Date: 2026-10-23 09:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '9e2b7d4c1f83'
+down_revision = '4d7a0c9e5b62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Dividends and penalties read every confirmed payment of a chama; with user_id and
+    # amount in the index that is a range scan instead of a table lookup per row
+    with op.batch_alter_table('contribution', schema=None) as batch_op:
+        batch_op.create_index('ix_contribution_chama_status_covering',
+                              ['chama_id', 'status', 'contributed_at', 'user_id', 'amount'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('contribution', schema=None) as batch_op:
+        batch_op.drop_index('ix_contribution_chama_status_covering')
@@ -0,0 +1,55 @@
+"""Penalty rules and computed member penalties
+
+Revision ID: a1d93e5c7f20
+Revises: 7c4e1f0a9b35
+Create Date: 2026-10-20 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a1d93e5c7f20'
+down_revision = '7c4e1f0a9b35'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('penalty_rule',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('chama_id', sa.Integer(), nullable=False),
+        sa.Column('grace_days', sa.Integer(), nullable=False),
+        sa.Column('fine_type', sa.String(length=10), nullable=False),
+        sa.Column('fine_amount', sa.Float(), nullable=False),
+        sa.Column('max_fine', sa.Float(), nullable=True),
+        sa.Column('max_total', sa.Float(), nullable=True),
+        sa.Column('stale_from', sa.DateTime(), nullable=True),
+        sa.Column('computed_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['chama_id'], ['chama.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('chama_id')
+    )
+    op.create_table('member_penalty',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('chama_id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('period_start', sa.DateTime(), nullable=False),
+        sa.Column('due_at', sa.DateTime(), nullable=False),
+        sa.Column('shortfall', sa.Float(), nullable=False),
+        sa.Column('outstanding', sa.Float(), nullable=False),
+        sa.Column('settled_at', sa.DateTime(), nullable=True),
+        sa.Column('days_late', sa.Integer(), nullable=False),
+        sa.Column('fine', sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(['chama_id'], ['chama.id'], ),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('chama_id', 'user_id', 'period_start')
+    )
+
+
+def downgrade():
+    op.drop_table('member_penalty')
+    op.drop_table('penalty_rule')
@@ -0,0 +1,46 @@
+"""Balance checkpoints and ledger indexes
+
+Revision ID: a3f08d6c4e12
+Revises: 7c1e5b2f9a31
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3f08d6c4e12'
+down_revision = '7c1e5b2f9a31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('balance_checkpoint',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('chama_id', sa.Integer(), nullable=False),
+        sa.Column('as_of', sa.DateTime(), nullable=False),
+        sa.Column('total_in', sa.Float(), nullable=False),
+        sa.Column('total_out', sa.Float(), nullable=False),
+        sa.Column('balance', sa.Float(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['chama_id'], ['chama.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('chama_id', 'as_of')
+    )
+    with op.batch_alter_table('contribution', schema=None) as batch_op:
+        batch_op.create_index('ix_contribution_chama_contributed_at', ['chama_id', 'contributed_at'], unique=False)
+
+    with op.batch_alter_table('expense', schema=None) as batch_op:
+        batch_op.create_index('ix_expense_chama_created_at', ['chama_id', 'created_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('expense', schema=None) as batch_op:
+        batch_op.drop_index('ix_expense_chama_created_at')
+
+    with op.batch_alter_table('contribution', schema=None) as batch_op:
+        batch_op.drop_index('ix_contribution_chama_contributed_at')
+
+    op.drop_table('balance_checkpoint')
@@ -0,0 +1,34 @@
+"""Compliance snapshots
+
+Revision ID: b81d4e07c9a5
+Revises: a3f08d6c4e12
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b81d4e07c9a5'
+down_revision = 'a3f08d6c4e12'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('compliance_snapshot',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('chama_id', sa.Integer(), nullable=False),
+        sa.Column('frequency', sa.String(length=20), nullable=False),
+        sa.Column('period_start', sa.DateTime(), nullable=False),
+        sa.Column('paid_json', sa.Text(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['chama_id'], ['chama.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('chama_id', 'frequency', 'period_start')
+    )
+
+
+def downgrade():
+    op.drop_table('compliance_snapshot')
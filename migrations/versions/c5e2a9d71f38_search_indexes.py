@@ -0,0 +1,53 @@
+"""Search indexes (trigram / FTS5)
+
+Revision ID: c5e2a9d71f38
+Revises: b81d4e07c9a5
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5e2a9d71f38'
+down_revision = 'b81d4e07c9a5'
+branch_labels = None
+depends_on = None
+
+SEARCHABLE = [
+    ('user', 'user_search', 'name'),
+    ('chama', 'chama_search', 'name'),
+    ('contribution', 'contribution_search', 'transaction_ref'),
+]
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for table, _, column in SEARCHABLE:
+            op.execute(f'CREATE INDEX ix_{table}_{column}_trgm ON "{table}" USING gin ({column} gin_trgm_ops)')
+    elif dialect == 'sqlite':
+        for table, fts, column in SEARCHABLE:
+            op.execute(f"CREATE VIRTUAL TABLE {fts} USING fts5("
+                       f"{column}, content='{table}', content_rowid='id', tokenize='trigram')")
+            op.execute(f"CREATE TRIGGER {fts}_ai AFTER INSERT ON \"{table}\" BEGIN "
+                       f"INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column}); END")
+            op.execute(f"CREATE TRIGGER {fts}_ad AFTER DELETE ON \"{table}\" BEGIN "
+                       f"INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column}); END")
+            op.execute(f"CREATE TRIGGER {fts}_au AFTER UPDATE OF {column} ON \"{table}\" BEGIN "
+                       f"INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column}); "
+                       f"INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column}); END")
+            op.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        for table, _, column in SEARCHABLE:
+            op.execute(f'DROP INDEX IF EXISTS ix_{table}_{column}_trgm')
+    elif dialect == 'sqlite':
+        for table, fts, _ in SEARCHABLE:
+            for suffix in ('ai', 'ad', 'au'):
+                op.execute(f'DROP TRIGGER IF EXISTS {fts}_{suffix}')
+            op.execute(f'DROP TABLE IF EXISTS {fts}')
@@ -0,0 +1,38 @@
+"""Leaderboard entries
+
+Revision ID: c5f2a8e3d417
+Revises: a1d93e5c7f20
+Create Date: 2026-10-20 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5f2a8e3d417'
+down_revision = 'a1d93e5c7f20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Filled in per chama on first view, or all at once with `flask rebuild-leaderboard`
+    op.create_table('leaderboard_entry',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('chama_id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('total', sa.Float(), nullable=False),
+        sa.Column('streak', sa.Integer(), nullable=False),
+        sa.Column('last_period', sa.DateTime(), nullable=True),
+        sa.Column('last_period_paid', sa.Float(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['chama_id'], ['chama.id'], ),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('chama_id', 'user_id')
+    )
+
+
+def downgrade():
+    op.drop_table('leaderboard_entry')
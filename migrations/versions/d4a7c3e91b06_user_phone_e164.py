@@ -0,0 +1,88 @@
+"""Canonical E.164 phone number
+
+Revision ID: d4a7c3e91b06
+Revises: c5e2a9d71f38
+Create Date: 2026-10-19 16:00:00.000000
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4a7c3e91b06'
+down_revision = 'c5e2a9d71f38'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 50000
+
+# Same rules as utils.normalize_kenyan_phones, copied so the migration doesn't depend on app code
+_PHONE_JUNK = re.compile(r'[^\d+]')
+_KENYAN_MOBILE = re.compile(r'(?:\+?254|0)?([17]\d{8})')
+
+user_table = sa.table('user',
+    sa.column('id', sa.Integer),
+    sa.column('phone_number', sa.String),
+    sa.column('phone_e164', sa.String),
+)
+
+
+def _normalize(phone_numbers):
+    strip, fullmatch = _PHONE_JUNK.sub, _KENYAN_MOBILE.fullmatch
+    normalized = []
+    for phone_number in phone_numbers:
+        match = fullmatch(strip('', phone_number)) if phone_number else None
+        normalized.append('+254' + match.group(1) if match else None)
+    return normalized
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('phone_e164', sa.String(length=16), nullable=True))
+
+    # Backfill in id order, one keyset batch at a time; the oldest account keeps a
+    # number that several accounts typed differently, later ones are left NULL
+    bind = op.get_bind()
+    seen = set()
+    duplicates = 0
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(user_table.c.id, user_table.c.phone_number)
+            .where(user_table.c.id > last_id)
+            .order_by(user_table.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        updates = []
+        for (user_id, _), canonical in zip(rows, _normalize(row[1] for row in rows)):
+            if canonical is None:
+                continue
+            if canonical in seen:
+                duplicates += 1
+                continue
+            seen.add(canonical)
+            updates.append({'user_id': user_id, 'phone_e164': canonical})
+        if updates:
+            bind.execute(
+                user_table.update()
+                .where(user_table.c.id == sa.bindparam('user_id'))
+                .values(phone_e164=sa.bindparam('phone_e164')),
+                updates
+            )
+    if duplicates:
+        print(f'{duplicates} accounts share a phone number with an older account; phone_e164 left NULL')
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_user_phone_e164'), ['phone_e164'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_user_phone_e164'))
+        batch_op.drop_column('phone_e164')
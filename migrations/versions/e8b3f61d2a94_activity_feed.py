@@ -0,0 +1,59 @@
+"""Activity feed
+
+Revision ID: e8b3f61d2a94
+Revises: c5f2a8e3d417
+Create Date: 2026-10-21 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8b3f61d2a94'
+down_revision = 'c5f2a8e3d417'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('activity',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('chama_id', sa.Integer(), nullable=False),
+        sa.Column('actor_id', sa.Integer(), nullable=True),
+        sa.Column('kind', sa.String(length=20), nullable=False),
+        sa.Column('subject_id', sa.Integer(), nullable=True),
+        sa.Column('message', sa.String(length=200), nullable=False),
+        sa.Column('fanned_out', sa.Boolean(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['actor_id'], ['user.id'], ),
+        sa.ForeignKeyConstraint(['chama_id'], ['chama.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('activity', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_activity_created_at'), ['created_at'], unique=False)
+        batch_op.create_index('ix_activity_chama_id_fanned_out_id', ['chama_id', 'fanned_out', 'id'], unique=False)
+
+    op.create_table('inbox_item',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('activity_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['activity_id'], ['activity.id'], ),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'activity_id')
+    )
+    with op.batch_alter_table('inbox_item', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_inbox_item_activity_id'), ['activity_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('inbox_item', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_inbox_item_activity_id'))
+
+    op.drop_table('inbox_item')
+    with op.batch_alter_table('activity', schema=None) as batch_op:
+        batch_op.drop_index('ix_activity_chama_id_fanned_out_id')
+        batch_op.drop_index(batch_op.f('ix_activity_created_at'))
+
+    op.drop_table('activity')
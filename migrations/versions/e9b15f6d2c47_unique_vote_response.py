@@ -0,0 +1,30 @@
+"""One response per member per vote
+
+Revision ID: e9b15f6d2c47
+Revises: d4a7c3e91b06
+Create Date: 2026-10-19 18:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e9b15f6d2c47'
+down_revision = 'd4a7c3e91b06'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Keep the earliest response where a race recorded more than one
+    op.execute(
+        'DELETE FROM vote_response WHERE id NOT IN '
+        '(SELECT MIN(id) FROM vote_response GROUP BY vote_id, user_id)'
+    )
+    with op.batch_alter_table('vote_response', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_vote_response_vote_user', ['vote_id', 'user_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('vote_response', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_vote_response_vote_user', type_='unique')
@@ -0,0 +1,98 @@
+"""Sync change feed and its triggers
+
+Revision ID: f3c81a7d5e90
+Revises: e9b15f6d2c47
+Create Date: 2026-10-19 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3c81a7d5e90'
+down_revision = 'e9b15f6d2c47'
+branch_labels = None
+depends_on = None
+
+PG_DELETED = "TG_OP = 'DELETE'"
+VOTE_CHAMA = '(SELECT chama_id FROM vote WHERE vote.id = {row}.vote_id)'
+
+# table: (chama_id expression, user_id expression), as in sync.SYNCED
+SYNCED = {
+    'membership': ('{row}.chama_id', '{row}.user_id'),
+    'contribution': ('{row}.chama_id', '{row}.user_id'),
+    'expense': ('{row}.chama_id', 'NULL'),
+    'goal': ('{row}.chama_id', 'NULL'),
+    'vote': ('{row}.chama_id', 'NULL'),
+    'vote_option': (VOTE_CHAMA, 'NULL'),
+    'vote_response': (VOTE_CHAMA, '{row}.user_id'),
+}
+
+
+def upsert(table, row, deleted):
+    chama, user = SYNCED[table]
+    return (f"INSERT INTO sync_change (entity, entity_id, chama_id, user_id, deleted, seq) "
+            f"VALUES ('{table}', {row}.id, {chama.format(row=row)}, {user.format(row=row)}, {deleted}, NULL) "
+            f"ON CONFLICT (entity, entity_id) DO UPDATE SET "
+            f"chama_id = coalesce(excluded.chama_id, sync_change.chama_id), "
+            f"user_id = coalesce(excluded.user_id, sync_change.user_id), "
+            f"deleted = excluded.deleted, seq = NULL;")
+
+
+def upgrade():
+    op.create_table('sync_change',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('seq', sa.BigInteger(), nullable=True),
+        sa.Column('entity', sa.String(length=20), nullable=False),
+        sa.Column('entity_id', sa.Integer(), nullable=False),
+        sa.Column('chama_id', sa.Integer(), nullable=True),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('deleted', sa.Boolean(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('entity', 'entity_id', name='uq_sync_change_entity')
+    )
+    with op.batch_alter_table('sync_change', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_sync_change_seq'), ['seq'], unique=False)
+        batch_op.create_index('ix_sync_change_chama_seq', ['chama_id', 'seq'], unique=False)
+
+    dialect = op.get_bind().dialect.name
+    for table in SYNCED:
+        if dialect == 'postgresql':
+            op.execute(f"CREATE OR REPLACE FUNCTION sync_{table}() RETURNS trigger AS $$ "
+                       f"DECLARE r record; BEGIN "
+                       f"IF TG_OP = 'DELETE' THEN r := OLD; ELSE r := NEW; END IF; "
+                       f"{upsert(table, 'r', PG_DELETED)} "
+                       f"RETURN NULL; END $$ LANGUAGE plpgsql")
+            op.execute(f'CREATE TRIGGER sync_{table} AFTER INSERT OR UPDATE OR DELETE ON "{table}" '
+                       f'FOR EACH ROW EXECUTE PROCEDURE sync_{table}()')
+        elif dialect == 'sqlite':
+            op.execute(f'CREATE TRIGGER sync_{table}_ai AFTER INSERT ON "{table}" BEGIN '
+                       f'{upsert(table, "new", 0)} END')
+            op.execute(f'CREATE TRIGGER sync_{table}_au AFTER UPDATE ON "{table}" BEGIN '
+                       f'{upsert(table, "new", 0)} END')
+            op.execute(f'CREATE TRIGGER sync_{table}_ad AFTER DELETE ON "{table}" BEGIN '
+                       f'{upsert(table, "old", 1)} END')
+
+        # Existing rows start out as one pending change each
+        chama, user = SYNCED[table]
+        op.execute(f"INSERT INTO sync_change (entity, entity_id, chama_id, user_id, deleted) "
+                   f"SELECT '{table}', t.id, {chama.format(row='t')}, {user.format(row='t')}, FALSE "
+                   f'FROM "{table}" t')
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    for table in SYNCED:
+        if dialect == 'postgresql':
+            op.execute(f'DROP TRIGGER IF EXISTS sync_{table} ON "{table}"')
+            op.execute(f'DROP FUNCTION IF EXISTS sync_{table}()')
+        elif dialect == 'sqlite':
+            for suffix in ('ai', 'au', 'ad'):
+                op.execute(f'DROP TRIGGER IF EXISTS sync_{table}_{suffix}')
+
+    with op.batch_alter_table('sync_change', schema=None) as batch_op:
+        batch_op.drop_index('ix_sync_change_chama_seq')
+        batch_op.drop_index(batch_op.f('ix_sync_change_seq'))
+
+    op.drop_table('sync_change')
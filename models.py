@@ -5,6 +5,10 @@ from flask_login import UserMixin
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     phone_number = db.Column(db.String(20), unique=True, nullable=False)
+    # Canonical +254XXXXXXXXX form used for every lookup; NULL for numbers that don't validate
+    phone_e164 = db.Column(db.String(16), unique=True, index=True)
+    # Canonical number this account shares with an older one (its phone_e164 stays NULL); see `flask phone-duplicates`
+    shared_phone_e164 = db.Column(db.String(16), index=True)
     name = db.Column(db.String(100), nullable=False)
     password_hash = db.Column(db.String(255), nullable=False)
     joined_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -58,6 +62,14 @@ class Contribution(db.Model):
     status = db.Column(db.String(20), default='pending')  # 'pending', 'confirmed'
     contributed_at = db.Column(db.DateTime, default=datetime.utcnow)
     confirmed_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    ussd_session_id = db.Column(db.String(100))  # idempotency key of a USSD contribution
+    
+    __table_args__ = (db.Index('ix_contribution_chama_contributed_at', 'chama_id', 'contributed_at'),
+                      # Covers the whole-chama reads of confirmed payments (dividends, penalties)
+                      db.Index('ix_contribution_chama_status_covering',
+                               'chama_id', 'status', 'contributed_at', 'user_id', 'amount'),
+                      # A gateway retry replayed on another worker must not record (and push) it twice
+                      db.UniqueConstraint('ussd_session_id', name='uq_contribution_ussd_session_id'))
     
     # Explicit relationships without conflicting backrefs
     user = db.relationship('User', foreign_keys=[user_id])
@@ -72,21 +84,155 @@ class Expense(db.Model):
     amount = db.Column(db.Float, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (db.Index('ix_expense_chama_created_at', 'chama_id', 'created_at'),)
+
     # Explicit relationship
     chama = db.relationship('Chama', foreign_keys=[chama_id])
 
+class ContributionArchive(db.Model):
+    """One chama's archived contributions for a closed month, compressed (see archive.py)"""
+    id = db.Column(db.Integer, primary_key=True)
+    chama_id = db.Column(db.Integer, db.ForeignKey('chama.id'), nullable=False)
+    period_start = db.Column(db.DateTime, nullable=False)
+    row_count = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)  # zlib-compressed JSON rows
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.UniqueConstraint('chama_id', 'period_start'),)
+
+class ContributionSummary(db.Model):
+    """Frozen per-member totals of archived contributions for one month and status"""
+    id = db.Column(db.Integer, primary_key=True)
+    chama_id = db.Column(db.Integer, db.ForeignKey('chama.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    period_start = db.Column(db.DateTime, nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    entries = db.Column(db.Integer, nullable=False)
+    amount = db.Column(db.Float, nullable=False)
+
+    __table_args__ = (db.UniqueConstraint('chama_id', 'user_id', 'period_start', 'status'),)
+
+class ArchivedReference(db.Model):
+    """Transaction reference of an archived contribution, so search still finds it (id is the contribution's)"""
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    chama_id = db.Column(db.Integer, db.ForeignKey('chama.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    period_start = db.Column(db.DateTime, nullable=False)
+    contributed_at = db.Column(db.DateTime, nullable=False)
+    transaction_ref = db.Column(db.String(100), nullable=False)
+    amount = db.Column(db.Float, nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+
+    __table_args__ = (db.Index('ix_archived_reference_chama_ref', 'chama_id', 'transaction_ref'),)
+
+    # Same shape as Contribution for search results
+    user = db.relationship('User', foreign_keys=[user_id])
+    chama = db.relationship('Chama', foreign_keys=[chama_id])
+
+class BalanceCheckpoint(db.Model):
+    """Chama balance from everything dated before `as_of` (a month boundary)"""
+    id = db.Column(db.Integer, primary_key=True)
+    chama_id = db.Column(db.Integer, db.ForeignKey('chama.id'), nullable=False)
+    as_of = db.Column(db.DateTime, nullable=False)
+    total_in = db.Column(db.Float, nullable=False)
+    total_out = db.Column(db.Float, nullable=False)
+    balance = db.Column(db.Float, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.UniqueConstraint('chama_id', 'as_of'),)
+
+class ComplianceSnapshot(db.Model):
+    """Frozen per-member paid totals for one closed contribution period"""
+    id = db.Column(db.Integer, primary_key=True)
+    chama_id = db.Column(db.Integer, db.ForeignKey('chama.id'), nullable=False)
+    frequency = db.Column(db.String(20), nullable=False)
+    period_start = db.Column(db.DateTime, nullable=False)
+    paid_json = db.Column(db.Text, nullable=False)  # {"<user_id>": amount}
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.UniqueConstraint('chama_id', 'frequency', 'period_start'),)
+
+class PenaltyRule(db.Model):
+    """A chama's late-payment fine (see penalties.py)"""
+    id = db.Column(db.Integer, primary_key=True)
+    chama_id = db.Column(db.Integer, db.ForeignKey('chama.id'), nullable=False, unique=True)
+    grace_days = db.Column(db.Integer, nullable=False, default=0)
+    fine_type = db.Column(db.String(10), nullable=False, default='flat')  # 'flat', 'percent'
+    fine_amount = db.Column(db.Float, nullable=False)  # KSh, or percent of the shortfall
+    max_fine = db.Column(db.Float)  # per period
+    max_total = db.Column(db.Float)  # per member, across all periods
+    # Earliest back-dated change since the last run; NULL computed_at means recompute everything
+    stale_from = db.Column(db.DateTime)
+    computed_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    chama = db.relationship('Chama', foreign_keys=[chama_id])
+
+class MemberPenalty(db.Model):
+    """Computed lateness and fine for one member and closed period"""
+    id = db.Column(db.Integer, primary_key=True)
+    chama_id = db.Column(db.Integer, db.ForeignKey('chama.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    period_start = db.Column(db.DateTime, nullable=False)
+    due_at = db.Column(db.DateTime, nullable=False)  # period end plus grace days
+    shortfall = db.Column(db.Float, nullable=False)  # unpaid at due_at
+    outstanding = db.Column(db.Float, nullable=False)  # unpaid now
+    settled_at = db.Column(db.DateTime)
+    days_late = db.Column(db.Integer, nullable=False, default=0)  # as of settlement, or of the run if unsettled
+    fine = db.Column(db.Float, nullable=False, default=0)
+
+    __table_args__ = (db.UniqueConstraint('chama_id', 'user_id', 'period_start'),)
+
+class LeaderboardEntry(db.Model):
+    """A member's running confirmed total and on-time streak in a chama (see leaderboard.py)"""
+    id = db.Column(db.Integer, primary_key=True)
+    chama_id = db.Column(db.Integer, db.ForeignKey('chama.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    total = db.Column(db.Float, nullable=False, default=0)
+    streak = db.Column(db.Integer, nullable=False, default=0)
+    # Latest period with a confirmed payment, and how much of it is paid
+    last_period = db.Column(db.DateTime)
+    last_period_paid = db.Column(db.Float, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.UniqueConstraint('chama_id', 'user_id'),)
+
 class Goal(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     chama_id = db.Column(db.Integer, db.ForeignKey('chama.id'), nullable=False)
     title = db.Column(db.String(100), nullable=False)
     target_amount = db.Column(db.Float, nullable=False)
+    # Running funded total, maintained by goals.apply_goal_funding()
+    current_amount = db.Column(db.Float, nullable=False, default=0, server_default='0')
+    target_date = db.Column(db.Date)
     description = db.Column(db.Text)
     is_achieved = db.Column(db.Boolean, default=False)
+    achieved_at = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     # Explicit relationship
     chama = db.relationship('Chama', foreign_keys=[chama_id])
 
+    @property
+    def progress_percent(self):
+        if not self.target_amount:
+            return 100
+        return min(100, int(round((self.current_amount or 0) / self.target_amount * 100)))
+
+class GoalAllocation(db.Model):
+    """Portion of a contribution earmarked for a goal"""
+    id = db.Column(db.Integer, primary_key=True)
+    goal_id = db.Column(db.Integer, db.ForeignKey('goal.id'), nullable=False, index=True)
+    contribution_id = db.Column(db.Integer, db.ForeignKey('contribution.id'), nullable=False, index=True)
+    amount = db.Column(db.Float, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.UniqueConstraint('goal_id', 'contribution_id'),)
+
+    # Explicit relationships
+    goal = db.relationship('Goal', foreign_keys=[goal_id])
+    contribution = db.relationship('Contribution', foreign_keys=[contribution_id])
+
 class Vote(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     chama_id = db.Column(db.Integer, db.ForeignKey('chama.id'), nullable=False)
@@ -122,10 +268,103 @@ class VoteResponse(db.Model):
     percentage = db.Column(db.Integer)  # For percentage-based votes
     responded_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # One response per member; votes.record_vote() relies on it for ON CONFLICT
+    __table_args__ = (db.UniqueConstraint('vote_id', 'user_id', name='uq_vote_response_vote_user'),)
+    
     # Relationships
     vote = db.relationship('Vote', back_populates='responses', foreign_keys=[vote_id])
     user = db.relationship('User', foreign_keys=[user_id])
     option = db.relationship('VoteOption', back_populates='responses', foreign_keys=[option_id])
 
+class Distribution(db.Model):
+    """A share-out of a period's income less expenses (see dividends.py)"""
+    id = db.Column(db.Integer, primary_key=True)
+    chama_id = db.Column(db.Integer, db.ForeignKey('chama.id'), nullable=False)
+    period_start = db.Column(db.DateTime, nullable=False)
+    period_end = db.Column(db.DateTime, nullable=False)  # exclusive
+    income = db.Column(db.Float, nullable=False)
+    expenses = db.Column(db.Float, nullable=False)
+    pool = db.Column(db.Float, nullable=False)
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.UniqueConstraint('chama_id', 'period_start', 'period_end'),)
+
+    payouts = db.relationship('DistributionPayout', back_populates='distribution', lazy=True,
+                              order_by='DistributionPayout.amount.desc()')
+
+class DistributionPayout(db.Model):
+    """One member's payout from a distribution"""
+    id = db.Column(db.Integer, primary_key=True)
+    distribution_id = db.Column(db.Integer, db.ForeignKey('distribution.id'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    capital = db.Column(db.Float, nullable=False)  # confirmed contributions held at the period end
+    weight = db.Column(db.BigInteger, nullable=False)  # cent-days
+    amount = db.Column(db.Float, nullable=False)
+
+    __table_args__ = (db.UniqueConstraint('distribution_id', 'user_id'),)
+
+    distribution = db.relationship('Distribution', back_populates='payouts')
+    user = db.relationship('User', foreign_keys=[user_id])
+
+class CapitalSummary(db.Model):
+    """A member's confirmed contributions in one closed month, frozen for dividend weights (see dividends.py)"""
+    id = db.Column(db.Integer, primary_key=True)
+    chama_id = db.Column(db.Integer, db.ForeignKey('chama.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    period_start = db.Column(db.DateTime, nullable=False)
+    cents = db.Column(db.BigInteger, nullable=False)
+    cent_days = db.Column(db.BigInteger, nullable=False)  # sum of cents x day number (days since 1970-01-01)
+
+    __table_args__ = (db.UniqueConstraint('chama_id', 'period_start', 'user_id'),)
+
+class Statement(db.Model):
+    """Where a member's rendered monthly statement is cached (see statements.py)"""
+    id = db.Column(db.Integer, primary_key=True)
+    chama_id = db.Column(db.Integer, db.ForeignKey('chama.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    period_start = db.Column(db.DateTime, nullable=False)
+    digest = db.Column(db.String(64), nullable=False)  # SHA-256 of the file, also its name
+    generated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.UniqueConstraint('chama_id', 'user_id', 'period_start'),)
+
+class Activity(db.Model):
+    """One event in a chama's activity feed (see feed.py)"""
+    id = db.Column(db.Integer, primary_key=True)
+    chama_id = db.Column(db.Integer, db.ForeignKey('chama.id'), nullable=False)
+    actor_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    kind = db.Column(db.String(20), nullable=False)
+    subject_id = db.Column(db.Integer)  # contribution, vote, goal or user, depending on kind
+    message = db.Column(db.String(200), nullable=False)
+    # False for chamas too big to fan out; readers merge these in
+    fanned_out = db.Column(db.Boolean, nullable=False, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    __table_args__ = (db.Index('ix_activity_chama_id_fanned_out_id', 'chama_id', 'fanned_out', 'id'),)
+
+class InboxItem(db.Model):
+    """An activity delivered to one member's feed"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    activity_id = db.Column(db.Integer, db.ForeignKey('activity.id'), nullable=False, index=True)
+
+    # Also the keyset index for reading a feed
+    __table_args__ = (db.UniqueConstraint('user_id', 'activity_id'),)
+
+class SyncChange(db.Model):
+    """Latest change to a synced row, written by triggers (see sync.py)"""
+    id = db.Column(db.Integer, primary_key=True)
+    # Assigned by sync.stamp_pending() once the change has committed; NULL until then
+    seq = db.Column(db.BigInteger, index=True)
+    entity = db.Column(db.String(20), nullable=False)  # table name
+    entity_id = db.Column(db.Integer, nullable=False)
+    chama_id = db.Column(db.Integer)
+    user_id = db.Column(db.Integer)
+    deleted = db.Column(db.Boolean, nullable=False, default=False)
+
+    __table_args__ = (db.UniqueConstraint('entity', 'entity_id', name='uq_sync_change_entity'),
+                      db.Index('ix_sync_change_chama_seq', 'chama_id', 'seq'))
+
 # Update Chama model to include votes relationship
 Chama.votes = db.relationship('Vote', back_populates='chama', foreign_keys='[Vote.chama_id]', lazy=True)
\ No newline at end of file
@@ -0,0 +1,198 @@
+"""Fail-fast client for outbound calls to third-party APIs.
+
+Every call to a dependency (M-Pesa, Africa's Talking) goes through its
+OutboundClient, which gives it:
+
+- connect and read timeouts, both capped by what is left of a per-call
+  `deadline`, so no call holds a worker longer than that however the
+  retries go;
+- a circuit breaker: after `failures` consecutive failures (timeouts,
+  connection errors, 5xx and 429 responses) calls fail immediately with
+  CircuitOpenError for `reset_after` seconds, then one trial call is let
+  through and its result closes or re-opens the circuit;
+- bounded retries with full jitter, only where a repeat is harmless: any
+  failure of an idempotent call, and connect timeouts (the request never
+  left) of the rest. An STK push or an SMS is never sent twice;
+- per-dependency latency histograms and outcome counters on /metrics.
+
+Settings come from DEFAULT_DEPENDENCIES, overridden per dependency by the
+OUTBOUND_DEPENDENCIES config. Clients and breakers are per process, and
+requests is only imported once a call is made.
+"""
+import os
+import random
+import threading
+import time
+
+from flask import current_app, has_app_context
+
+from extensions import metrics
+
+DEFAULT_DEPENDENCIES = {
+    # Slightly over a multiple of 3 s, the TCP retransmission window
+    'mpesa': {'connect_timeout': 3.05, 'read_timeout': 10.0, 'deadline': 15.0, 'retries': 2,
+              'backoff': 0.25, 'max_backoff': 2.0, 'failures': 5, 'reset_after': 30.0},
+    'sms': {'connect_timeout': 3.05, 'read_timeout': 9.05, 'deadline': 12.0, 'retries': 1,
+            'backoff': 0.25, 'max_backoff': 1.0, 'failures': 5, 'reset_after': 30.0},
+}
+IDEMPOTENT_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'))
+
+class OutboundError(Exception):
+    """A call to a dependency failed; the message says how"""
+
+    def __init__(self, dependency, operation, outcome, detail=''):
+        super().__init__(f'{dependency} {operation}: {outcome}' + (f' ({detail})' if detail else ''))
+        self.dependency = dependency
+        self.operation = operation
+        self.outcome = outcome
+
+class CircuitOpenError(OutboundError):
+    pass
+
+class UpstreamError(Exception):
+    """Raised inside a call for a response that counts as the dependency failing"""
+
+class CircuitBreaker:
+    """Consecutive-failure breaker with a single half-open trial call"""
+
+    def __init__(self, failures, reset_after):
+        self.failures = failures
+        self.reset_after = reset_after
+        self.lock = threading.Lock()
+        self.consecutive = 0
+        self.opened_at = None
+        self.trial = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if self.trial or time.monotonic() - self.opened_at >= self.reset_after:
+            return 'half_open'
+        return 'open'
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.trial or time.monotonic() - self.opened_at < self.reset_after:
+                return False
+            self.trial = True
+            return True
+
+    def record(self, ok):
+        """Count a call's result; None for calls that said nothing about the dependency's health"""
+        with self.lock:
+            if ok is None:
+                self.trial = False
+            elif ok:
+                self.consecutive = 0
+                self.opened_at = None
+                self.trial = False
+            else:
+                self.consecutive += 1
+                if self.trial or self.consecutive >= self.failures:
+                    self.opened_at = time.monotonic()
+                    self.trial = False
+
+class OutboundClient:
+    """Timeouts, circuit breaker, retries and metrics for one dependency"""
+
+    def __init__(self, name, connect_timeout, read_timeout, deadline, retries, backoff, max_backoff,
+                 failures, reset_after):
+        self.name = name
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = CircuitBreaker(failures, reset_after)
+        self.session = None
+
+    def call(self, operation, func, idempotent=False, errors=()):
+        """Return func(timeout) run under this dependency's deadline, breaker and retries.
+
+        `timeout` is a (connect, read) pair for requests. Timeouts,
+        connection errors, UpstreamError and `errors` are failures of the
+        dependency; anything else propagates as it is. Raises OutboundError
+        once the call has failed for good.
+        """
+        import requests  # Loaded on the first outbound call, not at boot
+        deadline = time.monotonic() + self.deadline
+        for attempt in range(self.retries + 1):
+            if not self.breaker.allow():
+                self._record(operation, 'circuit_open')
+                raise CircuitOpenError(self.name, operation, 'circuit_open')
+            remaining = deadline - time.monotonic()
+            timeout = (min(self.connect_timeout, remaining), min(self.read_timeout, remaining))
+            start = time.perf_counter()
+            try:
+                result = func(timeout)
+            except requests.Timeout as exc:
+                # A connect timeout means nothing was sent, so even a payment request can go again
+                outcome, error, retry = 'timeout', exc, idempotent or isinstance(exc, requests.ConnectTimeout)
+            except requests.ConnectionError as exc:
+                outcome, error, retry = 'connection_error', exc, idempotent
+            except (UpstreamError,) + tuple(errors) as exc:
+                outcome, error, retry = 'upstream_error', exc, idempotent
+            except Exception:
+                self.breaker.record(None)
+                self._record(operation, 'error', time.perf_counter() - start)
+                raise
+            else:
+                self.breaker.record(True)
+                self._record(operation, 'ok', time.perf_counter() - start)
+                return result
+            self.breaker.record(False)
+            self._record(operation, outcome, time.perf_counter() - start)
+
+            pause = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+            if not retry or attempt == self.retries or time.monotonic() + pause >= deadline:
+                break
+            time.sleep(pause)
+        raise OutboundError(self.name, operation, outcome, str(error)) from error
+
+    def request(self, operation, method, url, idempotent=None, **kwargs):
+        """An HTTP request through call(); returns the response unless it is a 5xx or 429"""
+        method = method.upper()
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+
+        def send(timeout):
+            response = self._session().request(method, url, timeout=timeout, **kwargs)
+            if response.status_code >= 500 or response.status_code == 429:
+                raise UpstreamError(f'HTTP {response.status_code}')
+            return response
+        return self.call(operation, send, idempotent)
+
+    def _session(self):
+        if self.session is None:
+            import requests
+            self.session = requests.Session()
+        return self.session
+
+    def _record(self, operation, outcome, elapsed=None):
+        metrics.record_outbound(self.name, operation, outcome, elapsed, self.breaker.state)
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client(name):
+    """This process's client for a dependency named in DEFAULT_DEPENDENCIES or OUTBOUND_DEPENDENCIES"""
+    client = _clients.get(name)
+    if client is None:
+        settings = dict(DEFAULT_DEPENDENCIES.get(name, {}))
+        if has_app_context():
+            settings.update(current_app.config.get('OUTBOUND_DEPENDENCIES', {}).get(name, {}))
+        with _clients_lock:
+            client = _clients.setdefault(name, OutboundClient(name, **settings))
+    return client
+
+def reset_clients():
+    """Forget clients (and their breakers), e.g. after a fork or a settings change"""
+    with _clients_lock:
+        _clients.clear()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_clients)
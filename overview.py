@@ -0,0 +1,81 @@
+"""Cross-chama admin overview.
+
+Everything on the overview is loaded with a fixed number of queries, each
+batched over all of the admin's chamas with IN (...) and GROUP BY chama_id,
+so the page costs the same whether the user runs 2 chamas or 50.
+"""
+from datetime import datetime
+
+from sqlalchemy import case, func, or_
+
+from archive import all_contributions
+from compliance import arrears_by_chama
+from extensions import db
+from models import Chama, Contribution, Expense, Membership, User, Vote
+
+def _grouped(query, chama_column, chama_ids):
+    """{chama_id: row values} for a query grouped by chama"""
+    rows = query.filter(chama_column.in_(chama_ids)).group_by(chama_column).all()
+    return {row[0]: row[1:] for row in rows}
+
+def admin_overview(user_id, now=None, recent_limit=15):
+    """Summary rows for every chama the user administers, plus recent activity across them"""
+    now = now or datetime.utcnow()
+    chamas = Chama.query.join(Membership, Membership.chama_id == Chama.id).filter(
+        Membership.user_id == user_id,
+        Membership.is_active == True,
+        Membership.role == 'admin'
+    ).order_by(Chama.name).all()
+    chama_ids = [chama.id for chama in chamas]
+    if not chama_ids:
+        return [], []
+
+    members = _grouped(db.session.query(Membership.chama_id, func.count(Membership.id))
+                       .filter(Membership.is_active == True), Membership.chama_id, chama_ids)
+    facts = all_contributions()
+    contributions = _grouped(db.session.query(
+        facts.c.chama_id,
+        func.coalesce(func.sum(case((facts.c.status == 'confirmed', facts.c.amount), else_=0)), 0),
+        func.sum(case((facts.c.status == 'pending', facts.c.entries), else_=0)),
+        func.max(facts.c.contributed_at),
+    ), facts.c.chama_id, chama_ids)
+    expenses = _grouped(db.session.query(Expense.chama_id, func.sum(Expense.amount), func.max(Expense.created_at)),
+                        Expense.chama_id, chama_ids)
+    votes = _grouped(db.session.query(Vote.chama_id, func.count(Vote.id)).filter(
+        Vote.is_active == True, or_(Vote.closes_at.is_(None), Vote.closes_at > now)
+    ), Vote.chama_id, chama_ids)
+    arrears = arrears_by_chama(chamas, now)
+
+    rows = []
+    for chama in chamas:
+        total_in, pending, last_in = contributions.get(chama.id, (0, 0, None))
+        total_out, last_out = expenses.get(chama.id, (0, None))
+        last_activity = max((d for d in (last_in, last_out) if d is not None), default=None)
+        rows.append({
+            'chama': chama,
+            'members': members.get(chama.id, (0,))[0],
+            'balance': (total_in or 0) - (total_out or 0),
+            'pending': pending or 0,
+            'open_votes': votes.get(chama.id, (0,))[0],
+            'members_in_arrears': arrears[chama.id][0],
+            'arrears': arrears[chama.id][1],
+            'last_activity': last_activity,
+        })
+
+    # Latest contributions and expenses across all the chamas, newest first
+    recent = [{'date': date, 'chama': chama_name, 'kind': 'contribution', 'description': name,
+               'amount': amount, 'status': status}
+              for date, chama_name, name, amount, status in
+              db.session.query(Contribution.contributed_at, Chama.name, User.name, Contribution.amount, Contribution.status)
+              .join(Chama, Chama.id == Contribution.chama_id).join(User, User.id == Contribution.user_id)
+              .filter(Contribution.chama_id.in_(chama_ids))
+              .order_by(Contribution.contributed_at.desc()).limit(recent_limit)]
+    recent += [{'date': date, 'chama': chama_name, 'kind': 'expense', 'description': title,
+                'amount': amount, 'status': None}
+               for date, chama_name, title, amount in
+               db.session.query(Expense.created_at, Chama.name, Expense.title, Expense.amount)
+               .join(Chama, Chama.id == Expense.chama_id)
+               .filter(Expense.chama_id.in_(chama_ids))
+               .order_by(Expense.created_at.desc()).limit(recent_limit)]
+    recent.sort(key=lambda entry: entry['date'], reverse=True)
+    return rows, recent[:recent_limit]
@@ -0,0 +1,320 @@
+"""Late-payment penalties.
+
+A chama's PenaltyRule fines a member for every period not paid in full by
+its due date (the end of the period plus grace_days): a flat amount, or a
+percentage of what was still unpaid then, capped per period (max_fine) and
+per member across all periods (max_total). Payments settle the oldest
+period owed first, the same rule compliance.py uses for arrears, so a
+period paid late is settled when the member's running total catches up.
+
+compute_penalties() works on whole arrays per chama, never per member or
+per period: confirmed payments are sorted by member and time with a
+running total each, and every member x period cell is resolved with two
+np.searchsorted calls, one for when the running total covered the amount
+owed through that period and one for what had been paid by its due date.
+The results are stored as MemberPenalty rows.
+
+Runs are incremental. Cells run up to the open period, and a stored cell
+is kept when nothing since the previous run (or the earliest back-dated
+change, see invalidate_penalties()) can change it: it was settled before
+then, or it is unsettled and already due but the member hasn't paid since.
+Payments before that point collapse into one total per member, so a run
+reads and rewrites only the cells touched by new contributions and the
+periods falling due; members with a recomputed cell that fell due before
+it have their full history loaded.
+"""
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import BigInteger, and_, case, cast, extract, func, or_, select
+
+from archive import all_contributions, archived_rows, month_start
+from compliance import period_starts
+from extensions import db
+from models import Contribution, MemberPenalty, Membership, PenaltyRule
+from statements import invalidate_statements
+
+FINE_TYPES = ('flat', 'percent')
+EPOCH = datetime(1970, 1, 1)
+
+class PenaltyError(ValueError):
+    pass
+
+def _seconds(values):
+    """Naive UTC datetimes as int64 seconds since the epoch"""
+    return np.array(values, dtype='datetime64[s]').astype(np.int64)
+
+def _epoch(column):
+    """SQL expression for a datetime column as whole seconds since the epoch"""
+    if db.engine.dialect.name == 'sqlite':
+        return cast(func.strftime('%s', column), BigInteger)
+    return cast(func.floor(extract('epoch', column)), BigInteger)
+
+def _cents(amounts):
+    return np.rint(np.asarray(amounts, dtype=np.float64) * 100).astype(np.int64)
+
+def settle(rows, times, cents, base, owed, due):
+    """Resolve every member x period cell at once.
+
+    rows, times and cents describe payments sorted by (row, time); base is
+    what each member (row) paid before them; owed is the cumulative amount
+    owed through each period (members x periods) and due the due time of
+    each period. Returns (settled, paid_by_due, paid_total): when each cell
+    was covered (-1 if not yet), what each member had paid by each due
+    time, and what each member has paid in all.
+    """
+    members = len(base)
+    index = np.arange(members)
+    starts = np.searchsorted(rows, index, 'left')
+    ends = np.searchsorted(rows, index, 'right')
+    running = np.concatenate(([0], np.cumsum(cents)))
+    # Running total per member after each payment
+    paid_after = base[rows] + running[1:] - running[starts[rows]]
+    paid_total = base + running[ends] - running[starts]
+
+    # Offsetting each member's values by row x scale makes both key arrays globally sorted
+    scale = int(max(paid_total.max(initial=0), owed.max(initial=0))) + 1
+    covered_at = np.searchsorted(rows * scale + paid_after, index[:, None] * scale + owed, 'left')
+    covered = covered_at < ends[:, None]
+    settled = np.where(covered, np.append(times, -1)[covered_at], -1)
+
+    origin = min(int(times.min(initial=due.min())), int(due.min()))
+    span = max(int(times.max(initial=due.max())), int(due.max())) - origin + 1
+    by_due = np.searchsorted(rows * span + (times - origin), index[:, None] * span + (due - origin), 'right')
+    paid_by_due = base[:, None] + running[by_due] - running[starts][:, None]
+    return settled, paid_by_due, paid_total
+
+def assess(rule, owed, expected, due, settled, paid_by_due, paid_total, mask, kept_fines, now):
+    """Shortfall, outstanding, days late and fine (cents) for the cells in `mask`.
+
+    kept_fines holds the stored fines of the cells outside the mask, which
+    count towards the per-member cap.
+    """
+    shortfall = np.clip(owed - paid_by_due, 0, expected)
+    outstanding = np.clip(owed - paid_total[:, None], 0, expected)
+    late_until = np.where(settled >= 0, settled, now)
+    late = mask & (late_until > due[None, :])
+    days_late = np.where(late, -((due[None, :] - late_until) // 86400), 0)
+
+    if rule.fine_type == 'percent':
+        fines = np.where(late, np.rint(shortfall * rule.fine_amount / 100), 0).astype(np.int64)
+    else:
+        fines = np.where(late, int(_cents(rule.fine_amount)), 0)
+    if rule.max_fine is not None:
+        fines = np.minimum(fines, int(_cents(rule.max_fine)))
+    if rule.max_total is not None:
+        capped = np.minimum(np.cumsum(np.where(mask, fines, kept_fines), axis=1), int(_cents(rule.max_total)))
+        fines = np.diff(capped, axis=1, prepend=0)
+    return shortfall, outstanding, days_late, fines
+
+def _payments(chama_id, user_ids, since, history=()):
+    """Confirmed payments sorted by member row and time, and what each member paid before them.
+
+    Payments are loaded from `since` (all of them when it is None), and
+    from the beginning for the members in `history`.
+    """
+    query = select(Contribution.user_id, _epoch(Contribution.contributed_at), Contribution.amount).where(
+        Contribution.chama_id == chama_id, Contribution.status == 'confirmed', Contribution.user_id.in_(user_ids))
+    if since is not None:
+        query = query.where(or_(Contribution.contributed_at >= since, Contribution.user_id.in_(history)))
+    payments = [tuple(row) for row in db.session.execute(query)]
+    active, full = set(user_ids), set(history)
+    payments += [(row['user_id'], int(_seconds([row['contributed_at']])[0]), row['amount'])
+                 for row in archived_rows(chama_id, None if full else since)
+                 if row['status'] == 'confirmed' and row['user_id'] in active
+                 and (since is None or row['contributed_at'] >= since or row['user_id'] in full)]
+
+    members = np.array(user_ids, dtype=np.int64)
+    base = np.zeros(len(members), dtype=np.int64)
+    if since is not None:
+        # Archived months are whole months, and `since` is always a month start
+        facts = all_contributions()
+        before = db.session.query(facts.c.user_id, func.sum(facts.c.amount)).filter(
+            facts.c.chama_id == chama_id, facts.c.status == 'confirmed', facts.c.contributed_at < since,
+            facts.c.user_id.in_(user_ids), ~facts.c.user_id.in_(history)).group_by(facts.c.user_id).all()
+        if before:
+            before_ids, before_amounts = zip(*before)
+            base[np.searchsorted(members, before_ids)] = _cents(before_amounts)
+
+    if not payments:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty, base
+    table = np.array(payments, dtype=np.float64)
+    rows = np.searchsorted(members, table[:, 0].astype(np.int64))
+    times = table[:, 1].astype(np.int64)
+    amounts = table[:, 2]
+    order = np.lexsort((times, rows))
+    return rows[order], times[order], _cents(amounts)[order], base
+
+def _compute_chama(rule, now):
+    """Recompute a chama's stale cells; the caller commits. Returns the number of cells computed."""
+    chama = rule.chama
+    frequency = chama.contribution_frequency
+    periods = period_starts(frequency, chama.created_at or now, now)
+    members = db.session.query(Membership.user_id, Membership.joined_at).filter(
+        Membership.chama_id == chama.id, Membership.is_active == True).order_by(Membership.user_id).all()
+    stale = MemberPenalty.query.filter(MemberPenalty.chama_id == chama.id)
+    if not periods or not members:
+        stale.delete(synchronize_session=False)
+        invalidate_statements(chama.id, EPOCH)
+        return 0
+
+    since = None
+    if rule.computed_at is not None:
+        since = month_start(min(rule.computed_at, rule.stale_from or rule.computed_at))
+    user_ids = [user_id for user_id, _ in members]
+    # Cells run up to the open period, so a period paid ahead is already settled when it falls due
+    ends = period_starts(frequency, periods[0], periods[-1] + timedelta(days=32))[1:len(periods) + 1]
+    starts = _seconds(periods)
+    due = _seconds([end + timedelta(days=rule.grace_days) for end in ends])
+    joined = _seconds([joined_at or periods[0] for _, joined_at in members])
+    first_due = np.maximum(0, np.searchsorted(starts, joined, 'right') - 1)
+    expected = int(_cents(chama.contribution_amount))
+    counted = np.maximum(0, np.arange(len(periods))[None, :] - first_due[:, None] + 1)
+    owed = counted * expected
+    rows, times, cents, base = _payments(chama.id, user_ids, since)
+
+    # Stored cells that nothing since `since` can change: settled before it, or still unsettled
+    # but already due and the member hasn't paid since. Per member they come first, so one
+    # grouped query gives each member's kept columns and the fines in them.
+    kept = np.zeros(owed.shape, dtype=bool)
+    kept_fines = np.zeros(owed.shape, dtype=np.int64)
+    keep = None
+    if since is not None:
+        payers = [user_ids[row] for row in np.unique(rows).tolist()]
+        keep = or_(and_(MemberPenalty.settled_at != None, MemberPenalty.settled_at < since),
+                   and_(MemberPenalty.settled_at == None, MemberPenalty.due_at < since,
+                        ~MemberPenalty.user_id.in_(payers)))
+        prefixes = np.array([tuple(row) for row in db.session.execute(
+            select(MemberPenalty.user_id, func.min(_epoch(MemberPenalty.period_start)), func.count(),
+                   func.sum(MemberPenalty.fine) * 100)
+            .where(MemberPenalty.chama_id == chama.id, MemberPenalty.user_id.in_(user_ids), keep)
+            .group_by(MemberPenalty.user_id))], dtype=np.float64).reshape(-1, 4)
+        if len(prefixes):
+            prefix_rows = np.searchsorted(np.array(user_ids, dtype=np.int64), prefixes[:, 0].astype(np.int64))
+            first = np.searchsorted(starts, prefixes[:, 1].astype(np.int64))
+            columns = np.arange(len(periods))[None, :]
+            kept[prefix_rows] = (columns >= first[:, None]) & (columns < (first + prefixes[:, 2].astype(np.int64))[:, None])
+            kept_fines[prefix_rows, np.minimum(first, len(periods) - 1)] = np.rint(prefixes[:, 3])
+    computed = (counted > 0) & ~kept
+
+    # Payments before `since` only count as one total, which is right for what was paid by a due
+    # date after it. Cells paid before `since` (a new member, or a new period paid ahead) and
+    # recomputed cells falling due before it need those members' earlier payments.
+    due_before = due < int(_seconds([since])[0]) if since is not None else np.zeros(len(periods), dtype=bool)
+    history = np.flatnonzero(np.any(computed & ((owed <= base[:, None]) | due_before[None, :]), axis=1))
+    history_ids = [user_ids[row] for row in history.tolist()]
+    if since is not None and history_ids:
+        rows, times, cents, base = _payments(chama.id, user_ids, since, history_ids)
+        kept[history] = False
+        kept_fines[history] = 0
+        computed = (counted > 0) & ~kept
+
+    settled, paid_by_due, paid_total = settle(rows, times, cents, base, owed, due)
+    shortfall, outstanding, days_late, fines = assess(rule, owed, expected, due, settled, paid_by_due, paid_total,
+                                                      computed, kept_fines, int(_seconds([now])[0]))
+    # Only closed periods are in arrears
+    outstanding[:, -1] = 0
+
+    # Cached statements show fines and arrears from the month of the earliest cell rewritten on
+    cell_rows, cell_cols = np.nonzero(computed)
+    if keep is None:
+        changed_from = EPOCH
+    else:
+        departed = db.session.query(func.min(MemberPenalty.period_start)).filter(
+            MemberPenalty.chama_id == chama.id, ~MemberPenalty.user_id.in_(user_ids)).scalar()
+        candidates = [departed] if departed else []
+        if len(cell_cols):
+            candidates.append(periods[int(cell_cols.min())])
+        changed_from = min(candidates, default=None)
+    if changed_from is not None:
+        invalidate_statements(chama.id, changed_from)
+
+    if keep is None:
+        stale.delete(synchronize_session=False)
+    else:
+        stale.filter(or_(~MemberPenalty.user_id.in_(user_ids), MemberPenalty.user_id.in_(history_ids), ~keep))\
+            .delete(synchronize_session=False)
+    db.session.bulk_insert_mappings(MemberPenalty, [
+        {'chama_id': chama.id, 'user_id': user_ids[row], 'period_start': periods[col],
+         'due_at': EPOCH + timedelta(seconds=due_at), 'shortfall': short / 100, 'outstanding': unpaid / 100,
+         'settled_at': EPOCH + timedelta(seconds=settled_at) if settled_at >= 0 else None,
+         'days_late': days, 'fine': fine / 100}
+        for row, col, due_at, short, unpaid, settled_at, days, fine in zip(
+            cell_rows.tolist(), cell_cols.tolist(), due[cell_cols].tolist(),
+            shortfall[computed].tolist(), outstanding[computed].tolist(), settled[computed].tolist(),
+            days_late[computed].tolist(), fines[computed].tolist())
+    ])
+    rule.stale_from = None
+    rule.computed_at = now
+    return len(cell_rows)
+
+def compute_penalties(chama_id=None, now=None):
+    """Bring stored penalties up to date for every chama with a rule (or one chama).
+
+    Commits after each chama. Returns the number of cells recomputed.
+    """
+    now = now or datetime.utcnow()
+    query = PenaltyRule.query.order_by(PenaltyRule.chama_id)
+    if chama_id is not None:
+        query = query.filter(PenaltyRule.chama_id == chama_id)
+    computed = 0
+    for rule in query.all():
+        computed += _compute_chama(rule, now)
+        db.session.commit()
+    return computed
+
+def save_rule(chama_id, grace_days, fine_type, fine_amount, max_fine=None, max_total=None):
+    """Create or replace a chama's rule; everything (and every cached statement) is recomputed. The caller commits."""
+    if fine_type not in FINE_TYPES:
+        raise PenaltyError('Choose a flat or percentage fine')
+    if grace_days < 0 or fine_amount < 0 or (max_fine is not None and max_fine < 0) \
+            or (max_total is not None and max_total < 0):
+        raise PenaltyError('Grace days, fines and caps cannot be negative')
+    if fine_type == 'percent' and fine_amount > 100:
+        raise PenaltyError('A percentage fine cannot exceed 100%')
+    rule = PenaltyRule.query.filter_by(chama_id=chama_id).first()
+    if rule is None:
+        rule = PenaltyRule(chama_id=chama_id)
+        db.session.add(rule)
+    rule.grace_days = grace_days
+    rule.fine_type = fine_type
+    rule.fine_amount = fine_amount
+    rule.max_fine = max_fine
+    rule.max_total = max_total
+    rule.stale_from = None
+    rule.computed_at = None
+    rule.updated_at = datetime.utcnow()
+    invalidate_statements(chama_id, EPOCH)
+    return rule
+
+def invalidate_penalties(chama_id, since):
+    """Recompute cells that could depend on entries dated at or after `since` on the next run"""
+    PenaltyRule.query.filter(
+        PenaltyRule.chama_id == chama_id,
+        or_(PenaltyRule.stale_from == None, PenaltyRule.stale_from > since),
+    ).update({'stale_from': since}, synchronize_session=False)
+
+def penalty_summary(chama_id, now=None):
+    """Per-member totals from the stored cells, most fined first.
+
+    Unsettled cells keep getting later after they were computed, so their
+    lateness is counted up to `now`.
+    """
+    now = now or datetime.utcnow()
+    overdue = and_(MemberPenalty.settled_at == None, MemberPenalty.due_at < now)
+    oldest = dict(db.session.query(MemberPenalty.user_id, func.min(MemberPenalty.due_at))
+                  .filter(MemberPenalty.chama_id == chama_id, overdue).group_by(MemberPenalty.user_id))
+    rows = db.session.query(
+        MemberPenalty.user_id,
+        func.sum(MemberPenalty.fine),
+        func.sum(MemberPenalty.outstanding),
+        func.sum(case((or_(MemberPenalty.days_late > 0, overdue), 1), else_=0)),
+        func.max(MemberPenalty.days_late),
+    ).filter(MemberPenalty.chama_id == chama_id).group_by(MemberPenalty.user_id).all()
+    summary = [{'user_id': user_id, 'fines': fines, 'arrears': arrears, 'late_periods': late_periods,
+                'worst_days': max(worst_days, -((oldest[user_id] - now) // timedelta(days=1)))
+                if user_id in oldest else worst_days}
+               for user_id, fines, arrears, late_periods, worst_days in rows]
+    summary.sort(key=lambda row: (-row['fines'], -row['arrears']))
+    return summary
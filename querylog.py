@@ -0,0 +1,212 @@
+"""Query fingerprinting and slow-query log.
+
+Every statement is reduced to a fingerprint (literals, bind parameters and
+IN-lists replaced by placeholders) and counted with its total and max time,
+per fingerprint and per originating Flask endpoint. Statements slower than
+SLOW_QUERY_THRESHOLD_MS get an EXPLAIN plan captured (EXPLAIN ANALYZE on
+PostgreSQL for plain SELECTs when SLOW_QUERY_EXPLAIN_ANALYZE is on, EXPLAIN
+QUERY PLAN on SQLite) and, if SLOW_QUERY_LOG_PATH is set, appended to a
+JSONL file. Only DML is explained, and on PostgreSQL inside a savepoint, so
+a failed EXPLAIN never aborts the application's transaction.
+
+The ranked report is served on /admin/queries (HTML, or JSONL with
+?format=jsonl) in debug mode or with an `Authorization: Bearer
+<QUERY_LOG_TOKEN>` header.
+"""
+import hmac
+import json
+import re
+import threading
+import time
+from datetime import datetime
+
+from flask import Response, abort, current_app, has_request_context, render_template, request
+from sqlalchemy import event
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER = re.compile(r'%\(\w+\)s|%s|(?<!:):\w+|\$\d+')
+_IN_LIST = re.compile(r'\bIN \(\?(?:, \?)*\)', re.IGNORECASE)
+_VALUES_ROWS = re.compile(r'(\(\?(?:, \?)*\))(?:, \(\?(?:, \?)*\))+')
+_WHITESPACE = re.compile(r'\s+')
+_EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')
+
+def fingerprint(statement):
+    """Normalize a SQL statement so that executions differing only in values match"""
+    sql = _STRING.sub('?', statement)
+    sql = _PLACEHOLDER.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _WHITESPACE.sub(' ', sql).strip()
+    sql = _IN_LIST.sub('IN (...)', sql)
+    return _VALUES_ROWS.sub(r'\1, ...', sql)
+
+class QueryLog:
+    """Flask extension aggregating statement fingerprints and capturing slow plans"""
+
+    max_cached_statements = 5000
+
+    def __init__(self, app=None, db=None):
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.fingerprints = {}
+        self.threshold = 0.1
+        self.explain_analyze = False
+        self.log_path = None
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db=None):
+        if db is None:
+            from extensions import db
+        app.extensions['query_log'] = self
+        if not app.config.setdefault('QUERY_LOG_ENABLED', True):
+            return
+        self.threshold = app.config.setdefault('SLOW_QUERY_THRESHOLD_MS', 100) / 1000
+        self.explain_analyze = app.config.setdefault('SLOW_QUERY_EXPLAIN_ANALYZE', False)
+        self.log_path = app.config.setdefault('SLOW_QUERY_LOG_PATH', None)
+        app.add_url_rule('/admin/queries', 'query_log', self.report_view)
+
+        with app.app_context():
+            for engine in db.engines.values():
+                event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+                event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+                event.listen(engine, 'handle_error', self._handle_error)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('_query_log_start', []).append(time.perf_counter())
+
+    def _handle_error(self, context):
+        # A failed statement never reaches after_cursor_execute; drop its start time
+        starts = context.connection.info.get('_query_log_start') if context.connection is not None else None
+        if starts:
+            starts.pop()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['_query_log_start'].pop()
+
+        fp = self.fingerprints.get(statement)
+        if fp is None:
+            if len(self.fingerprints) >= self.max_cached_statements:
+                self.fingerprints.clear()
+            fp = self.fingerprints[statement] = fingerprint(statement)
+        route = (request.endpoint or 'unmatched') if has_request_context() else 'background'
+
+        with self.lock:
+            entry = self.stats.get(fp)
+            if entry is None:
+                entry = self.stats[fp] = {'count': 0, 'total': 0.0, 'max': 0.0, 'routes': {}, 'plan': None}
+            entry['count'] += 1
+            entry['total'] += elapsed
+            entry['max'] = max(entry['max'], elapsed)
+            by_route = entry['routes'].setdefault(route, [0, 0.0])
+            by_route[0] += 1
+            by_route[1] += elapsed
+            needs_plan = elapsed >= self.threshold and entry['plan'] is None and not executemany
+            if needs_plan:
+                entry['plan'] = ''  # claimed, so concurrent slow runs don't all EXPLAIN
+
+        if elapsed >= self.threshold:
+            plan = self._explain(conn, statement, parameters) if needs_plan else None
+            if plan is not None:
+                with self.lock:
+                    entry['plan'] = plan
+            self._write_slow(fp, route, elapsed, plan)
+
+    def _explain(self, conn, statement, parameters):
+        """Run EXPLAIN for a statement on the same connection, bypassing events"""
+        dialect = conn.dialect.name
+        verb = statement.lstrip().upper()
+        # SAVEPOINT, SET, DDL and the like have no plan
+        if not verb.startswith(_EXPLAINABLE):
+            return None
+        if dialect == 'postgresql':
+            # ANALYZE runs the statement again; a WITH may hide a data-modifying CTE
+            if self.explain_analyze and verb.startswith('SELECT'):
+                prefix = 'EXPLAIN (ANALYZE, BUFFERS) '
+            else:
+                prefix = 'EXPLAIN '
+        elif dialect == 'sqlite':
+            prefix = 'EXPLAIN QUERY PLAN '
+        else:
+            prefix = 'EXPLAIN '
+        # On PostgreSQL a failed statement aborts the whole transaction, so fence it off
+        savepoint = dialect == 'postgresql'
+        try:
+            cursor = conn.connection.dbapi_connection.cursor()
+        except Exception as e:
+            return f'EXPLAIN failed: {e}'
+        try:
+            if savepoint:
+                cursor.execute('SAVEPOINT query_log_explain')
+            try:
+                cursor.execute(prefix + statement, parameters)
+                rows = cursor.fetchall()
+            except Exception as e:
+                if savepoint:
+                    cursor.execute('ROLLBACK TO SAVEPOINT query_log_explain')
+                    cursor.execute('RELEASE SAVEPOINT query_log_explain')
+                return f'EXPLAIN failed: {e}'
+            if savepoint:
+                cursor.execute('RELEASE SAVEPOINT query_log_explain')
+        except Exception as e:
+            # No transaction to put a savepoint in (autocommit), or rolling back failed
+            return f'EXPLAIN failed: {e}'
+        finally:
+            cursor.close()
+        # SQLite rows are (id, parent, notused, detail); other dialects return one text column
+        return '\n'.join(str(row[-1] if dialect == 'sqlite' else row[0]) for row in rows)
+
+    def _write_slow(self, fp, route, elapsed, plan):
+        if not self.log_path:
+            return
+        record = {
+            'at': datetime.utcnow().isoformat(),
+            'fingerprint': fp,
+            'route': route,
+            'duration_ms': round(elapsed * 1000, 3),
+        }
+        if plan:
+            record['plan'] = plan
+        line = json.dumps(record) + '\n'
+        with self.lock:
+            with open(self.log_path, 'a') as f:
+                f.write(line)
+
+    def report(self, limit=None):
+        """Fingerprints ranked by total time, with a per-route breakdown"""
+        with self.lock:
+            rows = [{
+                'fingerprint': fp,
+                'count': entry['count'],
+                'total_ms': round(entry['total'] * 1000, 3),
+                'mean_ms': round(entry['total'] / entry['count'] * 1000, 3),
+                'max_ms': round(entry['max'] * 1000, 3),
+                'routes': sorted(({'route': route, 'count': count, 'total_ms': round(total * 1000, 3)}
+                                  for route, (count, total) in entry['routes'].items()),
+                                 key=lambda r: r['total_ms'], reverse=True),
+                'plan': entry['plan'] or None,
+            } for fp, entry in self.stats.items()]
+        rows.sort(key=lambda r: r['total_ms'], reverse=True)
+        return rows[:limit] if limit else rows
+
+    def dump_jsonl(self, path):
+        """Write the current report to a JSONL file, one fingerprint per line"""
+        with open(path, 'w') as f:
+            for row in self.report():
+                f.write(json.dumps(row) + '\n')
+
+    def reset(self):
+        with self.lock:
+            self.stats.clear()
+
+    def report_view(self):
+        token = current_app.config.get('QUERY_LOG_TOKEN')
+        if not current_app.debug and (not token or not hmac.compare_digest(
+                request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode())):
+            abort(404)
+
+        rows = self.report(limit=request.args.get('limit', 200, type=int))
+        if request.args.get('format') == 'jsonl':
+            body = ''.join(json.dumps(row) + '\n' for row in rows)
+            return Response(body, mimetype='application/x-ndjson')
+        return render_template('query_log.html', rows=rows, threshold_ms=self.threshold * 1000)
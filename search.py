@@ -0,0 +1,133 @@
+"""Indexed search over members, chamas and transactions.
+
+Substring search on User.name, Chama.name and Contribution.transaction_ref
+(and ArchivedReference.transaction_ref, for archived months) is always
+answered from an index: trigram GIN indexes (pg_trgm) on
+PostgreSQL, and external-content FTS5 tables with the trigram tokenizer on
+SQLite, kept in sync by triggers so bulk inserts are covered too. Phone
+numbers are matched by prefix of their canonical form with range
+conditions on the phone_e164 index. Results are scoped to the caller's
+chamas.
+
+Trigram indexes need at least MIN_TERM_LENGTH characters; shorter terms
+return nothing rather than falling back to a scan.
+"""
+import re
+
+from sqlalchemy import DDL, Integer, and_, event, false, text
+
+from extensions import db
+from models import ArchivedReference, Chama, Contribution, Membership, User
+
+MIN_TERM_LENGTH = 3
+
+_NON_DIGITS = re.compile(r'[^\d]')
+_PHONE_QUERY = re.compile(r'^\+?[\d\s-]+$')
+
+# (table, fts table, indexed column)
+_SEARCHABLE = [
+    ('user', 'user_search', 'name'),
+    ('chama', 'chama_search', 'name'),
+    ('contribution', 'contribution_search', 'transaction_ref'),
+    ('archived_reference', 'archived_reference_search', 'transaction_ref'),
+]
+
+def _sqlite_ddl(table, fts, column):
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+        f"{column}, content='{table}', content_rowid='id', tokenize='trigram')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON \"{table}\" BEGIN "
+        f"INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON \"{table}\" BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {column} ON \"{table}\" BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column}); "
+        f"INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column}); END",
+    ]
+
+def _postgresql_ddl(table, fts, column):
+    return [f'CREATE INDEX IF NOT EXISTS ix_{table}_{column}_trgm ON "{table}" USING gin ({column} gin_trgm_ops)']
+
+def _install_ddl():
+    """Create the search indexes alongside the tables in db.create_all()"""
+    for table, fts, column in _SEARCHABLE:
+        target = db.metadata.tables[table]
+        event.listen(target, 'after_create',
+                     DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+        for dialect, build in (('sqlite', _sqlite_ddl), ('postgresql', _postgresql_ddl)):
+            for statement in build(table, fts, column):
+                event.listen(target, 'after_create', DDL(statement).execute_if(dialect=dialect))
+        # Triggers go with the table; the FTS table has to be dropped explicitly
+        event.listen(target, 'before_drop', DDL(f'DROP TABLE IF EXISTS {fts}').execute_if(dialect='sqlite'))
+
+_install_ddl()
+
+def rebuild_search_index():
+    """Repopulate the SQLite FTS tables from their content tables"""
+    if db.engine.dialect.name != 'sqlite':
+        return False
+    for _, fts, _ in _SEARCHABLE:
+        db.session.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+    return True
+
+def _match(model, fts, column, term):
+    """Filter condition for rows whose column contains `term`, via the index"""
+    if db.engine.dialect.name == 'sqlite':
+        # A quoted FTS5 string is matched as a substring by the trigram tokenizer
+        phrase = '"' + term.replace('"', '""') + '"'
+        return model.id.in_(text(f'SELECT rowid FROM {fts} WHERE {fts} MATCH :phrase')
+                            .bindparams(phrase=phrase).columns(rowid=Integer))
+    pattern = '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    return getattr(model, column).ilike(pattern)
+
+def phone_prefix(query):
+    """Canonical (+254...) prefix for a partially typed phone number, or None"""
+    digits = _NON_DIGITS.sub('', query)
+    if len(digits) < MIN_TERM_LENGTH:
+        return None
+    if digits.startswith('254'):
+        return '+' + digits
+    if digits.startswith('0'):
+        return '+254' + digits[1:]
+    return '+254' + digits
+
+def _phone_match(prefix):
+    # A range condition uses the phone_e164 index; LIKE 'x%' may not
+    return and_(User.phone_e164 >= prefix, User.phone_e164 < prefix + '\uffff')
+
+def search(user_id, query, limit=20):
+    """Members, chamas and contributions matching `query` within the user's chamas"""
+    term = (query or '').strip()
+    results = {'members': [], 'chamas': [], 'contributions': []}
+    if len(term) < MIN_TERM_LENGTH:
+        return results
+
+    chama_ids = db.session.query(Membership.chama_id).filter(
+        Membership.user_id == user_id, Membership.is_active == True
+    ).scalar_subquery()
+    member_ids = db.session.query(Membership.user_id).filter(
+        Membership.chama_id.in_(chama_ids), Membership.is_active == True
+    ).scalar_subquery()
+
+    if _PHONE_QUERY.match(term):
+        prefix = phone_prefix(term)
+        member_filter = _phone_match(prefix) if prefix else false()
+    else:
+        member_filter = _match(User, 'user_search', 'name', term)
+    results['members'] = User.query.filter(member_filter, User.id.in_(member_ids))\
+        .order_by(User.name).limit(limit).all()
+
+    results['chamas'] = Chama.query.filter(_match(Chama, 'chama_search', 'name', term), Chama.id.in_(chama_ids))\
+        .order_by(Chama.name).limit(limit).all()
+
+    hot = Contribution.query.filter(
+        _match(Contribution, 'contribution_search', 'transaction_ref', term),
+        Contribution.chama_id.in_(chama_ids)
+    ).order_by(Contribution.contributed_at.desc()).limit(limit).all()
+    # Archived months keep their references on the archive side
+    cold = ArchivedReference.query.filter(
+        _match(ArchivedReference, 'archived_reference_search', 'transaction_ref', term),
+        ArchivedReference.chama_id.in_(chama_ids)
+    ).order_by(ArchivedReference.contributed_at.desc()).limit(limit).all()
+    results['contributions'] = sorted(hot + cold, key=lambda row: row.contributed_at, reverse=True)[:limit]
+    return results
@@ -0,0 +1,224 @@
+"""Monthly member statements.
+
+A statement covers one member of one chama for a calendar month: their
+contributions in the month, confirmed totals to date, late-payment
+penalties and their share of the chama's closing balance. It is rendered
+from templates/statement.html as a standalone, print-ready HTML document.
+
+generate_statements() renders whole chamas at a time. Each chama costs a
+fixed handful of queries (_load_chama) however many members it has, and
+chamas are spread over a pool of forked worker processes, so the month-end
+run happens outside the web workers (`flask generate-statements`). Files
+are named by the SHA-256 of their contents, so re-running a month only
+writes statements that changed, and a Statement row points each member
+and month at its file. Pages serve that file; a statement that is missing
+or invalidated by a back-dated change is rendered on demand for that one
+member.
+"""
+import hashlib
+import multiprocessing
+import os
+import tempfile
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import func, or_
+
+from archive import all_contributions, archived_rows, month_start, next_month
+from extensions import db
+from ledger import balance_at
+from models import Chama, Contribution, MemberPenalty, Membership, PenaltyRule, Statement, User
+
+TEMPLATE = 'statement.html'
+
+def statement_dir(app=None):
+    app = app or current_app
+    return app.config.get('STATEMENT_DIR') or os.path.join(app.instance_path, 'statements')
+
+def statement_path(digest, app=None):
+    return os.path.join(statement_dir(app), digest[:2], f'{digest}.html')
+
+def _store(content, app=None):
+    """Write `content` under its digest unless it's already there; returns the digest"""
+    data = content.encode()
+    digest = hashlib.sha256(data).hexdigest()
+    path = statement_path(digest, app)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename, so a concurrent reader never sees half a file
+        fd, temp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as handle:
+            handle.write(data)
+        os.replace(temp, path)
+    return digest
+
+def _load_chama(chama_id, start, user_ids=None):
+    """Everything the chama's statements for the month starting `start` need, in one pass"""
+    end = next_month(start)
+    chama = db.session.get(Chama, chama_id)
+
+    contributions = db.session.query(Contribution.user_id, Contribution.contributed_at, Contribution.amount,
+                                     Contribution.status, Contribution.payment_method, Contribution.transaction_ref)\
+        .filter(Contribution.chama_id == chama_id, Contribution.contributed_at >= start,
+                Contribution.contributed_at < end)
+    if user_ids is not None:
+        contributions = contributions.filter(Contribution.user_id.in_(user_ids))
+    monthly = defaultdict(list)
+    for user_id, contributed_at, amount, status, method, reference in contributions:
+        monthly[user_id].append({'date': contributed_at, 'amount': amount, 'status': status,
+                                 'method': method, 'reference': reference})
+    for row in archived_rows(chama_id, start, end):
+        if user_ids is None or row['user_id'] in user_ids:
+            monthly[row['user_id']].append({'date': row['contributed_at'], 'amount': row['amount'],
+                                            'status': row['status'], 'method': row['payment_method'],
+                                            'reference': row['transaction_ref']})
+    for rows in monthly.values():
+        rows.sort(key=lambda row: row['date'])
+
+    # Members active now, or who contributed in the month
+    members = db.session.query(Membership.user_id, User.name, User.phone_number, Membership.role, Membership.joined_at)\
+        .join(User, User.id == Membership.user_id)\
+        .filter(Membership.chama_id == chama_id, Membership.joined_at < end,
+                or_(Membership.is_active == True, Membership.user_id.in_(list(monthly))))
+    if user_ids is not None:
+        members = members.filter(Membership.user_id.in_(user_ids))
+    members = members.order_by(Membership.user_id).all()
+
+    # Confirmed totals to the end of the month; archived months are dated at their start
+    facts = all_contributions()
+    totals = dict(db.session.query(facts.c.user_id, func.sum(facts.c.amount))
+                  .filter(facts.c.chama_id == chama_id, facts.c.status == 'confirmed',
+                          facts.c.contributed_at < end).group_by(facts.c.user_id))
+    chama_total = sum(totals.values())
+
+    penalties = defaultdict(list)
+    penalty_query = MemberPenalty.query.filter(MemberPenalty.chama_id == chama_id, MemberPenalty.period_start < end)
+    if user_ids is not None:
+        penalty_query = penalty_query.filter(MemberPenalty.user_id.in_(user_ids))
+    for penalty in penalty_query.order_by(MemberPenalty.period_start):
+        penalties[penalty.user_id].append(penalty)
+    assessed_at = db.session.query(PenaltyRule.computed_at).filter_by(chama_id=chama_id).scalar()
+
+    return {
+        'chama': chama, 'start': start, 'end': end, 'members': members, 'monthly': monthly,
+        'totals': totals, 'chama_total': chama_total, 'penalties': penalties, 'assessed_at': assessed_at,
+        'opening': balance_at(chama_id, start), 'closing': balance_at(chama_id, end),
+    }
+
+def _context(data, member):
+    user_id, name, phone, role, joined_at = member
+    rows = data['monthly'].get(user_id, [])
+    total = data['totals'].get(user_id, 0.0)
+    penalties = data['penalties'].get(user_id, [])
+    closing = data['closing']['balance']
+    return {
+        'chama': data['chama'], 'start': data['start'], 'end': data['end'],
+        'member': {'id': user_id, 'name': name, 'phone': phone, 'role': role, 'joined_at': joined_at},
+        'contributions': rows,
+        'confirmed_in_month': sum(row['amount'] for row in rows if row['status'] == 'confirmed'),
+        'pending_in_month': sum(row['amount'] for row in rows if row['status'] == 'pending'),
+        'confirmed_to_date': total,
+        'penalties': [penalty for penalty in penalties if penalty.period_start >= data['start']],
+        'fines_to_date': sum(penalty.fine for penalty in penalties),
+        'arrears': sum(penalty.outstanding for penalty in penalties),
+        'assessed_at': data['assessed_at'],
+        'opening_balance': data['opening']['balance'], 'closing_balance': closing,
+        'share_percent': total / data['chama_total'] * 100 if data['chama_total'] else 0.0,
+        'share': closing * total / data['chama_total'] if data['chama_total'] else 0.0,
+    }
+
+def generate_chama(chama_id, start, user_ids=None, app=None):
+    """Render and store the month's statements for a chama (or some of its members); the caller commits.
+
+    Returns {user_id: digest}.
+    """
+    app = app or current_app._get_current_object()
+    start = month_start(start)
+    data = _load_chama(chama_id, start, user_ids)
+    template = app.jinja_env.get_template(TEMPLATE)
+    now = datetime.utcnow()
+    # Nothing time-of-render goes into the document, so unchanged statements keep their digest
+    digests = {member[0]: _store(template.render(**_context(data, member)), app) for member in data['members']}
+
+    existing = Statement.query.filter(Statement.chama_id == chama_id, Statement.period_start == start)
+    if user_ids is not None:
+        existing = existing.filter(Statement.user_id.in_(user_ids))
+    existing.delete(synchronize_session=False)
+    db.session.bulk_insert_mappings(Statement, [
+        {'chama_id': chama_id, 'user_id': user_id, 'period_start': start, 'digest': digest, 'generated_at': now}
+        for user_id, digest in digests.items()
+    ])
+    return digests
+
+# Process pool
+
+_app = None
+
+def _init_worker():
+    # Pooled connections were inherited from the parent; open fresh ones
+    with _app.app_context():
+        db.engine.dispose(close=False)
+
+def _generate_one(job):
+    chama_id, start = job
+    with _app.app_context():
+        count = len(generate_chama(chama_id, start, app=_app))
+        db.session.commit()
+        return count
+
+def generate_statements(app, start, chama_ids=None, workers=None):
+    """Statements for every member of every chama (or `chama_ids`) for the month containing `start`.
+
+    Chamas are rendered in `workers` forked processes (default: one per
+    CPU), largest first, each committing its own. Returns statements
+    written.
+    """
+    global _app
+    start = month_start(start)
+    sizes = db.session.query(Membership.chama_id, func.count(Membership.id))\
+        .filter(Membership.joined_at < next_month(start)).group_by(Membership.chama_id)
+    if chama_ids is not None:
+        sizes = sizes.filter(Membership.chama_id.in_(chama_ids))
+    jobs = [(chama_id, start) for chama_id, _ in sorted(sizes, key=lambda row: -row[1])]
+    db.session.commit()
+
+    workers = workers or os.cpu_count() or 1
+    _app = app
+    if workers == 1 or len(jobs) <= 1:
+        return sum(_generate_one(job) for job in jobs)
+    with ProcessPoolExecutor(min(workers, len(jobs)), mp_context=multiprocessing.get_context('fork'),
+                             initializer=_init_worker) as pool:
+        return sum(pool.map(_generate_one, jobs))
+
+# Serving
+
+def member_statement(chama_id, user_id, start):
+    """Path of a member's statement for the month containing `start`, rendered if missing; the caller commits"""
+    start = month_start(start)
+    statement = Statement.query.filter_by(chama_id=chama_id, user_id=user_id, period_start=start).first()
+    if statement is not None and os.path.exists(statement_path(statement.digest)):
+        return statement.digest, statement_path(statement.digest)
+    digest = generate_chama(chama_id, start, user_ids=[user_id]).get(user_id)
+    if digest is None:
+        return None, None
+    return digest, statement_path(digest)
+
+def statement_months(chama_id, user_id, now=None):
+    """Closed months a member can have a statement for, newest first"""
+    joined_at = db.session.query(func.min(Membership.joined_at))\
+        .filter_by(chama_id=chama_id, user_id=user_id).scalar()
+    if joined_at is None:
+        return []
+    months, month = [], month_start(joined_at)
+    current = month_start(now or datetime.utcnow())
+    while month < current:
+        months.append(month)
+        month = next_month(month)
+    return months[::-1]
+
+def invalidate_statements(chama_id, since):
+    """Forget cached statements from the month of `since` on; they are rendered again when next asked for"""
+    Statement.query.filter(Statement.chama_id == chama_id, Statement.period_start >= month_start(since))\
+        .delete(synchronize_session=False)
@@ -0,0 +1,158 @@
+"""Delta sync feed for offline-first clients.
+
+Triggers on every synced table upsert one sync_change row per changed row
+(keyed by table and id), so the feed is compacted: a row that changed a
+hundred times since the client's cursor is sent once, with its current
+state, and deletions leave a tombstone. Triggers also catch bulk and Core
+writes (record_vote's INSERT ... ON CONFLICT, account deletion) that ORM
+events would miss.
+
+Sequence numbers are not assigned by the writers. Before reading,
+stamp_pending() numbers the changes that have committed since the last
+stamp, one stamper at a time, so every change that commits later gets a
+higher number than anything a client has already seen. Writers that
+commit out of order can't be skipped by a cursor.
+"""
+from datetime import date, datetime
+
+from sqlalchemy import DDL, and_, event, or_, text
+
+from extensions import db
+from models import Contribution, Expense, Goal, Membership, SyncChange, User, Vote, VoteOption, VoteResponse
+
+DEFAULT_PAGE = 200
+MAX_PAGE = 1000
+STAMP_LOCK = 4201  # pg_advisory_xact_lock key
+
+_VOTE_CHAMA = '(SELECT chama_id FROM vote WHERE vote.id = {row}.vote_id)'
+
+# table: (model, chama_id expression, user_id expression)
+SYNCED = {
+    'membership': (Membership, '{row}.chama_id', '{row}.user_id'),
+    'contribution': (Contribution, '{row}.chama_id', '{row}.user_id'),
+    'expense': (Expense, '{row}.chama_id', 'NULL'),
+    'goal': (Goal, '{row}.chama_id', 'NULL'),
+    'vote': (Vote, '{row}.chama_id', 'NULL'),
+    'vote_option': (VoteOption, _VOTE_CHAMA, 'NULL'),
+    'vote_response': (VoteResponse, _VOTE_CHAMA, '{row}.user_id'),
+}
+
+def _upsert(table, row, deleted):
+    _, chama, user = SYNCED[table]
+    return (f"INSERT INTO sync_change (entity, entity_id, chama_id, user_id, deleted, seq) "
+            f"VALUES ('{table}', {row}.id, {chama.format(row=row)}, {user.format(row=row)}, {deleted}, NULL) "
+            f"ON CONFLICT (entity, entity_id) DO UPDATE SET "
+            f"chama_id = coalesce(excluded.chama_id, sync_change.chama_id), "
+            f"user_id = coalesce(excluded.user_id, sync_change.user_id), "
+            f"deleted = excluded.deleted, seq = NULL;")
+
+def _sqlite_ddl(table):
+    return [
+        f'CREATE TRIGGER IF NOT EXISTS sync_{table}_ai AFTER INSERT ON "{table}" BEGIN '
+        f'{_upsert(table, "new", 0)} END',
+        f'CREATE TRIGGER IF NOT EXISTS sync_{table}_au AFTER UPDATE ON "{table}" BEGIN '
+        f'{_upsert(table, "new", 0)} END',
+        f'CREATE TRIGGER IF NOT EXISTS sync_{table}_ad AFTER DELETE ON "{table}" BEGIN '
+        f'{_upsert(table, "old", 1)} END',
+    ]
+
+def _postgresql_ddl(table):
+    upsert = _upsert(table, 'r', "TG_OP = 'DELETE'")
+    return [
+        f"CREATE OR REPLACE FUNCTION sync_{table}() RETURNS trigger AS $$ "
+        f"DECLARE r record; BEGIN "
+        f"IF TG_OP = 'DELETE' THEN r := OLD; ELSE r := NEW; END IF; "
+        f"{upsert} "
+        f"RETURN NULL; END $$ LANGUAGE plpgsql",
+        f'DROP TRIGGER IF EXISTS sync_{table} ON "{table}"',
+        f'CREATE TRIGGER sync_{table} AFTER INSERT OR UPDATE OR DELETE ON "{table}" '
+        f'FOR EACH ROW EXECUTE PROCEDURE sync_{table}()',
+    ]
+
+def _install_ddl():
+    """Create the change triggers alongside the tables in db.create_all()"""
+    for table in SYNCED:
+        target = db.metadata.tables[table]
+        for dialect, build in (('sqlite', _sqlite_ddl), ('postgresql', _postgresql_ddl)):
+            for statement in build(table):
+                event.listen(target, 'after_create', DDL(statement).execute_if(dialect=dialect))
+
+_install_ddl()
+
+def stamp_pending():
+    """Give committed changes without a sequence number the next ones; commits"""
+    if not db.session.query(SyncChange.query.filter(SyncChange.seq.is_(None)).exists()).scalar():
+        return 0
+    if db.engine.dialect.name == 'postgresql':
+        # One stamper at a time, so max(seq) below includes every earlier stamp
+        db.session.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': STAMP_LOCK})
+    # ids are unique, so id - min(id) numbers the batch without collisions
+    stamped = db.session.execute(text(
+        'UPDATE sync_change SET seq = (SELECT coalesce(max(seq), 0) FROM sync_change) + id + 1 '
+        '- (SELECT min(id) FROM sync_change WHERE seq IS NULL) WHERE seq IS NULL'
+    )).rowcount
+    db.session.commit()
+    return stamped
+
+def _json(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+def _row_json(row):
+    return {column.name: _json(getattr(row, column.key)) for column in row.__table__.columns}
+
+def changes_since(user_id, since=0, limit=DEFAULT_PAGE, chama_id=None):
+    """One page of changes after cursor `since` that are visible to the user.
+
+    Covers the user's active chamas (or just `chama_id`, to backfill a
+    newly joined one from 0), the user's own memberships even after they
+    end, and only the user's own vote responses.
+    """
+    stamp_pending()
+    chama_ids = [cid for (cid,) in db.session.query(Membership.chama_id).filter(
+        Membership.user_id == user_id, Membership.is_active == True)]
+    if chama_id is not None:
+        chama_ids = [cid for cid in chama_ids if cid == chama_id]
+    visible = or_(
+        and_(SyncChange.chama_id.in_(chama_ids),
+             or_(SyncChange.entity != 'vote_response', SyncChange.user_id == user_id)),
+        and_(SyncChange.entity == 'membership', SyncChange.user_id == user_id),
+    )
+    rows = SyncChange.query.filter(SyncChange.seq > since, visible)\
+        .order_by(SyncChange.seq).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    # Current state of everything that wasn't deleted, one query per table
+    wanted = {}
+    for row in rows:
+        if not row.deleted:
+            wanted.setdefault(row.entity, []).append(row.entity_id)
+    current = {}
+    for table, ids in wanted.items():
+        model = SYNCED[table][0]
+        current.update(((table, obj.id), obj) for obj in model.query.filter(model.id.in_(ids)))
+    names = {}
+    if 'membership' in wanted:
+        member_ids = {current[key].user_id for key in current if key[0] == 'membership'}
+        names = dict(db.session.query(User.id, User.name).filter(User.id.in_(member_ids)))
+
+    changes = []
+    for row in rows:
+        obj = current.get((row.entity, row.entity_id))
+        change = {'seq': row.seq, 'entity': row.entity, 'id': row.entity_id}
+        if obj is None:
+            # Deleted, or deleted by a write whose tombstone isn't stamped yet
+            change['deleted'] = True
+        else:
+            change['data'] = _row_json(obj)
+            if row.entity == 'membership':
+                change['data']['user_name'] = names.get(obj.user_id)
+        changes.append(change)
+
+    return {
+        'changes': changes,
+        'cursor': rows[-1].seq if rows else since,
+        'has_more': has_more,
+    }
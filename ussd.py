@@ -0,0 +1,358 @@
+"""USSD channel for feature phones (Africa's Talking callback).
+
+The gateway POSTs sessionId, phoneNumber and text (every input so far,
+'*'-separated) on each hop and drops the session if the reply takes more
+than a few seconds, so a hop should be a cache read:
+
+- menu state lives in an in-process store keyed by sessionId and each hop
+  only interprets the newest input. A hop that lands on a worker without
+  the session (or after it expired) rebuilds the state by replaying `text`
+  from the main menu; only the last input of a session ever writes. A
+  retried hop gets the previous reply from the worker that answered it;
+  on any other worker the replay reaches the write again, so a
+  contribution carries its sessionId under a unique constraint and is
+  recorded (and pushed) once per session;
+- what the menus show (chamas, amounts paid, balances, what's due, open
+  votes) is built once per member in a fixed number of batched queries
+  and cached for SUMMARY_TTL seconds. Confirming a contribution or voting
+  drops the member's entry.
+
+The phoneNumber in a callback is only trusted once gateway_allowed() has
+checked that the gateway sent it.
+
+A contribution is recorded as pending and the M-Pesa STK push runs on a
+background thread after the reply, so the gateway never waits on
+Safaricom. State is per process, like the other in-memory caches.
+"""
+import hmac
+import ipaddress
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func, or_
+from sqlalchemy.exc import IntegrityError
+
+from archive import all_contributions
+from compliance import owed_to_date, period_starts
+from extensions import db, metrics
+from feed import contribution_made
+from ledger import next_month
+from models import Chama, Contribution, Expense, Membership, User, Vote, VoteOption, VoteResponse
+from utils import ExpiringCache, MPesaService, normalize_kenyan_phone
+from votes import VoteError, get_vote_meta, record_vote
+
+SESSION_TTL = 180  # Africa's Talking ends sessions after ~180s
+SUMMARY_TTL = 60
+MAX_SESSIONS = 50000
+MAX_SUMMARIES = 20000
+# Gateways cut replies at 182 characters
+MAX_SCREEN = 182
+MAX_ITEMS = 5
+NAME_WIDTH = 14
+MIN_AMOUNT = 10
+MAX_AMOUNT = 150000  # M-Pesa STK push limit per transaction
+
+ChamaSummary = namedtuple('ChamaSummary', 'id name contribution_amount frequency paid balance arrears next_due')
+OpenVote = namedtuple('OpenVote', 'id chama_id title vote_type options')
+MemberSummary = namedtuple('MemberSummary', 'user_id name phone_number chamas votes')
+
+_sessions = ExpiringCache(SESSION_TTL, MAX_SESSIONS)
+_summaries = ExpiringCache(SUMMARY_TTL, MAX_SUMMARIES)
+_push_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='stk-push')
+
+# Member summaries
+
+def _next_due(frequency, starts):
+    if not starts:
+        return None
+    return starts[-1] + timedelta(weeks=1) if frequency == 'weekly' else next_month(starts[-1])
+
+def build_member_summaries(user_ids, now=None):
+    """{user_id: MemberSummary} for several members in a fixed number of queries"""
+    now = now or datetime.utcnow()
+    user_ids = list(user_ids)
+    users = db.session.query(User.id, User.name, User.phone_number).filter(User.id.in_(user_ids)).all()
+    memberships = db.session.query(Membership.user_id, Membership.joined_at, Chama)\
+        .join(Chama, Chama.id == Membership.chama_id)\
+        .filter(Membership.user_id.in_(user_ids), Membership.is_active == True)\
+        .order_by(Chama.name).all()
+    chama_ids = sorted({chama.id for _, _, chama in memberships})
+
+    facts = all_contributions()
+    paid = dict(((user_id, chama_id), amount) for user_id, chama_id, amount in
+                db.session.query(facts.c.user_id, facts.c.chama_id, func.sum(facts.c.amount))
+                .filter(facts.c.user_id.in_(user_ids), facts.c.chama_id.in_(chama_ids),
+                        facts.c.status == 'confirmed')
+                .group_by(facts.c.user_id, facts.c.chama_id))
+    income = dict(db.session.query(facts.c.chama_id, func.sum(facts.c.amount))
+                  .filter(facts.c.chama_id.in_(chama_ids), facts.c.status == 'confirmed')
+                  .group_by(facts.c.chama_id).all())
+    spent = dict(db.session.query(Expense.chama_id, func.sum(Expense.amount))
+                 .filter(Expense.chama_id.in_(chama_ids)).group_by(Expense.chama_id).all())
+
+    votes = db.session.query(Vote.id, Vote.chama_id, Vote.title, Vote.vote_type)\
+        .filter(Vote.chama_id.in_(chama_ids), Vote.is_active == True,
+                or_(Vote.closes_at.is_(None), Vote.closes_at >= now))\
+        .order_by(Vote.closes_at, Vote.id).all()
+    vote_ids = [vote.id for vote in votes]
+    options = {}
+    for vote_id, option_id, text in db.session.query(VoteOption.vote_id, VoteOption.id, VoteOption.option_text)\
+            .filter(VoteOption.vote_id.in_(vote_ids)).order_by(VoteOption.id):
+        options.setdefault(vote_id, []).append((option_id, text))
+    voted = set(db.session.query(VoteResponse.user_id, VoteResponse.vote_id)
+                .filter(VoteResponse.vote_id.in_(vote_ids), VoteResponse.user_id.in_(user_ids)))
+
+    periods = {}
+    chamas = {user_id: [] for user_id, _, _ in users}
+    for user_id, joined_at, chama in memberships:
+        starts = periods.get(chama.id)
+        if starts is None:
+            starts = periods[chama.id] = period_starts(chama.contribution_frequency, chama.created_at or now, now)
+        member_paid = paid.get((user_id, chama.id)) or 0
+        owed = owed_to_date(starts, joined_at, chama.contribution_amount)
+        chamas[user_id].append(ChamaSummary(
+            chama.id, chama.name, chama.contribution_amount, chama.contribution_frequency, member_paid,
+            (income.get(chama.id) or 0) - (spent.get(chama.id) or 0), max(0, owed - member_paid),
+            _next_due(chama.contribution_frequency, starts)))
+
+    summaries = {}
+    for user_id, name, phone_number in users:
+        member_chamas = {chama.id for chama in chamas[user_id]}
+        open_votes = [OpenVote(vote.id, vote.chama_id, vote.title, vote.vote_type, options.get(vote.id, []))
+                      for vote in votes if vote.chama_id in member_chamas and (user_id, vote.id) not in voted]
+        summaries[user_id] = MemberSummary(user_id, name, phone_number, chamas[user_id], open_votes)
+    return summaries
+
+def get_member_summary(user_id):
+    """Cached MemberSummary for one member"""
+    summary = _summaries.get(user_id)
+    metrics.record_cache('ussd_summary', summary is not None)
+    if summary is None:
+        summary = build_member_summaries([user_id]).get(user_id)
+        if summary is not None:
+            _summaries.set(user_id, summary)
+    return summary
+
+def invalidate_member_summary(user_id):
+    _summaries.pop(user_id)
+
+# Menus
+
+def _short(name):
+    return name if len(name) <= NAME_WIDTH else name[:NAME_WIDTH - 1] + '.'
+
+def _ksh(amount):
+    return f'KSh {amount:,.0f}'
+
+def _fit(header, lines):
+    """Header plus as many lines as fit on one screen"""
+    screen = header
+    for line in lines:
+        if len(screen) + len(line) + 1 > MAX_SCREEN:
+            break
+        screen += '\n' + line
+    return screen
+
+def _numbered(lines):
+    return '\n'.join(f'{number}. {line}' for number, line in enumerate(lines[:MAX_ITEMS], 1))
+
+def _pick(value, items):
+    """Item chosen by a 1-based menu number, or None"""
+    if value.isdigit() and 1 <= int(value) <= min(len(items), MAX_ITEMS):
+        return items[int(value) - 1]
+    return None
+
+def _main_menu(summary):
+    return f'CON Welcome {_short(summary.name)}\n' + _numbered(['My balance', "What's due", 'Contribute', 'Vote'])
+
+def _balances(summary):
+    if not summary.chamas:
+        return "END You haven't joined a chama yet."
+    return _fit('END Paid by you / chama balance:', [f'{_short(chama.name)}: {chama.paid:,.0f} / {chama.balance:,.0f}'
+                                                     for chama in summary.chamas])
+
+def _dues(summary):
+    if not summary.chamas:
+        return "END You haven't joined a chama yet."
+    lines = []
+    for chama in summary.chamas:
+        line = f'{_short(chama.name)}: {chama.contribution_amount:,.0f}'
+        if chama.next_due:
+            line += f" by {chama.next_due:%d %b}"
+        if chama.arrears:
+            line += f' +{chama.arrears:,.0f} late'
+        lines.append(line)
+    return _fit('END Due (KSh):', lines)
+
+def _ask_amount(chama):
+    return f'CON {_short(chama.name)}\nEnter amount (usual {_ksh(chama.contribution_amount)}):'
+
+def _ask_vote_choice(vote):
+    if vote.vote_type == 'percentage':
+        return f'CON {_short(vote.title)}\nEnter your approval, 0-100:'
+    return f'CON {_short(vote.title)}\n' + _numbered([text for _, text in vote.options])
+
+def _step(state, summary, value):
+    """Apply one input to the session state and return the reply"""
+    screen = state['screen']
+    chamas = {chama.id: chama for chama in summary.chamas}
+
+    if screen == 'main':
+        if value == '1':
+            return _balances(summary)
+        if value == '2':
+            return _dues(summary)
+        if value == '3':
+            if not summary.chamas:
+                return "END You haven't joined a chama yet."
+            if len(summary.chamas) == 1:
+                state.update(screen='amount', chama_id=summary.chamas[0].id)
+                return _ask_amount(summary.chamas[0])
+            state['screen'] = 'chama'
+            return 'CON Contribute to:\n' + _numbered([_short(chama.name) for chama in summary.chamas])
+        if value == '4':
+            if not summary.votes:
+                return 'END There are no open votes for you.'
+            state['screen'] = 'vote'
+            return 'CON Open votes:\n' + _numbered([_short(vote.title) for vote in summary.votes])
+        return 'CON Invalid choice.\n' + _main_menu(summary)[4:]
+
+    if screen == 'chama':
+        chama = _pick(value, summary.chamas)
+        if chama is None:
+            return 'CON Invalid choice.\n' + _numbered([_short(chama.name) for chama in summary.chamas])
+        state.update(screen='amount', chama_id=chama.id)
+        return _ask_amount(chama)
+
+    if screen == 'amount':
+        chama = chamas.get(state['chama_id'])
+        if chama is None:
+            return 'END You are no longer a member of this chama.'
+        if not value.isdigit() or not MIN_AMOUNT <= int(value) <= MAX_AMOUNT:
+            return f'CON Enter an amount between {_ksh(MIN_AMOUNT)} and {_ksh(MAX_AMOUNT)}:'
+        state.update(screen='confirm', amount=int(value))
+        return f'CON Pay {_ksh(int(value))} to {_short(chama.name)} via M-Pesa?\n1. Confirm\n2. Cancel'
+
+    if screen == 'confirm':
+        if value != '1':
+            return 'END Cancelled.'
+        chama = chamas.get(state['chama_id'])
+        if chama is None:
+            return 'END You are no longer a member of this chama.'
+        return _contribute(summary, chama, state['amount'], state['session_id'])
+
+    if screen == 'vote':
+        vote = _pick(value, summary.votes)
+        if vote is None:
+            return 'CON Invalid choice.\n' + _numbered([_short(vote.title) for vote in summary.votes])
+        state.update(screen='ballot', vote_id=vote.id)
+        return _ask_vote_choice(vote)
+
+    if screen == 'ballot':
+        # The vote may have closed or been answered on the web since the last hop
+        vote = next((vote for vote in summary.votes if vote.id == state['vote_id']), None)
+        if vote is None:
+            return 'END This vote is no longer open.'
+        if vote.vote_type == 'percentage':
+            if not value.isdigit() or int(value) > 100:
+                return 'CON Enter a number from 0 to 100:'
+            return _vote(summary, vote, percentage=int(value))
+        option = _pick(value, vote.options)
+        if option is None:
+            return 'CON Invalid choice.\n' + _ask_vote_choice(vote)[4:]
+        return _vote(summary, vote, option_id=option[0])
+
+    return 'END Session expired, please dial again.'
+
+# Writes (always the last hop of a session)
+
+def _stk_push(app, contribution_id, phone_number, amount, account_reference):
+    with app.app_context():
+        result = MPesaService().initiate_stk_push(phone_number, amount, account_reference, 'Chama contribution')
+        if result and result.get('CheckoutRequestID'):
+            Contribution.query.filter_by(id=contribution_id)\
+                .update({'transaction_ref': result['CheckoutRequestID']}, synchronize_session=False)
+            db.session.commit()
+
+def _contribute(summary, chama, amount, session_id):
+    reply = f'END You will get an M-Pesa prompt to pay {_ksh(amount)} to {_short(chama.name)}.'
+    contribution = Contribution(user_id=summary.user_id, chama_id=chama.id, amount=amount,
+                                payment_method='mpesa', transaction_ref='', status='pending',
+                                ussd_session_id=session_id)
+    db.session.add(contribution)
+    try:
+        db.session.flush()
+    except IntegrityError:
+        # A retry of the confirming hop replayed on another worker; the first one recorded and pushed it
+        db.session.rollback()
+        return reply
+    contribution_made(contribution, summary.name)
+    db.session.commit()
+    _push_executor.submit(_stk_push, current_app._get_current_object(), contribution.id,
+                          summary.phone_number, amount, f'CHAMA{chama.id}')
+    return reply
+
+def _vote(summary, vote, option_id=None, percentage=None):
+    meta = get_vote_meta(vote.id)
+    try:
+        record_vote(vote.id, summary.user_id, meta, option_id, percentage)
+        db.session.commit()
+    except VoteError as e:
+        db.session.rollback()
+        return f'END {e}'
+    finally:
+        invalidate_member_summary(summary.user_id)
+    return 'END Your vote has been recorded. Thank you!'
+
+# Gateway callback
+
+def gateway_allowed(request):
+    """Whether a callback came from the gateway: the secret key on the callback URL and/or an allowed address.
+
+    With neither USSD_CALLBACK_SECRET nor USSD_ALLOWED_IPS configured every
+    callback is refused, since the phoneNumber it carries is taken on trust.
+    """
+    secret = current_app.config.get('USSD_CALLBACK_SECRET')
+    networks = current_app.config.get('USSD_ALLOWED_IPS')
+    if not secret and not networks:
+        return False
+    if secret and not hmac.compare_digest(request.args.get('key', '').encode(), secret.encode()):
+        return False
+    if networks:
+        try:
+            address = ipaddress.ip_address(request.remote_addr or '')
+        except ValueError:
+            return False
+        return any(address in ipaddress.ip_network(network, strict=False) for network in networks)
+    return True
+
+def handle_ussd(session_id, phone_number, text):
+    """Process one gateway hop and return the reply, starting with CON or END"""
+    inputs = text.split('*') if text else []
+    state = _sessions.get(session_id)
+    if state is not None and state['hops'] == len(inputs):
+        # The gateway retried a hop we already answered
+        return state['reply']
+
+    if state is None or state['hops'] != len(inputs) - 1:
+        phone_e164 = normalize_kenyan_phone(phone_number)
+        user_id = db.session.query(User.id).filter(User.phone_e164 == phone_e164).scalar() if phone_e164 else None
+        if user_id is None:
+            return 'END This number is not registered on ChamaStack.'
+        state = {'session_id': session_id, 'user_id': user_id, 'screen': 'main', 'hops': 0}
+        pending = inputs
+    else:
+        pending = inputs[-1:]
+
+    summary = get_member_summary(state['user_id'])
+    reply = _main_menu(summary) if not inputs else None
+    for value in pending:
+        reply = _step(state, summary, value.strip())
+        state['hops'] += 1
+        if reply.startswith('END'):
+            break
+    state['reply'] = reply
+    _sessions.set(session_id, state)
+    return reply
@@ -1,18 +1,78 @@
+import os
 import secrets
 import string
 from datetime import datetime, timedelta
-import africastalking
 from flask import current_app
-import requests
 import base64
 import json
 import re
+import threading
+import time
+from collections import OrderedDict
+
+from outbound import OutboundError, get_client
+
+# Everything but digits and '+', then an optional 254/+254/0 prefix and a 9-digit 7xx/1xx mobile number
+_PHONE_JUNK = re.compile(r'[^\d+]')
+_KENYAN_MOBILE = re.compile(r'(?:\+?254|0)?([17]\d{8})')
+
+# SMS SDK clients, built on first use and shared for the life of the process; HTTP goes through outbound.py
+_sms_clients = {}
+
+def _reset_clients():
+    """Forget clients inherited from the parent process after a fork"""
+    _sms_clients.clear()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_clients)
+
+def get_sms_client(username, api_key):
+    """Return the Africa's Talking SMS client, initializing the SDK once per process"""
+    key = (username, api_key)
+    if key not in _sms_clients:
+        import africastalking
+        africastalking.initialize(username, api_key)
+        _sms_clients[key] = africastalking.SMS
+    return _sms_clients[key]
+
+class ExpiringCache:
+    """LRU mapping whose entries expire `ttl` seconds after they were last stored"""
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < now:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def pop(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
 
 def generate_join_code(length=8):
     """Generate a unique join code for chamas"""
     characters = string.ascii_uppercase + string.digits
     # Exclude confusing characters
-    characters = characters.replace('0', '').replace('O', '').replace('I', '').replace('1')
+    characters = characters.replace('0', '').replace('O', '').replace('I', '').replace('1', '')
     return ''.join(secrets.choice(characters) for _ in range(length))
 
 def format_kenyan_phone(phone_number):
@@ -37,21 +97,34 @@ class SMSService:
         self.username = current_app.config.get('AFRICASTALKING_USERNAME')
         self.api_key = current_app.config.get('AFRICASTALKING_API_KEY')
         
-        if self.username and self.api_key:
-            africastalking.initialize(self.username, self.api_key)
-            self.sms = africastalking.SMS
+        self._sms = None
+    
+    @property
+    def sms(self):
+        if self._sms is None:
+            self._sms = get_sms_client(self.username, self.api_key)
+        return self._sms
     
     def send_sms(self, phone_number, message):
         """Send SMS to a phone number"""
+        if not self.username or not self.api_key:
+            current_app.logger.info('SMS not configured. Would send: %s to %s', message, phone_number)
+            return True
+        
+        # Sending isn't idempotent, so only a connect timeout is retried
+        from africastalking.Service import AfricasTalkingException
+        recipients = [format_kenyan_phone(phone_number)]
         try:
-            if not self.username or not self.api_key:
-                print(f"SMS not configured. Would send: {message} to {phone_number}")
-                return True
-            
-            response = self.sms.send(message, [format_kenyan_phone(phone_number)])
+            response = get_client('sms').call(
+                'send', lambda timeout: self.sms.send(message, recipients, timeout=timeout),
+                errors=(AfricasTalkingException,))
             return response['SMSMessageData']['Recipients'][0]['status'] == 'Success'
-        except Exception as e:
-            print(f"SMS sending failed: {e}")
+        except OutboundError as e:
+            current_app.logger.warning('SMS sending failed: %s', e)
+            return False
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            # Rejected number, or a response without the expected recipient status
+            current_app.logger.warning('SMS sending failed: %r', e)
             return False
     
     def send_contribution_reminder(self, user, chama):
@@ -78,34 +151,33 @@ class MPesaService:
         self.shortcode = current_app.config.get('MPESA_SHORTCODE')
         self.passkey = current_app.config.get('MPESA_PASSKEY')
         
-        self.base_url = "https://sandbox.safaricom.co.ke"  # Use production URL in production
+        # Use production URL in production
+        self.base_url = current_app.config.get('MPESA_BASE_URL') or "https://sandbox.safaricom.co.ke"
     
     def get_access_token(self):
         """Get OAuth access token from Safaricom"""
+        url = f"{self.base_url}/oauth/v1/generate?grant_type=client_credentials"
+        
+        # Create basic auth header
+        auth_string = f"{self.consumer_key}:{self.consumer_secret}"
+        auth_bytes = auth_string.encode('ascii')
+        auth_b64 = base64.b64encode(auth_bytes).decode('ascii')
+        
+        headers = {
+            'Authorization': f'Basic {auth_b64}',
+            'Content-Type': 'application/json'
+        }
+        
         try:
-            url = f"{self.base_url}/oauth/v1/generate?grant_type=client_credentials"
-            
-            # Create basic auth header
-            auth_string = f"{self.consumer_key}:{self.consumer_secret}"
-            auth_bytes = auth_string.encode('ascii')
-            auth_b64 = base64.b64encode(auth_bytes).decode('ascii')
-            
-            headers = {
-                'Authorization': f'Basic {auth_b64}',
-                'Content-Type': 'application/json'
-            }
-            
-            response = requests.get(url, headers=headers)
-            
+            response = get_client('mpesa').request('oauth', 'GET', url, headers=headers)
             if response.status_code == 200:
                 return response.json()['access_token']
-            else:
-                print(f"Failed to get access token: {response.text}")
-                return None
-                
-        except Exception as e:
-            print(f"Error getting access token: {e}")
-            return None
+            current_app.logger.warning('Failed to get access token: HTTP %s %s', response.status_code, response.text)
+        except OutboundError as e:
+            current_app.logger.warning('Error getting access token: %s', e)
+        except (ValueError, KeyError) as e:
+            current_app.logger.warning('Unexpected access token response: %r', e)
+        return None
     
     def initiate_stk_push(self, phone_number, amount, account_reference, transaction_desc):
         """Initiate STK Push for payment"""
@@ -113,43 +185,42 @@ class MPesaService:
         if not access_token:
             return None
         
+        url = f"{self.base_url}/mpesa/stkpush/v1/processrequest"
+        
+        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+        password_string = f"{self.shortcode}{self.passkey}{timestamp}"
+        password = base64.b64encode(password_string.encode()).decode('utf-8')
+        
+        headers = {
+            'Authorization': f'Bearer {access_token}',
+            'Content-Type': 'application/json'
+        }
+        
+        payload = {
+            "BusinessShortCode": self.shortcode,
+            "Password": password,
+            "Timestamp": timestamp,
+            "TransactionType": "CustomerPayBillOnline",
+            "Amount": int(amount),
+            "PartyA": format_kenyan_phone(phone_number).replace('+', ''),
+            "PartyB": self.shortcode,
+            "PhoneNumber": format_kenyan_phone(phone_number).replace('+', ''),
+            "CallBackURL": "https://your-domain.com/api/mpesa/callback",  # Update with your domain
+            "AccountReference": account_reference,
+            "TransactionDesc": transaction_desc
+        }
+        
+        # A repeated push would prompt the customer twice, so only a connect timeout is retried
         try:
-            url = f"{self.base_url}/mpesa/stkpush/v1/processrequest"
-            
-            timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-            password_string = f"{self.shortcode}{self.passkey}{timestamp}"
-            password = base64.b64encode(password_string.encode()).decode('utf-8')
-            
-            headers = {
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': 'application/json'
-            }
-            
-            payload = {
-                "BusinessShortCode": self.shortcode,
-                "Password": password,
-                "Timestamp": timestamp,
-                "TransactionType": "CustomerPayBillOnline",
-                "Amount": int(amount),
-                "PartyA": format_kenyan_phone(phone_number).replace('+', ''),
-                "PartyB": self.shortcode,
-                "PhoneNumber": format_kenyan_phone(phone_number).replace('+', ''),
-                "CallBackURL": "https://your-domain.com/api/mpesa/callback",  # Update with your domain
-                "AccountReference": account_reference,
-                "TransactionDesc": transaction_desc
-            }
-            
-            response = requests.post(url, json=payload, headers=headers)
-            
+            response = get_client('mpesa').request('stk_push', 'POST', url, json=payload, headers=headers)
             if response.status_code == 200:
                 return response.json()
-            else:
-                print(f"STK Push failed: {response.text}")
-                return None
-                
-        except Exception as e:
-            print(f"Error initiating STK push: {e}")
-            return None
+            current_app.logger.warning('STK Push failed: HTTP %s %s', response.status_code, response.text)
+        except OutboundError as e:
+            current_app.logger.warning('Error initiating STK push: %s', e)
+        except ValueError as e:
+            current_app.logger.warning('Unexpected STK push response: %r', e)
+        return None
 
 def calculate_next_contribution_date(chama, last_contribution_date=None):
     """Calculate when the next contribution is due"""
@@ -167,37 +238,30 @@ def calculate_next_contribution_date(chama, last_contribution_date=None):
 def get_contribution_summary(chama, user=None, period='month'):
     """Get contribution summary for a chama or user"""
     # Import here to avoid circular imports
-    try:
-        from models import Contribution
-    except ImportError:
-        try:
-            from .models import Contribution
-        except ImportError:
-            # If running as a script or different structure
-            import sys
-            import os
-            sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-            from models import Contribution
-    
     from sqlalchemy import func, extract
     
-    query = Contribution.query.filter_by(chama_id=chama.id, status='confirmed')
+    from archive import all_contributions
+    from extensions import db
+    
+    # Hot rows plus the summaries of archived months
+    facts = all_contributions()
+    query = db.session.query(facts).filter(facts.c.chama_id == chama.id, facts.c.status == 'confirmed')
     
     if user:
-        query = query.filter_by(user_id=user.id)
+        query = query.filter(facts.c.user_id == user.id)
     
     # Filter by period
     now = datetime.now()
     if period == 'month':
         query = query.filter(
-            extract('month', Contribution.contributed_at) == now.month,
-            extract('year', Contribution.contributed_at) == now.year
+            extract('month', facts.c.contributed_at) == now.month,
+            extract('year', facts.c.contributed_at) == now.year
         )
     elif period == 'year':
-        query = query.filter(extract('year', Contribution.contributed_at) == now.year)
+        query = query.filter(extract('year', facts.c.contributed_at) == now.year)
     
-    total = query.with_entities(func.sum(Contribution.amount)).scalar() or 0
-    count = query.count()
+    total, count = query.with_entities(func.coalesce(func.sum(facts.c.amount), 0),
+                                       func.coalesce(func.sum(facts.c.entries), 0)).one()
     
     return {
         'total_amount': total,
@@ -205,21 +269,23 @@ def get_contribution_summary(chama, user=None, period='month'):
         'average_contribution': total / count if count > 0 else 0
     }
 
+def normalize_kenyan_phone(phone_number):
+    """Canonical E.164 form (+2547XXXXXXXX) of a Kenyan mobile number, or None if invalid"""
+    if not phone_number:
+        return None
+    match = _KENYAN_MOBILE.fullmatch(_PHONE_JUNK.sub('', phone_number))
+    return '+254' + match.group(1) if match else None
+
+def normalize_kenyan_phones(phone_numbers):
+    """Canonical forms for a batch of numbers (None where invalid), in input order"""
+    strip, fullmatch = _PHONE_JUNK.sub, _KENYAN_MOBILE.fullmatch
+    normalized = []
+    append = normalized.append
+    for phone_number in phone_numbers:
+        match = fullmatch(strip('', phone_number)) if phone_number else None
+        append('+254' + match.group(1) if match else None)
+    return normalized
+
 def validate_kenyan_phone(phone_number):
     """Validate Kenyan phone number format"""
-    # Remove any non-digit characters except +
-    cleaned = re.sub(r'[^\d+]', '', phone_number)
-    
-    # Check various valid formats
-    patterns = [
-        r'^\+254[17]\d{8}$',  # +254701234567 or +254712345678
-        r'^254[17]\d{8}$',    # 254701234567
-        r'^0[17]\d{8}$',      # 0701234567
-        r'^[17]\d{8}$'        # 701234567
-    ]
-    
-    for pattern in patterns:
-        if re.match(pattern, cleaned):
-            return True
-    
-    return False
\ No newline at end of file
+    return normalize_kenyan_phone(phone_number) is not None
@@ -0,0 +1,86 @@
+"""Vote submission.
+
+A response is recorded with a single INSERT ... SELECT ... ON CONFLICT DO
+NOTHING: the SELECT only yields a row while the vote is open, and the
+unique (vote_id, user_id) constraint makes a second submission a no-op, so
+concurrent double-clicks can't record two responses and there is no
+check-then-insert window. Options are validated against a per-process
+cache of each vote's option ids (options never change once a vote is
+created); only a rejected insert costs a follow-up query to say why.
+"""
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+
+from sqlalchemy import DateTime, Integer, exists, literal, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from extensions import db, metrics
+from models import Vote, VoteOption, VoteResponse
+
+VoteMeta = namedtuple('VoteMeta', 'chama_id vote_type option_ids')
+
+class VoteError(ValueError):
+    pass
+
+_meta_cache = OrderedDict()
+_meta_lock = threading.Lock()
+MAX_CACHED_VOTES = 5000
+
+def get_vote_meta(vote_id):
+    """Chama, type and option ids of a vote, cached per process; None if it doesn't exist"""
+    with _meta_lock:
+        meta = _meta_cache.get(vote_id)
+        if meta is not None:
+            _meta_cache.move_to_end(vote_id)
+    metrics.record_cache('vote_options', meta is not None)
+    if meta is not None:
+        return meta
+
+    vote = db.session.query(Vote.chama_id, Vote.vote_type).filter(Vote.id == vote_id).first()
+    if vote is None:
+        return None
+    option_ids = frozenset(option_id for (option_id,) in
+                           db.session.query(VoteOption.id).filter(VoteOption.vote_id == vote_id))
+    meta = VoteMeta(vote.chama_id, vote.vote_type, option_ids)
+    with _meta_lock:
+        _meta_cache[vote_id] = meta
+        if len(_meta_cache) > MAX_CACHED_VOTES:
+            _meta_cache.popitem(last=False)
+    return meta
+
+def _insert():
+    if db.engine.dialect.name == 'postgresql':
+        return postgresql.insert(VoteResponse)
+    return sqlite.insert(VoteResponse)
+
+def record_vote(vote_id, user_id, meta, option_id=None, percentage=None):
+    """Record a user's response exactly once. Raises VoteError if it was not recorded.
+
+    The caller commits.
+    """
+    if meta.vote_type == 'percentage':
+        if percentage is None or not 0 <= percentage <= 100:
+            raise VoteError('Please enter a valid percentage between 0 and 100')
+        option_id = None
+    else:
+        if option_id is None:
+            raise VoteError('Please select an option')
+        if option_id not in meta.option_ids:
+            raise VoteError('Invalid option')
+        percentage = None
+
+    now = datetime.utcnow()
+    is_open = exists().where(Vote.id == vote_id, Vote.is_active == True,
+                             or_(Vote.closes_at.is_(None), Vote.closes_at >= now))
+    row = select(literal(vote_id, Integer), literal(user_id, Integer), literal(option_id, Integer),
+                 literal(percentage, Integer), literal(now, DateTime)).where(is_open)
+    statement = _insert().from_select(
+        ['vote_id', 'user_id', 'option_id', 'percentage', 'responded_at'], row
+    ).on_conflict_do_nothing(index_elements=['vote_id', 'user_id'])
+    if db.session.execute(statement).rowcount == 1:
+        return
+
+    # Nothing inserted: either an earlier response exists or the vote is closed
+    already = db.session.query(VoteResponse.id).filter_by(vote_id=vote_id, user_id=user_id).first()
+    raise VoteError('You have already voted' if already else 'Voting has closed')